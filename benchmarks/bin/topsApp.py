@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+"""Stand-in for ISCE's topsApp.py that sleeps and writes scratch data instead of processing
+
+Configured with environment variables:
+    BENCHMARK_TOPSAPP_SLEEP  Seconds to sleep for each run (default 0)
+    BENCHMARK_TOPSAPP_BYTES  Bytes of scratch data to write for each run (default 0)
+    BENCHMARK_RASTER_BYTES   Size of each merged raster written by the geocode step (default 256 KB)
+
+Runs that include the geocode step leave an isce.log and merged outputs behind, like topsApp.
+"""
+
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fixtures  # noqa: E402
+
+
+def main():
+    steps = ' '.join(sys.argv[1:])
+    time.sleep(float(os.environ.get('BENCHMARK_TOPSAPP_SLEEP', 0)))
+
+    scratch_bytes = int(os.environ.get('BENCHMARK_TOPSAPP_BYTES', 0))
+    if scratch_bytes:
+        name = 'scratch_{}.bin'.format(re.sub(r'\W+', '_', steps) or 'all')
+        with open(name, 'wb') as f:
+            f.write(os.urandom(scratch_bytes))
+
+    if not steps or 'geocode' in steps:
+        swath = re.sub(r'\D', '', os.path.basename(os.getcwd())) or '1'
+        fixtures.write_pair_outputs('.', swath, raster_bytes=int(os.environ.get('BENCHMARK_RASTER_BYTES', 256 * 1024)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""Synthetic Sentinel-1 SAFE files, orbit files and ISCE outputs for benchmarking the drivers
+
+The files have the names and the parts of the structure the drivers read (annotation
+orbits, geolocation grids, headings and burst lists, isce.log lines and merged outputs),
+but contain no real data.
+"""
+
+import os
+from datetime import datetime, timedelta
+
+# Sentinel-1 repeat cycle and the length of a scene
+REPEAT_DAYS = 12
+SCENE_SECONDS = 27
+
+FIRST_SCENE = datetime(2016, 4, 8, 9, 13, 55)
+
+# Outputs of topsApp in the merged directory of a pair
+MERGED_FILES = (
+    'colorized_unw.png', 'colorized_unw.png.aux.xml', 'colorized_unw_large.png', 'colorized_unw_large.png.aux.xml',
+    'colorized_unw.kmz', 'color.png', 'color.png.aux.xml', 'color_large.png', 'color_large.png.aux.xml',
+    'color.kmz', 'phase.tif', 'amp.tif', 'coherence.tif',
+)
+
+ISCE_LOG = """\
+{time} - isce.topsinsar.runPreprocessor - INFO - Preprocessing
+topsinsar.subset.Overlap.IW-{swath}.start time = {overlap}
+topsinsar.baseline.Bperp at midrange for first common burst = {baseline:.4f}
+topsinsar.geocode.Azimuth looks = 7
+topsinsar.geocode.Range looks = 19
+"""
+
+
+# Sentinel-1 IW burst cycle
+BURST_SECONDS = 2.758273
+
+# Seconds from the ascending node to the start of the first scene
+ANX_SECONDS = 1620
+
+MANIFEST = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<xfdu:XFDU xmlns:xfdu="urn:ccsds:schema:xfdu:1" xmlns:s1="http://www.esa.int/safe/sentinel-1.0/sentinel-1">
+<s1:ascendingNodeTime>{anx_time:%Y-%m-%dT%H:%M:%S.%f}</s1:ascendingNodeTime>
+</xfdu:XFDU>
+"""
+
+
+def scene_start(index):
+    return FIRST_SCENE + timedelta(days=REPEAT_DAYS * index, seconds=index % 3)
+
+
+def safe_name(start, mission='S1A'):
+    stop = start + timedelta(seconds=SCENE_SECONDS)
+    return '{}_IW_SLC__1SSV_{:%Y%m%dT%H%M%S}_{:%Y%m%dT%H%M%S}_010728_01001F_83EB.SAFE'.format(mission, start, stop)
+
+
+def _annotation(start, swath, bursts, orbit_offset):
+    stop = start + timedelta(seconds=SCENE_SECONDS)
+    orbits = ''.join(
+        '<orbit><time>{:%Y-%m-%dT%H:%M:%S.%f}</time><frame>Earth Fixed</frame>'
+        '<position><x>{:.3f}</x><y>{:.3f}</y><z>{:.3f}</z></position>'
+        '<velocity><x>-1500.0</x><y>1200.0</y><z>7300.0</z></velocity></orbit>'.format(
+            start + timedelta(seconds=t), 5.0e6 - 1500.0 * t, 1.0e6 + 1200.0 * t + orbit_offset, 4.5e6 + 7300.0 * t,
+        )
+        for t in range(-60, 90, 10)
+    )
+    west = -120.0 + 0.8 * (swath - 1)
+    points = ''.join(
+        '<geolocationGridPoint><azimuthTime>{:%Y-%m-%dT%H:%M:%S.%f}</azimuthTime>'
+        '<line>{}</line><pixel>{}</pixel><latitude>{:.6f}</latitude><longitude>{:.6f}</longitude>'
+        '<height>100.0</height></geolocationGridPoint>'.format(
+            start + timedelta(seconds=SCENE_SECONDS * line / 9), line * 1500, pixel * 1000,
+            35.0 + 1.7 * line / 9, west + 0.9 * pixel / 20,
+        )
+        for line in range(10) for pixel in range(21)
+    )
+    burst_list = ''.join(
+        '<burst><azimuthTime>{:%Y-%m-%dT%H:%M:%S.%f}</azimuthTime><byteOffset>{}</byteOffset></burst>'.format(
+            start + timedelta(seconds=BURST_SECONDS * burst), burst * 130000000,
+        )
+        for burst in range(bursts)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<product>'
+        '<adsHeader><missionId>S1A</missionId><swath>IW{swath}</swath>'
+        '<startTime>{start:%Y-%m-%dT%H:%M:%S.%f}</startTime><stopTime>{stop:%Y-%m-%dT%H:%M:%S.%f}</stopTime>'
+        '</adsHeader><generalAnnotation><productInformation><platformHeading>-1.699e+01</platformHeading>'
+        '</productInformation><orbitList count="{count}">{orbits}</orbitList></generalAnnotation>'
+        '<swathTiming><linesPerBurst>1500</linesPerBurst><burstList count="{bursts}">{burst_list}</burstList>'
+        '</swathTiming>'
+        '<geolocationGrid><geolocationGridPointList>{points}</geolocationGridPointList></geolocationGrid>'
+        '</product>\n'
+    ).format(swath=swath, start=start, stop=stop, count=15, orbits=orbits, bursts=bursts, burst_list=burst_list,
+             points=points)
+
+
+def write_safe(directory, start, measurement_bytes=0, bursts=9, orbit_offset=0.0, anx_time=None):
+    """Write a synthetic SAFE directory with a manifest, and annotation and measurement files for all three subswaths
+
+    Measurement files are sparse, so large ones cost no disk space unless they're read.
+    """
+    name = safe_name(start)
+    safe = os.path.join(directory, name)
+    os.makedirs(os.path.join(safe, 'annotation'))
+    os.makedirs(os.path.join(safe, 'measurement'))
+    with open(os.path.join(safe, 'manifest.safe'), 'w') as f:
+        f.write(MANIFEST.format(anx_time=anx_time or start - timedelta(seconds=ANX_SECONDS)))
+
+    for swath in (1, 2, 3):
+        base = 's1a-iw{}-slc-vv-{:%Y%m%dt%H%M%S}-{:%Y%m%dt%H%M%S}-010728-01001f-00{}'.format(
+            swath, start, start + timedelta(seconds=SCENE_SECONDS), swath,
+        )
+        with open(os.path.join(safe, 'annotation', base + '.xml'), 'w') as f:
+            f.write(_annotation(start, swath, bursts, orbit_offset))
+        with open(os.path.join(safe, 'measurement', base + '.tiff'), 'wb') as f:
+            f.truncate(measurement_bytes)
+    return name
+
+
+def write_orbit_file(directory, start):
+    """Write a precise orbit file covering the day of a scene"""
+    day = datetime(start.year, start.month, start.day)
+    name = 'S1A_OPER_AUX_POEORB_OPOD_{:%Y%m%dT%H%M%S}_V{:%Y%m%dT%H%M%S}_{:%Y%m%dT%H%M%S}.EOF'.format(
+        day + timedelta(days=20), day - timedelta(seconds=3617), day + timedelta(days=1, seconds=3583),
+    )
+    with open(os.path.join(directory, name), 'w') as f:
+        f.write('<Earth_Explorer_File></Earth_Explorer_File>\n')
+    return name
+
+
+def write_stack(directory, scenes, measurement_bytes=0):
+    """Write the SAFE files of a stack to a directory and their orbit files to its orbits subdirectory"""
+    orbit_dir = os.path.join(directory, 'orbits')
+    os.makedirs(orbit_dir, exist_ok=True)
+    names = []
+    for index in range(scenes):
+        start = scene_start(index)
+        # Every scene is acquired at the same place in the orbit, give or take a couple of seconds
+        anx_time = FIRST_SCENE + timedelta(days=REPEAT_DAYS * index, seconds=-ANX_SECONDS)
+        names.append(write_safe(directory, start, measurement_bytes=measurement_bytes, orbit_offset=20.0 * index,
+                                anx_time=anx_time))
+        write_orbit_file(orbit_dir, start)
+    return names
+
+
+def write_pair_outputs(pair_dir, swath, raster_bytes=256 * 1024, baseline=42.0):
+    """Write the isce.log and merged outputs topsApp leaves in the directory of a processed pair"""
+    merged = os.path.join(pair_dir, 'merged')
+    os.makedirs(merged, exist_ok=True)
+    with open(os.path.join(pair_dir, 'isce.log'), 'w') as f:
+        f.write(ISCE_LOG.format(time=datetime.now(), swath=swath, overlap=FIRST_SCENE + timedelta(seconds=8.5),
+                                baseline=baseline))
+    for name in MERGED_FILES:
+        size = raster_bytes if name.endswith(('.tif', '.png', '.kmz')) else 512
+        # Random, so the outputs are as incompressible as the real, already compressed, ones
+        with open(os.path.join(merged, name), 'wb') as f:
+            f.write(os.urandom(size))
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+"""Time the stack drivers over synthetic stacks and compare against a stored baseline
+
+Each benchmark runs over synthetic stacks of every requested size, in a fresh temporary
+directory, and the fastest of `--repeat` runs is kept. topsApp.py is replaced by the stand-in
+in benchmarks/bin and GeoTIFF conversion by a no-op, so the timings are the overhead of the
+drivers themselves: XML generation, orbit handling, scheduling, collection, metadata and
+packaging.
+
+    python benchmarks/run.py --sizes 3 10 50 200
+    python benchmarks/run.py --save-baseline
+
+Benchmarks whose dependencies (GDAL for the stack drivers) aren't installed are skipped, and
+a saved baseline lists them with the reason, next to a description of the machine.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Benchmark the source tree this script is in, not whatever version is installed
+sys.path[:0] = [HERE, os.path.dirname(HERE)]
+
+import fixtures  # noqa: E402
+
+BASELINE = os.path.join(HERE, 'baseline.json')
+SIZES = (3, 10, 50, 200)
+
+
+class Skip(Exception):
+    """A benchmark can't run in this environment"""
+
+
+def pairs_of(scenes):
+    """The default stack network: each scene with its next two"""
+    return [(i, j) for i in range(scenes) for j in (i + 1, i + 2) if j < scenes]
+
+
+def pair_dir(names, i, j):
+    """The directory the stack driver processes a pair in, named by the dates of its scenes"""
+    return '{}_{}'.format(names[i][17:32], names[j][17:32])
+
+
+def stack_driver():
+    try:
+        from hyp3_insar_isce import proc_s1_stack_isce
+    except ImportError as e:
+        raise Skip(str(e))
+    # The synthetic outputs are already "converted"; GDAL has nothing to read in them
+    proc_s1_stack_isce.convert_merged = lambda merged_dir, proj, output_format=None: None
+    return proc_s1_stack_isce
+
+
+def write_processed_pairs(names, raster_bytes):
+    """Lay out the pairs of a stack as topsApp leaves them, with topsApp.xml, isce.log and merged outputs"""
+    from lxml import etree
+
+    template = etree.parse(os.path.join(HERE, '..', 'hyp3_insar_isce', 'etc', 'isceS1template.xml'))
+    for i, j in pairs_of(len(names)):
+        isce_dir = os.path.join(pair_dir(names, i, j), 'iw1')
+        os.makedirs(isce_dir)
+        for comp in template.findall('component/component'):
+            for prop in comp.findall('property'):
+                if prop.attrib['name'] == 'safe':
+                    prop.text = os.path.abspath(names[i] if comp.attrib['name'] == 'master' else names[j])
+        template.write(os.path.join(isce_dir, 'topsApp.xml'))
+        fixtures.write_pair_outputs(isce_dir, 1, raster_bytes=raster_bytes)
+
+
+def bench_xml(scenes, args):
+    """Pair directory setup: orbit files linked from a warm cache and a topsApp.xml for every pair"""
+    from hyp3_insar_isce.orbit_cache import OrbitCache
+    from hyp3_insar_isce.topsapp_xml import TopsAppTemplate, write_pair_xmls
+
+    names = fixtures.write_stack('.', scenes)
+    cache = OrbitCache('orbit_cache', source_dir='orbits')
+    # Fetching orbit files is the separate orbits stage; time looking them up in a warm cache
+    cache.prefetch(names)
+
+    start = time.perf_counter()
+    orbit_files = cache.prefetch(names)
+    template = TopsAppTemplate(unwrap=True, gbb=(35.0, 36.7, -120.0, -119.1))
+    write_pair_xmls(template, [(pair_dir(names, i, j), names[i], names[j]) for i, j in pairs_of(scenes)], 1,
+                    orbit_files)
+    return time.perf_counter() - start
+
+
+def bench_metadata(scenes, args):
+    """make_metadata_file for every pair"""
+    driver = stack_driver()
+    names = fixtures.write_stack('.', scenes)
+    write_processed_pairs(names, raster_bytes=1024)
+    os.mkdir('PRODUCT')
+
+    start = time.perf_counter()
+    for i, j in pairs_of(scenes):
+        driver.make_metadata_file(pair_dir(names, i, j), 'iw1')
+    return time.perf_counter() - start
+
+
+def bench_collect(scenes, args):
+    """get_image_files for every pair, without the GeoTIFF conversion"""
+    driver = stack_driver()
+    names = fixtures.write_stack('.', scenes)
+    write_processed_pairs(names, raster_bytes=args.raster_bytes)
+    os.mkdir('PRODUCT')
+    options = {'west': -120.0, 'east': -119.1, 'south': 35.0, 'north': 36.7, 'metrics': driver.Metrics(log=len)}
+
+    start = time.perf_counter()
+    for i, j in pairs_of(scenes):
+        driver.get_image_files(pair_dir(names, i, j), 'iw1', options)
+    return time.perf_counter() - start
+
+
+def bench_stack(scenes, args):
+    """proc_s1_stack_isce end to end, with the stand-in topsApp.py"""
+    from hyp3_insar_isce import planner
+    from hyp3_insar_isce.orbit_cache import OrbitCache
+
+    driver = stack_driver()
+    fixtures.write_stack('.', scenes)
+    # The driver can only download orbit files, so put the synthetic ones in its cache
+    cache = OrbitCache('orbit_cache')
+    for name in os.listdir('orbits'):
+        cache.add(os.path.join('orbits', name))
+
+    # The stand-in topsApp.py writes next to nothing, so plan for that rather than for real pairs
+    with open('planner_model.json', 'w') as f:
+        json.dump({'stages': {stage: {'scratch_bytes': 0.0, 'memory_bytes': 0.0, 'cpu_seconds': 0.0}
+                              for stage in planner.STAGES}}, f)
+
+    start = time.perf_counter()
+    driver.proc_s1_stack_isce(ss=1, workers=args.workers, orbit_cache_dir='orbit_cache',
+                              plan_model='planner_model.json')
+    return time.perf_counter() - start
+
+
+def bench_package(scenes, args):
+    """Zipping the PRODUCT directory of a stack"""
+    from hyp3_insar_isce.archive import zip_dir
+
+    product_dir = 'PRODUCT'
+    for i, j in pairs_of(scenes):
+        fixtures.write_pair_outputs('pair', 1, raster_bytes=args.raster_bytes)
+        for name in os.listdir(os.path.join('pair', 'merged')):
+            os.renames(os.path.join('pair', 'merged', name), os.path.join(product_dir, '{}_{}_{}'.format(i, j, name)))
+
+    start = time.perf_counter()
+    zip_dir(product_dir, 'product.zip')
+    return time.perf_counter() - start
+
+
+BENCHMARKS = {
+    'xml': bench_xml,
+    'metadata': bench_metadata,
+    'collect': bench_collect,
+    'stack': bench_stack,
+    'package': bench_package,
+}
+
+
+def run(benchmark, scenes, args):
+    """Run a benchmark in a fresh directory, returning the fastest of its repeats in seconds"""
+    timings = []
+    for _ in range(args.repeat):
+        back = os.getcwd()
+        work_dir = tempfile.mkdtemp(prefix='hyp3-benchmark-', dir=args.work_dir)
+        os.chdir(work_dir)
+        try:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                timings.append(BENCHMARKS[benchmark](scenes, args))
+        finally:
+            os.chdir(back)
+            shutil.rmtree(work_dir)
+    return min(timings)
+
+
+def machine():
+    """Describe the machine the benchmarks run on, to record with a baseline"""
+    processor = platform.processor()
+    if os.path.exists('/proc/cpuinfo'):
+        with open('/proc/cpuinfo') as f:
+            processor = next((line.split(':', 1)[1].strip() for line in f if line.startswith('model name')),
+                             processor)
+    try:
+        from osgeo import gdal
+        gdal_version = getattr(gdal, '__version__', None)
+    except ImportError:
+        gdal_version = None
+    return {
+        'platform': platform.platform(),
+        'processor': processor,
+        'cpus': len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count(),
+        'memory_gb': round(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024 ** 3, 1),
+        'python': platform.python_version(),
+        'gdal': gdal_version,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print the results next to the baseline, returning the benchmarks slower than it by more than tolerance"""
+    regressions = []
+    print('{:<10} {:>6} {:>10} {:>10} {:>8}'.format('benchmark', 'scenes', 'seconds', 'baseline', 'ratio'))
+    for benchmark, timings in results.items():
+        for scenes, seconds in timings.items():
+            reference = baseline.get(benchmark, {}).get(scenes)
+            if seconds is None:
+                print('{:<10} {:>6} {:>10}'.format(benchmark, scenes, 'skipped'))
+                continue
+            if reference is None:
+                print('{:<10} {:>6} {:>10.3f} {:>10}'.format(benchmark, scenes, seconds, '-'))
+                continue
+            ratio = seconds / reference
+            flag = ''
+            if ratio > 1 + tolerance:
+                regressions.append((benchmark, scenes))
+                flag = ' REGRESSION'
+            print('{:<10} {:>6} {:>10.3f} {:>10.3f} {:>8.2f}{}'.format(benchmark, scenes, seconds, reference, ratio,
+                                                                       flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('benchmarks', nargs='*', default=list(BENCHMARKS),
+                        help='Benchmarks to run, of {}; all of them by default'.format(', '.join(BENCHMARKS)))
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES, help='Numbers of scenes in the stacks')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each benchmark to keep the fastest of')
+    parser.add_argument('--workers', type=int, default=4, help='Workers for the stack benchmark')
+    parser.add_argument('--raster-bytes', type=int, default=256 * 1024, help='Size of each synthetic output raster')
+    parser.add_argument('--topsapp-sleep', type=float, default=0.0, help='Seconds each stand-in topsApp run sleeps')
+    parser.add_argument('--topsapp-bytes', type=int, default=0, help='Bytes each stand-in topsApp run writes')
+    parser.add_argument('--work-dir', help='Directory to create the synthetic stacks in')
+    parser.add_argument('--baseline', default=BASELINE, help='Baseline timings to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='Save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Fraction a benchmark may be slower than its baseline before it is a regression')
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmarks: {}'.format(', '.join(sorted(unknown))))
+
+    os.environ['PATH'] = os.path.join(HERE, 'bin') + os.pathsep + os.environ['PATH']
+    os.environ['BENCHMARK_TOPSAPP_SLEEP'] = str(args.topsapp_sleep)
+    os.environ['BENCHMARK_TOPSAPP_BYTES'] = str(args.topsapp_bytes)
+    os.environ['BENCHMARK_RASTER_BYTES'] = str(args.raster_bytes)
+
+    results = {}
+    skipped = {}
+    for benchmark in args.benchmarks:
+        results[benchmark] = {}
+        for scenes in args.sizes:
+            try:
+                results[benchmark][str(scenes)] = run(benchmark, scenes, args)
+            except Skip as e:
+                print('Skipping {} benchmark: {}'.format(benchmark, e), file=sys.stderr)
+                results[benchmark] = {str(size): None for size in args.sizes}
+                skipped[benchmark] = str(e)
+                break
+
+    saved = {'benchmarks': {}, 'skipped': {}}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            saved.update(json.load(f))
+    baseline = saved['benchmarks']
+    if saved.get('machine') and saved['machine'] != machine():
+        print('The baseline was recorded on another machine, {}; its timings may not compare'.format(
+            json.dumps(saved['machine'], sort_keys=True)), file=sys.stderr)
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        for benchmark, timings in results.items():
+            measured = {scenes: seconds for scenes, seconds in timings.items() if seconds is not None}
+            if measured:
+                baseline.setdefault(benchmark, {}).update(measured)
+                saved['skipped'].pop(benchmark, None)
+        # Benchmarks that have never run where the baseline was recorded
+        saved['skipped'].update({benchmark: reason for benchmark, reason in skipped.items()
+                                 if benchmark not in baseline})
+        with open(args.baseline, 'w') as f:
+            json.dump({'machine': machine(), 'benchmarks': baseline, 'skipped': saved['skipped']}, f, indent=2,
+                      sort_keys=True)
+        print('Saved baseline to {}'.format(args.baseline))
+    elif regressions:
+        sys.exit('{} benchmark(s) regressed'.format(len(regressions)))
+
+
+if __name__ == '__main__':
+    main()
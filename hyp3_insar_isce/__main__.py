@@ -1,8 +1,14 @@
 #!/usr/bin/env python
+import argparse
 import datetime
+import glob
 import os
 import shutil
+import sys
+import tempfile
+from functools import partial
 
+import boto3
 from hyp3lib.metadata import add_esa_citation
 from hyp3proclib import (
     build_output_name_pair,
@@ -16,14 +22,57 @@ from hyp3proclib import (
     record_metrics,
     success,
     upload_product,
-    zip_dir
 )
-from hyp3proclib.db import get_db_connection
+from hyp3proclib.db import get_db_connection, query_database
 from hyp3proclib.file_system import cleanup_workdir
 from hyp3proclib.logger import log
 from hyp3proclib.proc_base import Processor
 
 import hyp3_insar_isce
+from hyp3_insar_isce import job_runner
+from hyp3_insar_isce.archive import write_zip, zip_dir
+from hyp3_insar_isce.metrics import Metrics, REPORT_NAME
+from hyp3_insar_isce.upload import MultipartUpload
+
+# Peak memory and scratch disk, in GB, of a job processing every subswath of a pair
+JOB_MEMORY = 12
+JOB_SCRATCH = 60
+# Peak memory, in GB, of zipping and uploading a job's product, after its processing is done
+PACKAGE_MEMORY = 1
+
+# Pool of connections to the HyP3 database of this process, when running in slots
+_db_pool = None
+
+
+def db_connection():
+    """Return a connection to the HyP3 database, from this process's pool if it has one"""
+    if _db_pool is None:
+        return get_db_connection('hyp3-db')
+    return _db_pool.connection()
+
+
+def s3_url(bucket, key):
+    return 'https://{}.s3.amazonaws.com/{}'.format(bucket, key)
+
+
+def record_streamed_product(cfg, conn, bucket, key, upload):
+    """Record the zip streamed to S3 as the job's product, with its browse image uploaded next to it
+
+    This stands in for hyp3proclib's upload_product, which would upload the zip again from disk.
+    """
+    browse_key = os.path.splitext(key)[0] + '.png'
+    boto3.client('s3').upload_file(cfg['attachment'], bucket, browse_key, ExtraArgs={'ContentType': 'image/png'})
+    query_database(conn, """
+        INSERT INTO products (local_queue_id, name, url, browse_url, size, sha256)
+        VALUES (%(local_queue_id)s, %(name)s, %(url)s, %(browse_url)s, %(size)s, %(sha256)s)
+    """, {
+        'local_queue_id': cfg['id'],
+        'name': os.path.basename(key),
+        'url': s3_url(bucket, key),
+        'browse_url': s3_url(bucket, browse_key),
+        'size': upload.size,
+        'sha256': upload.sha256.hexdigest(),
+    }, commit=True)
 
 
 def write_list_file(list_file, g1, g2):
@@ -38,7 +87,30 @@ def find_subswath(dir_):
     return sub
 
 
-def process_insar(cfg, n):
+def write_metrics(cfg, metrics):
+    """Combine the measurements of this job and its stack processing into reports next to the product"""
+    # procAllS1StackISCE.py processes each subswath in its own directory
+    reports = glob.glob(os.path.join(cfg['workdir'], REPORT_NAME + '.json'))
+    reports += glob.glob(os.path.join(cfg['workdir'], 'iw*', REPORT_NAME + '.json'))
+    for report in reports:
+        metrics.load(report)
+    for record in metrics.records:
+        record.setdefault('job', cfg['sub_name'])
+
+    basename = cfg.get('out_path', os.path.join(cfg['workdir'], cfg['sub_name'])) + '.metrics'
+    metrics.write(basename)
+    log.info('Wrote metrics to ' + basename + '.json')
+
+    # The work directory is cleaned up, so keep a copy wherever the job asks, e.g. a node exporter textfile directory
+    metrics_dir = get_extra_arg(cfg, "metrics_dir", "")
+    if metrics_dir:
+        for extension in ('.json', '.prom'):
+            shutil.copy(basename + extension, metrics_dir)
+
+
+def process_insar(cfg, n, processed=None):
+    """Process a job, calling `processed` once ISCE processing is done, before the product is zipped and uploaded"""
+    metrics = Metrics(log=log.info)
     try:
         log.info('Processing ISCE InSAR pair "{0}" for "{1}"'.format(cfg['sub_name'], cfg['username']))
 
@@ -59,10 +131,15 @@ def process_insar(cfg, n):
         cfg["email_text"] = "This is a {0}-day InSAR pair from {1} to {2}.".format(delta, sd1, sd2)
 
         subswath = get_extra_arg(cfg, "subswath", "0")
-        if subswath == "0":
-            process(cfg, 'procAllS1StackISCE.py', ["-90", "90", "-180", "180", "-f", list_file, "-d"])
-        else:
-            process(cfg, 'procS1StackISCE.py', ["-f", list_file, "-d", "-s", subswath])
+        output_format = ["--output-format", get_extra_arg(cfg, "output_format", "GTiff")]
+        with metrics.stage('process', pair=ifm_dir):
+            if subswath == "0":
+                process(cfg, 'procAllS1StackISCE.py',
+                        ["-90", "90", "-180", "180", "-f", list_file, "-d"] + output_format)
+            else:
+                process(cfg, 'procS1StackISCE.py', ["-f", list_file, "-d", "-s", subswath] + output_format)
+        if processed is not None:
+            processed()
 
         subdir = os.path.join(cfg['workdir'], 'PRODUCT')
         if not os.path.isdir(subdir):
@@ -91,14 +168,28 @@ def process_insar(cfg, n):
 
             cfg['attachment'] = find_phase_png(out_path)
             add_esa_citation(g1, out_path)
-            zip_dir(out_path, zip_file)
-
-            cfg['final_product_size'] = [os.stat(zip_file).st_size, ]
+            store_geotiffs = get_extra_arg(cfg, "store_geotiffs", "false") == "true"
+            upload_bucket = get_extra_arg(cfg, "upload_bucket", "")
+            if upload_bucket:
+                # The zip is the product's upload, made in parts while it's being written, so it's never read back
+                key = get_extra_arg(cfg, "upload_prefix", "") + os.path.basename(zip_file)
+                log.info('Streaming ' + zip_file + ' to s3://' + upload_bucket + '/' + key)
+                with metrics.stage('zip_upload', pair=ifm_dir), \
+                        MultipartUpload(boto3.client('s3'), upload_bucket, key) as upload:
+                    write_zip(out_path, upload, store_geotiffs=store_geotiffs)
+                cfg['final_product_size'] = [upload.size, ]
+            else:
+                with metrics.stage('zip', pair=ifm_dir):
+                    zip_dir(out_path, zip_file, store_geotiffs=store_geotiffs)
+                cfg['final_product_size'] = [os.stat(zip_file).st_size, ]
             cfg['original_product_size'] = 0
 
-            with get_db_connection('hyp3-db') as conn:
+            with metrics.stage('upload', pair=ifm_dir), db_connection() as conn:
                 record_metrics(cfg, conn)
-                upload_product(zip_file, cfg, conn)
+                if upload_bucket:
+                    record_streamed_product(cfg, conn, upload_bucket, key, upload)
+                else:
+                    upload_product(zip_file, cfg, conn)
                 success(conn, cfg)
 
     except Exception as e:
@@ -106,14 +197,70 @@ def process_insar(cfg, n):
         log.info('Notifying user')
         failure(cfg, str(e))
 
+    try:
+        write_metrics(cfg, metrics)
+    except (OSError, ValueError):
+        log.exception('Writing metrics failed')
+
     cleanup_workdir(cfg)
 
     log.info('Done')
 
 
+def process_insar_in_slot(slot, throttle, job_memory, job_scratch, cfg, n):
+    """Run a job in its own work directory, once the throttle admits it
+
+    The job's memory reservation shrinks to what packaging needs once ISCE processing is done. Its
+    scratch disk stays reserved, since the work directory is only cleaned up when the job finishes.
+    """
+    workdir = cfg['workdir']
+    with throttle.reserve(slot, job_memory, job_scratch, log=log.info), \
+            job_runner.slot_workdir(workdir, slot) as slot_dir:
+        cfg['workdir'] = slot_dir
+        try:
+            process_insar(cfg, n, processed=partial(throttle.shrink, slot, memory=PACKAGE_MEMORY * 2 ** 30))
+        finally:
+            cfg['workdir'] = workdir
+
+
+def run_slot(throttle, job_memory, job_scratch, slot):
+    """Take and process jobs in one slot, reusing its database connection between jobs"""
+    global _db_pool
+    _db_pool = job_runner.ConnectionPool(partial(get_db_connection, 'hyp3-db'))
+    try:
+        processor = Processor('insar_isce', partial(process_insar_in_slot, slot, throttle, job_memory, job_scratch),
+                              sci_version=hyp3_insar_isce.__version__)
+        processor.run()
+    finally:
+        _db_pool.close()
+
+
 def main():
-    processor = Processor('insar_isce', process_insar, sci_version=hyp3_insar_isce.__version__)
-    processor.run()
+    # Options of the runner itself; the rest are the Processor's
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--slots", type=int, default=1,
+                        help="Number of jobs to process at the same time, each with an equal share of the CPUs")
+    parser.add_argument("--job-memory", type=float, default=JOB_MEMORY,
+                        help="Peak memory in GB of a job; a slot waits while other jobs hold the rest")
+    parser.add_argument("--job-scratch", type=float, default=JOB_SCRATCH,
+                        help="Scratch disk in GB a job needs; a slot waits while other jobs hold the rest")
+    parser.add_argument("--scratch-dir", default=tempfile.gettempdir(),
+                        help="Directory on the file system the jobs' work directories are on")
+    args, sys.argv[1:] = parser.parse_known_args()
+
+    if args.slots <= 1:
+        processor = Processor('insar_isce', process_insar, sci_version=hyp3_insar_isce.__version__)
+        processor.run()
+        return
+
+    memory, scratch = job_runner.default_budgets(args.scratch_dir)
+    throttle = job_runner.ResourceThrottle(args.slots, memory, scratch)
+    log.info('Running {} slots sharing {:.1f} GB of memory and {:.1f} GB of scratch disk'.format(
+        args.slots, memory / 2 ** 30, scratch / 2 ** 30))
+    exitcodes = job_runner.run_slots(
+        partial(run_slot, throttle, args.job_memory * 2 ** 30, args.job_scratch * 2 ** 30), args.slots
+    )
+    sys.exit(1 if any(exitcodes) else 0)
 
 
 if __name__ == "__main__":
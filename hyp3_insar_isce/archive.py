@@ -0,0 +1,211 @@
+"""Write zip archives of product directories, compressing members in parallel
+
+The archive is written strictly sequentially, so it can be streamed to any object with
+a `write` method, like a pipe or an upload, as it is produced. Every member's CRC and sizes
+are known before its local header is written, deflated members' from compressing them and
+stored members' from a pass over the file, so the archive has no data descriptors and can
+be read from its local headers alone.
+"""
+
+import os
+import struct
+import tempfile
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from hyp3_insar_isce.resources import available_cpus
+
+CHUNK_SIZE = 1024 ** 2
+
+# Formats that are already compressed and gain nothing from deflating them again
+STORED_EXTENSIONS = ('.png', '.kmz', '.zip', '.jpg', '.gz')
+GEOTIFF_EXTENSIONS = ('.tif', '.tiff')
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+FLAG_UTF8 = 0x800
+
+
+def _dos_time(mtime):
+    # the zip format can't represent times before 1980
+    t = time.localtime(max(mtime, 315532800))
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+class _Member:
+    def __init__(self, path, arcname, method):
+        stat = os.stat(path)
+        self.path = path
+        self.arcname = arcname.encode('utf-8')
+        self.method = method
+        self.mode = stat.st_mode
+        self.time, self.date = _dos_time(stat.st_mtime)
+        self.file_size = stat.st_size
+        self.compress_size = None
+        self.crc = 0
+        self.offset = None
+        self.data = None
+
+    @property
+    def zip64(self):
+        return self.file_size >= ZIP64_LIMIT or (self.compress_size or 0) >= ZIP64_LIMIT
+
+    def deflate(self, level):
+        """Compress the member into a temporary file, ahead of it being written to the archive"""
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        self.data = tempfile.SpooledTemporaryFile(max_size=16 * CHUNK_SIZE)
+        with open(self.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                self.crc = zlib.crc32(chunk, self.crc)
+                self.data.write(compressor.compress(chunk))
+        self.data.write(compressor.flush())
+        self.compress_size = self.data.tell()
+        self.data.seek(0)
+        return self
+
+    def checksum(self):
+        """Compute the CRC of a stored member, ahead of it being written to the archive"""
+        with open(self.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                self.crc = zlib.crc32(chunk, self.crc)
+        self.compress_size = self.file_size
+        return self
+
+    def chunks(self):
+        """Yield the (compressed) data of the member"""
+        if self.data is not None:
+            with self.data:
+                yield from iter(lambda: self.data.read(CHUNK_SIZE), b'')
+            return
+
+        with open(self.path, 'rb') as f:
+            yield from iter(lambda: f.read(CHUNK_SIZE), b'')
+
+    @property
+    def flags(self):
+        return FLAG_UTF8
+
+    def local_header(self):
+        version = 45 if self.zip64 else 20
+        extra = b''
+        if self.zip64:
+            compress_size, file_size = ZIP64_LIMIT, ZIP64_LIMIT
+            extra = struct.pack('<HHQQ', 1, 16, self.file_size, self.compress_size)
+        else:
+            compress_size, file_size = self.compress_size, self.file_size
+
+        return struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, version, self.flags, self.method, self.time, self.date,
+            self.crc, compress_size, file_size, len(self.arcname), len(extra),
+        ) + self.arcname + extra
+
+    def central_header(self):
+        fields = []
+        file_size, compress_size, offset = self.file_size, self.compress_size, self.offset
+        if file_size >= ZIP64_LIMIT:
+            fields.append(file_size)
+            file_size = ZIP64_LIMIT
+        if compress_size >= ZIP64_LIMIT:
+            fields.append(compress_size)
+            compress_size = ZIP64_LIMIT
+        if offset >= ZIP64_LIMIT:
+            fields.append(offset)
+            offset = ZIP64_LIMIT
+        extra = struct.pack('<HH%dQ' % len(fields), 1, 8 * len(fields), *fields) if fields else b''
+        version = 45 if fields or self.zip64 else 20
+
+        return struct.pack(
+            '<IHHHHHHIIIHHHHHII', 0x02014b50, version | (3 << 8), version, self.flags, self.method,
+            self.time, self.date, self.crc, compress_size, file_size, len(self.arcname), len(extra), 0, 0, 0,
+            (self.mode & 0xFFFF) << 16, offset,
+        ) + self.arcname + extra
+
+
+def _end_records(count, cd_offset, cd_size):
+    records = b''
+    if count > 0xFFFF or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+        zip64_end_offset = cd_offset + cd_size
+        records += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset)
+        records += struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1)
+        count, cd_offset, cd_size = min(count, 0xFFFF), min(cd_offset, ZIP64_LIMIT), min(cd_size, ZIP64_LIMIT)
+    return records + struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, cd_size, cd_offset, 0)
+
+
+def list_members(directory, store_geotiffs=False):
+    """List the files of a directory to archive, named relative to its parent, with their compression method"""
+    stored = STORED_EXTENSIONS + (GEOTIFF_EXTENSIONS if store_geotiffs else ())
+    parent = os.path.dirname(os.path.abspath(directory))
+    members = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            method = ZIP_STORED if name.lower().endswith(stored) else ZIP_DEFLATED
+            members.append(_Member(path, os.path.relpath(os.path.abspath(path), parent), method))
+    return members
+
+
+def write_zip(directory, fileobj, workers=None, store_geotiffs=False, level=6):
+    """Write a zip archive of a directory to a file object, compressing members in parallel
+
+    Args:
+        directory: Directory to archive; members are named relative to its parent
+        fileobj: Object with a `write` method to write the archive to; it doesn't need to be seekable
+        workers: Number of members to compress at once; defaults to the number of available CPUs
+        store_geotiffs: Store GeoTIFFs, which are already compressed internally, without deflating them
+        level: zlib compression level
+
+    Returns:
+        size: Number of bytes written
+    """
+    members = list_members(directory, store_geotiffs=store_geotiffs)
+    workers = workers or available_cpus()
+    offset = 0
+
+    def write(data):
+        nonlocal offset
+        fileobj.write(data)
+        offset += len(data)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Compress, or checksum, a bounded number of members ahead of the one being written
+        pending = deque()
+        upcoming = iter(members)
+
+        def fill():
+            while len(pending) < 2 * workers:
+                member = next(upcoming, None)
+                if member is None:
+                    return
+                if member.method == ZIP_DEFLATED:
+                    pending.append((member, executor.submit(member.deflate, level)))
+                else:
+                    pending.append((member, executor.submit(member.checksum)))
+
+        fill()
+        while pending:
+            member, prepared = pending.popleft()
+            prepared.result()
+            fill()
+
+            member.offset = offset
+            write(member.local_header())
+            for chunk in member.chunks():
+                write(chunk)
+
+    cd_offset = offset
+    for member in members:
+        write(member.central_header())
+    write(_end_records(len(members), cd_offset, offset - cd_offset))
+    return offset
+
+
+def zip_dir(directory, zip_file, workers=None, store_geotiffs=False):
+    """Write a zip archive of a directory to a file; see `write_zip`"""
+    with open(zip_file, 'wb') as f:
+        return write_zip(directory, f, workers=workers, store_geotiffs=store_geotiffs)
@@ -0,0 +1,113 @@
+"""Select the bursts of a subswath that a region of interest needs, from the annotation geolocation grids
+
+topsApp reads and processes every burst of a subswath unless it's given a region of interest,
+in which case it keeps only the bursts whose bounding box intersects it. These functions find
+those bursts in every scene of a stack up front, so the stack drivers can hand topsApp a region
+of interest trimmed to the stack's coverage, and fail before processing when a scene has none.
+"""
+
+
+def bounding_box(points):
+    """Return the bounding box (south, north, west, east) of (lat, lon) points, across the antimeridian if needed
+
+    Like hyp3lib's getSubSwath.get_bounding_box, longitudes that span more than 180 degrees
+    are moved to 0 to 360.
+    """
+    lats = [lat for lat, _ in points]
+    lons = [lon for _, lon in points]
+    if max(lons) - min(lons) > 180:
+        lons = [lon + 360 if lon < 0 else lon for lon in lons]
+    return min(lats), max(lats), min(lons), max(lons)
+
+
+def burst_bounds(points, lines_per_burst, count):
+    """Return the bounding box of each burst of a subswath
+
+    The lines of the geolocation grid fall on, or near, the boundaries between bursts, so each
+    burst is bounded by the grid lines nearest to its first and last lines.
+
+    Args:
+        points: dict of (line, pixel) to (lat, lon) of the subswath's geolocation grid
+        lines_per_burst: Number of lines in each burst
+        count: Number of bursts
+
+    Returns:
+        bounds: (south, north, west, east) of each burst
+    """
+    lines = sorted({line for line, _ in points})
+    bounds = []
+    for burst in range(count):
+        first = min(lines, key=lambda line: abs(line - burst * lines_per_burst))
+        last = min(lines, key=lambda line: abs(line - (burst + 1) * lines_per_burst))
+        bounds.append(bounding_box([point for (line, _), point in points.items() if first <= line <= last]))
+    return bounds
+
+
+def normalize_roi(roi):
+    """Return a region of interest (south, north, west, east) given across the antimeridian, with west > east,
+    with its east moved past 180 degrees, the way bounding_box moves longitudes
+    """
+    south, north, west, east = roi
+    if west > east:
+        east += 360
+    return south, north, west, east
+
+
+def intersection(box, other):
+    """Return the intersection of two bounding boxes (south, north, west, east), or None if they don't intersect
+
+    Longitudes across the antimeridian may be in either -180 to 180 or 0 to 360, so box is moved
+    by 360 degrees of longitude where that makes it meet other; the intersection is in other's.
+    """
+    south, north = max(box[0], other[0]), min(box[1], other[1])
+    if south > north:
+        return None
+    for shift in (0, 360, -360):
+        west, east = max(box[2] + shift, other[2]), min(box[3] + shift, other[3])
+        if west <= east:
+            return south, north, west, east
+    return None
+
+
+def select_bursts(swath, roi):
+    """Return the indices of the bursts of a subswath whose bounding box intersects roi, as topsApp selects them
+
+    Args:
+        swath: Catalog entry of the subswath, from `scene_catalog`, with the bounds of each burst
+        roi: Region of interest (south, north, west, east)
+    """
+    roi = normalize_roi(roi)
+    return [index for index, burst in enumerate(swath['bursts'])
+            if intersection((burst['south'], burst['north'], burst['west'], burst['east']), roi) is not None]
+
+
+def stack_roi(swaths, roi):
+    """Return the region of interest of a subswath to process in a stack, and the bursts it selects in each scene
+
+    The region of interest is trimmed to the bursts of the scenes that intersect it, so it
+    selects the same bursts while ending where the stack's coverage does.
+
+    Args:
+        swaths: Catalog entries of the subswath in each scene of the stack
+        roi: Region of interest (south, north, west, east)
+
+    Returns:
+        roi: The trimmed region of interest, in the longitudes of the region given
+        selected: Indices of the bursts selected in each scene
+    """
+    roi = normalize_roi(roi)
+    selected = []
+    coverage = []
+    for swath in swaths:
+        indices = []
+        for index, burst in enumerate(swath['bursts']):
+            covered = intersection((burst['south'], burst['north'], burst['west'], burst['east']), roi)
+            if covered is not None:
+                indices.append(index)
+                coverage.append(covered)
+        if not indices:
+            raise ValueError('No burst of {} intersects the region of interest {}'.format(swath['annotation'], roi))
+        selected.append(indices)
+
+    return (min(box[0] for box in coverage), max(box[1] for box in coverage),
+            min(box[2] for box in coverage), max(box[3] for box in coverage)), selected
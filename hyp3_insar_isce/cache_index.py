@@ -0,0 +1,63 @@
+"""The index of a persistent, size-bounded cache directory shared between processes
+
+Each entry of the index is a dict with at least its `size` in bytes and when it was
+`last_used`. The index is a JSON file in the cache directory, read and written under an
+exclusive lock on `index.lock`, so every process and thread using the cache sees the same
+entries. The least recently used entries are evicted once they add up to more than
+`max_bytes`.
+"""
+
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+
+class CacheIndex:
+    """The index of the entries in a cache directory
+
+    Args:
+        cache_dir: Directory of the cache
+        max_bytes: Total size of the entries above which the least recently used are evicted
+        files: Function returning the files of an entry, removed when it's evicted
+        kind: What the entries are, for the eviction message
+        index_name: Name of the index in the cache directory
+    """
+    def __init__(self, cache_dir, max_bytes, files, kind='file', index_name='index.json'):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.files = files
+        self.kind = kind
+        self.index_file = os.path.join(cache_dir, index_name)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def locked(self):
+        """Lock, load, and on exit save, the index shared by every process using the cache"""
+        with self._lock, open(os.path.join(self.cache_dir, 'index.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            index = {}
+            if os.path.isfile(self.index_file):
+                with open(self.index_file) as f:
+                    index = json.load(f)
+
+            yield index
+
+            with open(self.index_file + '.tmp', 'w') as f:
+                json.dump(index, f, indent=2, sort_keys=True)
+            os.replace(self.index_file + '.tmp', self.index_file)
+
+    def evict(self, index, keep):
+        """Remove the least recently used entries, except `keep`, until the rest fit in `max_bytes`"""
+        total = sum(entry['size'] for entry in index.values())
+        for name in sorted(index, key=lambda n: index[n]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            print('Evicting {} {} from the cache'.format(self.kind, name))
+            total -= index.pop(name)['size']
+            for f in self.files(name):
+                if os.path.isfile(f):
+                    os.remove(f)
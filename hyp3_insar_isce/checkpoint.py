@@ -0,0 +1,70 @@
+"""Per-pair checkpoints of finished topsApp stages and collected products"""
+
+import json
+import os
+
+CHECKPOINT_FILE = 'checkpoint.json'
+
+# topsApp stages, in order, and the topsApp.py arguments to run each of them
+STAGES = (
+    ('preprocess', '--end=preprocess'),
+    ('filter', '--start=computeBaselines --end=filter'),
+    ('unwrap', '--dostep=unwrap'),
+    ('geocode', '--dostep=geocode'),
+)
+STAGE_NAMES = tuple(stage for stage, _ in STAGES)
+
+
+def load(pair_dir):
+    """Load the checkpoint of a pair directory, or an empty checkpoint if it has none"""
+    checkpoint_file = os.path.join(pair_dir, CHECKPOINT_FILE)
+    if not os.path.isfile(checkpoint_file):
+        return {'stage': None, 'products': []}
+    with open(checkpoint_file) as f:
+        return json.load(f)
+
+
+def save(pair_dir, checkpoint):
+    checkpoint_file = os.path.join(pair_dir, CHECKPOINT_FILE)
+    with open(checkpoint_file + '.tmp', 'w') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(checkpoint_file + '.tmp', checkpoint_file)
+
+
+def mark_stage(pair_dir, stage):
+    """Record that a topsApp stage of a pair finished"""
+    checkpoint = load(pair_dir)
+    checkpoint['stage'] = stage
+    save(pair_dir, checkpoint)
+
+
+def rewind(pair_dir, stage):
+    """Record that a pair's outputs after a topsApp stage are gone, so it resumes after that stage
+
+    A stage of None resumes from the start. A pair is never moved forward.
+    """
+    checkpoint = load(pair_dir)
+    last = checkpoint['stage']
+    if last is not None and (stage is None or STAGE_NAMES.index(stage) < STAGE_NAMES.index(last)):
+        checkpoint['stage'] = stage
+        save(pair_dir, checkpoint)
+
+
+def mark_collected(pair_dir, products):
+    """Record the products collected from a pair"""
+    checkpoint = load(pair_dir)
+    checkpoint['products'] = list(products)
+    save(pair_dir, checkpoint)
+
+
+def remaining_stages(pair_dir, unwrap=True):
+    """Return the topsApp stages of a pair that have not finished yet, as (stage, topsApp.py arguments)"""
+    last = load(pair_dir)['stage']
+    start = STAGE_NAMES.index(last) + 1 if last is not None else 0
+    return [(stage, step) for stage, step in STAGES[start:] if unwrap or stage != 'unwrap']
+
+
+def is_collected(pair_dir, product_dir):
+    """Return True if every product of a pair has already been collected into product_dir"""
+    products = load(pair_dir)['products']
+    return bool(products) and all(os.path.isfile(os.path.join(product_dir, product)) for product in products)
@@ -0,0 +1,128 @@
+"""A data cube of a stack's collected products, on one grid, in a single HDF5 file
+
+Each product layer (unwrapped phase, coherence and amplitude) is a (pair, y, x) float32
+dataset, chunked a pair and a block of pixels at a time and compressed, so a window or a
+time series of pixels can be read without reading whole products. The pair, y and x
+coordinates are HDF5 dimension scales, as netCDF-4 readers expect, and each pair also has
+the times of its scenes and the baseline, heading and UTC time of its metadata.
+
+Pairs are appended as they're collected, so the cube of a stack that stopped part way holds
+every pair collected so far; appending a pair that's already in the cube replaces it.
+"""
+
+import os
+
+import h5py
+import numpy as np
+
+CUBE_FILE = 'stack_cube.h5'
+
+# Layers of the cube, and the suffix of the product each is read from in PRODUCT
+LAYERS = {
+    'unw_phase': 'unw_phase.tif',
+    'corr': 'corr.tif',
+    'amp': 'amp.tif',
+}
+
+# Per-pair coordinates, and their types
+PAIR_COORDINATES = {
+    'reference_time': h5py.string_dtype(),
+    'secondary_time': h5py.string_dtype(),
+    'baseline': 'f8',
+    'heading': 'f8',
+    'utctime': 'f8',
+}
+
+# Rows and columns of each chunk
+CHUNK_SIZE = 512
+
+
+def pair_times(pair_dir):
+    """Return the ISO 8601 times of the reference and secondary scenes of a pair, from its directory name"""
+    return tuple('{}-{}-{}T{}:{}:{}'.format(date[0:4], date[4:6], date[6:8], date[9:11], date[11:13], date[13:15])
+                 for date in os.path.basename(pair_dir).split('_')[:2])
+
+
+def create(cube_file, grid):
+    """Create an empty cube on a grid
+
+    Args:
+        cube_file: HDF5 file to create
+        grid: dict of the grid's crs (WKT), x0 and y0 (upper left corner), res, width and height
+    """
+    width, height = grid['width'], grid['height']
+    chunks = (1, min(CHUNK_SIZE, height), min(CHUNK_SIZE, width))
+    with h5py.File(cube_file + '.tmp', 'w') as f:
+        for name, value in grid.items():
+            f.attrs[name] = value
+
+        f['x'] = grid['x0'] + (np.arange(width) + 0.5) * grid['res']
+        f['y'] = grid['y0'] - (np.arange(height) + 0.5) * grid['res']
+        f.create_dataset('pair', shape=(0,), maxshape=(None,), dtype=h5py.string_dtype())
+        for name in ('pair', 'y', 'x'):
+            f[name].make_scale(name)
+
+        for name, dtype in PAIR_COORDINATES.items():
+            f.create_dataset(name, shape=(0,), maxshape=(None,), dtype=dtype)
+            f[name].dims[0].attach_scale(f['pair'])
+
+        for name in LAYERS:
+            layer = f.create_dataset(name, shape=(0, height, width), maxshape=(None, height, width), chunks=chunks,
+                                     dtype='f4', fillvalue=np.nan, compression='gzip', compression_opts=4,
+                                     shuffle=True)
+            for dim, scale in enumerate(('pair', 'y', 'x')):
+                layer.dims[dim].attach_scale(f[scale])
+    os.replace(cube_file + '.tmp', cube_file)
+
+
+def read_grid(cube_file):
+    with h5py.File(cube_file, 'r') as f:
+        return {name: value.item() if isinstance(value, np.generic) else value for name, value in f.attrs.items()}
+
+
+def _pair_names(f):
+    return [name.decode() if isinstance(name, bytes) else name for name in f['pair'][()]]
+
+
+def pairs(cube_file):
+    """Return the names of the pairs in a cube, in the order they were appended"""
+    with h5py.File(cube_file, 'r') as f:
+        return _pair_names(f)
+
+
+def append_pair(cube_file, pair, layers, coordinates):
+    """Append the products of a pair to a cube, or replace them if the pair is already in it
+
+    Args:
+        cube_file: HDF5 file of the cube
+        pair: Name of the pair, like 20160408T091355_20160420T091355_iw1
+        layers: dict of each layer in LAYERS to its data on the cube's grid, as an array, or any object with a
+            shape whose rows can be sliced, which is read a chunk of rows at a time
+        coordinates: dict of the pair's coordinates in PAIR_COORDINATES; missing or None values are left empty
+    """
+    with h5py.File(cube_file, 'a') as f:
+        shape = (f.attrs['height'], f.attrs['width'])
+        for name in LAYERS:
+            if tuple(layers[name].shape) != shape:
+                raise ValueError('Layer {} of {} has shape {}; the cube grid is {} by {}'.format(
+                    name, pair, tuple(layers[name].shape), *shape))
+
+        names = _pair_names(f)
+        if pair in names:
+            index = names.index(pair)
+        else:
+            index = len(names)
+            for name in ('pair',) + tuple(PAIR_COORDINATES) + tuple(LAYERS):
+                f[name].resize(index + 1, axis=0)
+            f['pair'][index] = pair
+
+        for name in PAIR_COORDINATES:
+            value = coordinates.get(name)
+            if value is None:
+                value = '' if f[name].dtype.kind == 'O' else np.nan
+            f[name][index] = value
+
+        for name in LAYERS:
+            for row in range(0, shape[0], CHUNK_SIZE):
+                f[name][index, row:row + CHUNK_SIZE] = layers[name][row:row + CHUNK_SIZE]
+        f.flush()
@@ -0,0 +1,215 @@
+"""Persistent, size-bounded cache of DEMs in ISCE format
+
+The DEM source is chosen once for the whole bounding box of a DEM, the way hyp3lib's
+get_dem chooses it, and every 1x1 degree tile of the DEM is then warped onto a common
+geographic grid from that source's tiles, read in place, and cached, so a DEM never mixes
+sources. A DEM for any bounding box is mosaicked from the cached tiles, and finished DEMs
+are memoized by bounding box and resolution, so jobs over the same area reuse both.
+"""
+
+import fcntl
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import hyp3lib.etc
+from hyp3lib import DemError
+from hyp3lib.dem2isce import dem2isce
+from hyp3lib.get_dem import get_best_dem, reproject_wkt
+from osgeo import gdal, ogr, osr
+
+from hyp3_insar_isce.cache_index import CacheIndex
+from hyp3_insar_isce.file_system import link_or_copy
+
+# Pixel size, in degrees, of the DEMs made by hyp3lib.get_dem.get_ISCE_dem
+PIXEL_SIZE = 0.000277777777778
+NODATA = -32767
+
+
+def tile_name(lat, lon):
+    """Return the name of the 1x1 degree tile whose south west corner is at lat, lon"""
+    return '{}{:02d}{}{:03d}'.format('N' if lat >= 0 else 'S', abs(lat), 'E' if lon >= 0 else 'W', abs(lon))
+
+
+def tiles_for(west, south, east, north):
+    """Return the (lat, lon) of the south west corner of every tile intersecting a bounding box"""
+    return [
+        (lat, lon)
+        for lat in range(math.floor(south), math.ceil(north))
+        for lon in range(math.floor(west), math.ceil(east))
+    ]
+
+
+def box_wkt(west, south, east, north):
+    return 'POLYGON (({0} {1}, {2} {1}, {2} {3}, {0} {3}, {0} {1}))'.format(west, south, east, north)
+
+
+def source_nodata(source):
+    """Return the no data value of a DEM source's tiles, as hyp3lib.get_dem assumes it"""
+    if 'SRTMGL' in source:
+        return -32768
+    if 'GIMP' in source:
+        return None
+    if 'REMA' in source:
+        return 0
+    if 'NED' in source or 'EU_DEM_V11' in source:
+        return -3.4028234663852886e+38
+    raise DemError('Unable to determine NoData value for DEM {}'.format(source))
+
+
+def source_tile_path(source, tile):
+    """Return the GDAL path of a DEM source's tile, where hyp3lib.get_dem would download it from"""
+    config = os.path.join(os.path.dirname(hyp3lib.etc.__file__), 'config', 'get_dem.py.cfg')
+    with open(config) as f:
+        locations = {line.split()[0]: os.path.dirname(line.split()[1]) for line in f if line.strip()}
+    location = locations[source]
+    if location.startswith('s3:'):
+        return '/vsis3/{}/{}/{}.tif'.format(location.split('/')[-1], source, tile)
+    return os.path.join(location, source, 'geotiff', tile + '.tif')
+
+
+def select_source(west, south, east, north):
+    """Choose the DEM source for a bounding box, with hyp3lib's preferences
+
+    Returns:
+        source: dict of the source's `name`, `epsg`, and the footprint, as WKT in that EPSG, of each of its `tiles`
+            intersecting the bounding box
+    """
+    name, epsg, tiles, footprints = get_best_dem(south, north, west, east)
+    return {'name': name, 'epsg': int(epsg), 'tiles': dict(zip(tiles, footprints))}
+
+
+def source_tiles(source, lat, lon):
+    """Return the source's tiles intersecting the 1x1 degree tile whose south west corner is at lat, lon"""
+    wkt = box_wkt(lon, lat, lon + 1, lat + 1)
+    if source['epsg'] != 4326:
+        wkt = reproject_wkt(wkt, 4326, source['epsg'])
+    tile = ogr.CreateGeometryFromWkt(wkt)
+    return sorted(name for name, footprint in source['tiles'].items()
+                  if ogr.CreateGeometryFromWkt(footprint).Intersection(tile).GetArea() > 0)
+
+
+def dem_key(west, south, east, north, pixel_size=PIXEL_SIZE):
+    return 'dem_{:.6f}_{:.6f}_{:.6f}_{:.6f}_{:.9f}'.format(west, south, east, north, pixel_size)
+
+
+def envi_files(path):
+    """Return a DEM in ENVI format and its header"""
+    return [path, os.path.splitext(path)[0] + '.hdr']
+
+
+class DemCache:
+    """A directory of DEM tiles, and DEMs mosaicked from them, shared between jobs
+
+    Each tile is fetched by only one process or thread at a time; the others wait for it. The
+    least recently used tiles and DEMs are evicted once the cache holds more than `max_bytes`.
+    """
+    index_name = 'index.json'
+
+    def __init__(self, cache_dir, max_bytes=20 * 1024 ** 3):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._fetch_locks = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._index = CacheIndex(self.cache_dir, max_bytes,
+                                 lambda name: envi_files(os.path.join(self.cache_dir, name + '.dem')),
+                                 kind='DEM', index_name=self.index_name)
+
+    @contextmanager
+    def _fetch_lock(self, name):
+        """Hold a lock on fetching an entry, across threads and processes"""
+        with self._lock:
+            thread_lock = self._fetch_locks.setdefault(name, threading.Lock())
+        with thread_lock, open(os.path.join(self.cache_dir, name + '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def lookup(self, name):
+        """Return the cached DEM or tile with a name, or None if there isn't one"""
+        path = os.path.join(self.cache_dir, name + '.dem')
+        with self._index.locked() as index:
+            if name not in index or not all(os.path.isfile(f) for f in envi_files(path)):
+                return None
+            index[name]['last_used'] = time.time()
+            return path
+
+    def add(self, name, path):
+        """Index a DEM or tile written to the cache"""
+        with self._index.locked() as index:
+            index[name] = {
+                'size': sum(os.path.getsize(f) for f in envi_files(path)),
+                'last_used': time.time(),
+            }
+            self._index.evict(index, keep=name)
+        return path
+
+    @staticmethod
+    def _fetch_tile(source, lat, lon, path):
+        """Warp a tile onto the common grid from the source's tiles, or fill it with no data where it has none"""
+        bounds = (lon, lat, lon + 1, lat + 1)
+        sources = [source_tile_path(source['name'], tile) for tile in source_tiles(source, lat, lon)]
+        if not sources:
+            size = round(1 / PIXEL_SIZE)
+            srs = osr.SpatialReference()
+            srs.ImportFromEPSG(4326)
+            ds = gdal.GetDriverByName('ENVI').Create(path, size, size, 1, gdal.GDT_Float32)
+            ds.SetGeoTransform((lon, PIXEL_SIZE, 0, lat + 1, 0, -PIXEL_SIZE))
+            ds.SetProjection(srs.ExportToWkt())
+            ds.GetRasterBand(1).SetNoDataValue(NODATA)
+            ds.GetRasterBand(1).Fill(NODATA)
+            ds = None
+            print('No {} DEM tiles cover {}; filled it with no data'.format(source['name'], os.path.basename(path)))
+            return
+
+        # The ASF DEM buckets are public
+        gdal.SetThreadLocalConfigOption('AWS_NO_SIGN_REQUEST', 'YES')
+        gdal.Warp(path, sources, format='ENVI', dstSRS='EPSG:4326', outputBounds=bounds,
+                  xRes=PIXEL_SIZE, yRes=PIXEL_SIZE, resampleAlg='cubic', outputType=gdal.GDT_Float32,
+                  srcNodata=source_nodata(source['name']), dstNodata=NODATA)
+        print('Fetched {} DEM tile {}'.format(source['name'], os.path.basename(path)))
+
+    def get_tile(self, lat, lon, source):
+        """Return the cached tile of a DEM source whose south west corner is at lat, lon, fetching it if needed"""
+        name = '{}_{}'.format(source['name'], tile_name(lat, lon))
+        path = self.lookup(name)
+        if path is not None:
+            return path
+
+        with self._fetch_lock(name):
+            path = self.lookup(name)
+            if path is None:
+                path = os.path.join(self.cache_dir, name + '.dem')
+                self._fetch_tile(source, lat, lon, path)
+                path = self.add(name, path)
+        return path
+
+    def get_dem(self, west, south, east, north):
+        """Return a cached DEM of a bounding box, mosaicking it from cached tiles if needed"""
+        west, south, east, north = float(west), float(south), float(east), float(north)
+        name = dem_key(west, south, east, north)
+        path = self.lookup(name)
+        if path is not None:
+            return path
+
+        with self._fetch_lock(name):
+            path = self.lookup(name)
+            if path is None:
+                source = select_source(west, south, east, north)
+                tiles = [self.get_tile(lat, lon, source) for lat, lon in tiles_for(west, south, east, north)]
+                mosaic = '/vsimem/{}.vrt'.format(name)
+                gdal.BuildVRT(mosaic, tiles)
+                path = os.path.join(self.cache_dir, name + '.dem')
+                gdal.Translate(path, mosaic, format='ENVI', projWin=[west, north, east, south])
+                gdal.Unlink(mosaic)
+                path = self.add(name, path)
+        return path
+
+    def get_ISCE_dem(self, west, south, east, north, demName, demXMLName):
+        """Write a DEM of a bounding box in ISCE format; a cached drop-in for `hyp3lib.get_dem.get_ISCE_dem`"""
+        cached = self.get_dem(west, south, east, north)
+        for src, dst in zip(envi_files(cached), envi_files(demName)):
+            link_or_copy(src, dst)
+        dem2isce(demName, envi_files(demName)[1], demXMLName)
@@ -0,0 +1,62 @@
+"""Share files between working directories without copying them"""
+
+import fcntl
+import os
+import shutil
+
+# ioctl request to clone a file's extents on copy-on-write file systems (Btrfs, XFS), from linux/fs.h
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    """Create dst as a copy-on-write clone of src; raises OSError if the file system doesn't support it"""
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+
+def link_or_copy(src, dst):
+    """Make dst a hard link to src, or a reflink, and only copy src when neither is possible"""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    try:
+        reflink(src, dst)
+        return
+    except OSError:
+        pass
+    shutil.copyfile(src, dst)
+
+
+def link_or_symlink(src, dst):
+    """Hard link src to dst, falling back to a symbolic link across file systems"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        os.symlink(os.path.abspath(src), dst)
+
+
+def link_tree(src, dst):
+    """Recreate the directory tree src at dst, linking each file instead of copying it"""
+    shutil.copytree(src, dst, symlinks=True, copy_function=link_or_symlink)
+
+
+def replace_tree(src, dst):
+    """Atomically replace the directory tree dst with a linked copy of src"""
+    tmp = dst + '.tmp.{}'.format(os.getpid())
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    link_tree(src, tmp)
+    try:
+        os.rename(tmp, dst)
+    except OSError:
+        # Another process already populated dst
+        shutil.rmtree(tmp)
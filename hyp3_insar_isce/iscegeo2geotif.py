@@ -0,0 +1,191 @@
+"""Convert ISCE geocoded outputs into GeoTIFF, browse, and kmz files with bounded memory
+
+The GeoTIFFs are written either as plain tiled GeoTIFFs or, with output_format='COG', as
+cloud-optimized GeoTIFFs: tiled and compressed with internal overviews laid out ahead of the
+full resolution data, so readers can fetch a window or a thumbnail with a few range reads.
+"""
+
+import argparse
+import os
+import shutil
+
+from hyp3lib.iscegeo2geotif import makeKMZ
+from osgeo import gdal
+
+# Memory, in MB, GDAL may use for its block cache, and for each chunk it reprojects
+GDAL_CACHE = 256
+WARP_MEMORY = 256
+
+CREATION_OPTIONS = ['TILED=YES', 'COMPRESS=LZW', 'BIGTIFF=IF_SAFER']
+
+# Output formats of the GeoTIFFs
+GTIFF = 'GTiff'
+COG = 'COG'
+OUTPUT_FORMATS = (GTIFF, COG)
+
+# Built through the GTiff driver, which has made COGs since long before GDAL's own COG driver
+COG_BLOCK_SIZE = 512
+COG_OPTIONS = ['TILED=YES', 'BLOCKXSIZE=%d' % COG_BLOCK_SIZE, 'BLOCKYSIZE=%d' % COG_BLOCK_SIZE, 'COMPRESS=DEFLATE',
+               'PREDICTOR=3', 'BIGTIFF=IF_SAFER', 'COPY_SRC_OVERVIEWS=YES']
+
+
+def select_band(src, band):
+    """Return an in-memory VRT of one band of src, without reading any of its data"""
+    vrt = '/vsimem/{}.band{}.vrt'.format(os.path.basename(src), band)
+    gdal.Translate(vrt, src, format='VRT', bandList=[band])
+    return vrt
+
+
+def write_geotiff(dst, src, proj=None, res=30):
+    """Write src to a tiled GeoTIFF, reprojecting it a chunk at a time when a projection is given"""
+    if proj is None:
+        gdal.Translate(dst, src, creationOptions=CREATION_OPTIONS)
+    else:
+        gdal.Warp(dst, src, dstSRS=proj, xRes=res, yRes=res, resampleAlg='cubic', dstNodata=0, multithread=True,
+                  warpMemoryLimit=WARP_MEMORY * 1024 ** 2, creationOptions=CREATION_OPTIONS)
+
+
+def overview_levels(width, height, block_size=COG_BLOCK_SIZE):
+    """Return the decimation factors of the overviews of a raster, halving it until it fits in a block"""
+    levels = []
+    factor = 2
+    while max(width, height) / (factor // 2) > block_size:
+        levels.append(factor)
+        factor *= 2
+    return levels
+
+
+def write_cog(dst, src, proj=None, res=30):
+    """Write src to a cloud-optimized GeoTIFF
+
+    The raster is written to a temporary tiled GeoTIFF first, its overviews are built by
+    averaging, and both are copied into dst with the overviews ahead of the full resolution data.
+    """
+    tmp = dst + '.tmp.tif'
+    write_geotiff(tmp, src, proj=proj, res=res)
+    ds = gdal.Open(tmp, gdal.GA_Update)
+    ds.BuildOverviews('AVERAGE', overview_levels(ds.RasterXSize, ds.RasterYSize))
+    del ds
+    gdal.Translate(dst, tmp, creationOptions=COG_OPTIONS)
+    gdal.GetDriverByName('GTiff').Delete(tmp)
+
+
+def georeferenced_browse(oldname, pngname, geo_raster, proj, height):
+    """Create a browse image from a colorized PNG, georeferenced from the header of the raster it was made from
+
+    Like `hyp3lib.iscegeo2geotif.create_browse`, but without reading the raster's data.
+    """
+    ds = gdal.Open(geo_raster)
+    ulx, xres, _, uly, _, yres = ds.GetGeoTransform()
+    bounds = [ulx, uly, ulx + xres * ds.RasterXSize, uly + yres * ds.RasterYSize]
+    gdal.Translate('/vsimem/browse.vrt', oldname, format='VRT', height=height, outputBounds=bounds,
+                   outputSRS=ds.GetProjection())
+    del ds
+    gdal.Warp('/vsimem/browse_proj.vrt', '/vsimem/browse.vrt', format='VRT', dstSRS=proj, resampleAlg='cubic',
+              dstNodata=0)
+    gdal.Translate(pngname, '/vsimem/browse_proj.vrt', format='PNG')
+    gdal.Unlink('/vsimem/browse_proj.vrt')
+    gdal.Unlink('/vsimem/browse.vrt')
+
+
+def stack_grid(src, south, north, west, east, proj, res=30):
+    """Return the grid, as `datacube.create` takes it, of a bounding box in a projection, aligned to the resolution
+
+    src is any raster covering the box; only its header is read.
+    """
+    vrt = '/vsimem/stack_grid.vrt'
+    gdal.Warp(vrt, src, format='VRT', dstSRS=proj, outputBounds=(west, south, east, north),
+              outputBoundsSRS='EPSG:4326', xRes=res, yRes=res, targetAlignedPixels=True)
+    ds = gdal.Open(vrt)
+    x0, _, _, y0, _, _ = ds.GetGeoTransform()
+    grid = {'crs': ds.GetProjection(), 'x0': x0, 'y0': y0, 'res': float(res), 'width': ds.RasterXSize,
+            'height': ds.RasterYSize}
+    del ds
+    gdal.Unlink(vrt)
+    return grid
+
+
+class GriddedRaster:
+    """The first band of a raster warped onto a grid, read a slice of rows at a time
+
+    Pixels outside the raster, or that are nodata in it, are NaN.
+    """
+    def __init__(self, src, grid):
+        self.vrt = '/vsimem/{}.grid.vrt'.format(os.path.basename(src))
+        bounds = (grid['x0'], grid['y0'] - grid['height'] * grid['res'],
+                  grid['x0'] + grid['width'] * grid['res'], grid['y0'])
+        gdal.Warp(self.vrt, src, format='VRT', dstSRS=grid['crs'], outputBounds=bounds, width=grid['width'],
+                  height=grid['height'], resampleAlg='near', dstNodata=float('nan'), outputType=gdal.GDT_Float32)
+        self.ds = gdal.Open(self.vrt)
+        self.shape = (grid['height'], grid['width'])
+
+    def __getitem__(self, rows):
+        start, stop, _ = rows.indices(self.shape[0])
+        return self.ds.GetRasterBand(1).ReadAsArray(0, start, self.shape[1], stop - start)
+
+    def close(self):
+        self.ds = None
+        gdal.Unlink(self.vrt)
+
+
+def convert_files(proj=None, res=30, output_format=GTIFF):
+    """Convert the ISCE outputs in the current directory
+
+    Unlike `hyp3lib.iscegeo2geotif.convert_files`, bands are read straight from the ISCE
+    rasters through VRTs rather than from full resolution temporary GeoTIFFs, GDAL's block
+    cache and warp buffers are capped, and the browse images are georeferenced from the
+    raster headers rather than by reading the full resolution phase, so memory use doesn't
+    grow with scene size.
+
+    With output_format='COG', the GeoTIFFs are cloud-optimized.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError('Unknown output format {}; expected one of {}'.format(
+            output_format, ', '.join(OUTPUT_FORMATS)))
+    gdal.SetCacheMax(GDAL_CACHE * 1024 ** 2)
+
+    makeKMZ("filt_topophase.unw.geo", "unw")
+    shutil.move("unw.kmz", "colorized_unw.kmz")
+    makeKMZ("filt_topophase.flat.geo", "col")
+    shutil.move("col.kmz", "color.kmz")
+
+    amp = select_band("filt_topophase.unw.geo.vrt", 1)
+    phase = select_band("filt_topophase.unw.geo.vrt", 2)
+
+    write = write_cog if output_format == COG else write_geotiff
+    print("Creating phase.tif")
+    write("phase.tif", phase, proj=proj, res=res)
+    print("Creating amp.tif")
+    write("amp.tif", amp, proj=proj, res=res)
+    print("Creating coherence.tif")
+    write("coherence.tif", "phsig.cor.geo.vrt", proj=proj, res=res)
+
+    if proj is not None:
+        # makeKMZ leaves a 1024 and a 2048 line high PNG of each
+        print("Creating browse images colorized_unw.png and color.png")
+        georeferenced_browse("unw.png", "colorized_unw.png", phase, proj, 1024)
+        georeferenced_browse("unw_large.png", "colorized_unw_large.png", phase, proj, 2048)
+        georeferenced_browse("col.png", "color.png", phase, proj, 1024)
+        georeferenced_browse("col_large.png", "color_large.png", phase, proj, 2048)
+
+    gdal.Unlink(amp)
+    gdal.Unlink(phase)
+
+
+def main():
+    """Main entrypoint"""
+    parser = argparse.ArgumentParser(
+        prog='iscegeo2geotif.py',
+        description='Convert the ISCE geocoded outputs in the current directory into GeoTIFF, browse and kmz files',
+    )
+    parser.add_argument("-p", "--proj", help="Projection to warp the GeoTIFFs to, like EPSG:32611")
+    parser.add_argument("-r", "--res", type=float, default=30, help="Resolution of the projected GeoTIFFs")
+    parser.add_argument("-f", "--output-format", choices=OUTPUT_FORMATS, default=GTIFF,
+                        help="Write plain tiled GeoTIFFs, or cloud-optimized GeoTIFFs with internal overviews")
+    args = parser.parse_args()
+
+    convert_files(proj=args.proj, res=args.res, output_format=args.output_format)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Run several jobs of a processor at once, each in its own slot
+
+Each slot is a process, pinned to its own share of the CPUs, that takes jobs one at a time and
+runs them in a work directory of its own. Before a job starts it reserves its memory and
+scratch disk from budgets shared by every slot, and waits while the other slots' jobs hold
+too much of either. Once its processing is done, a job shrinks its reservation to what
+zipping and uploading need, so another slot's topsApp run can start without oversubscribing
+the machine; the slot's CPUs stay pinned to it until the job finishes. Database connections
+are taken from a pool in each slot and reused between its jobs instead of being opened for
+every job.
+"""
+
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from hyp3_insar_isce.resources import available_memory, split_cpus
+
+# Seconds a slot waits for other slots to release resources before checking again
+POLL_SECONDS = 10
+
+
+class ConnectionPool:
+    """A pool of up to `size` database connections, opened with `connect` as they're needed
+
+    Connections are used as with a DB-API connection's own context manager: the transaction
+    is committed when the block exits and rolled back if it raises. Closed connections are
+    dropped from the pool.
+
+    Args:
+        connect: Function returning a new connection
+        size: Most connections open at once; callers wait for one to be returned beyond that
+    """
+    def __init__(self, connect, size=1):
+        self._connect = connect
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        conn = None
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            except BaseException:  # noqa: B902
+                if not getattr(conn, 'closed', False):
+                    conn.rollback()
+                raise
+            conn.commit()
+        finally:
+            if conn is not None and not getattr(conn, 'closed', False):
+                self._idle.put(conn)
+            self._slots.release()
+
+    def close(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ResourceThrottle:
+    """Memory and scratch disk budgets shared by the slots, reserved by each job while it runs
+
+    Create the throttle before starting the slot processes, so they share it.
+
+    Args:
+        slots: Number of slots
+        memory: Memory, in bytes, the slots' jobs can reserve between them
+        scratch: Scratch disk, in bytes, the slots' jobs can reserve between them
+        poll_seconds: Seconds to wait between checks while a job can't be admitted
+    """
+    def __init__(self, slots, memory, scratch, poll_seconds=POLL_SECONDS):
+        self.memory = memory
+        self.scratch = scratch
+        self.poll_seconds = poll_seconds
+        self._lock = multiprocessing.Lock()
+        # Reserved by each slot, so a slot that's restarted can't leak its reservation
+        self._memory = multiprocessing.Array('d', slots, lock=False)
+        self._scratch = multiprocessing.Array('d', slots, lock=False)
+
+    def reserved(self):
+        """Return the memory and scratch disk reserved by all of the slots"""
+        with self._lock:
+            return sum(self._memory), sum(self._scratch)
+
+    def try_reserve(self, slot, memory, scratch):
+        """Reserve memory and scratch disk for a slot's job if the budgets allow it, returning whether they did
+
+        A job is always admitted when no other slot holds a reservation, however much it needs.
+        """
+        with self._lock:
+            self._memory[slot] = self._scratch[slot] = 0
+            reserved_memory, reserved_scratch = sum(self._memory), sum(self._scratch)
+            idle = not reserved_memory and not reserved_scratch
+            if not idle and (reserved_memory + memory > self.memory or reserved_scratch + scratch > self.scratch):
+                return False
+            self._memory[slot] = memory
+            self._scratch[slot] = scratch
+            return True
+
+    def shrink(self, slot, memory=None, scratch=None):
+        """Lower the memory and/or scratch disk reserved by a slot's job, once it needs less; never raises them"""
+        with self._lock:
+            if memory is not None:
+                self._memory[slot] = min(self._memory[slot], memory)
+            if scratch is not None:
+                self._scratch[slot] = min(self._scratch[slot], scratch)
+
+    def release(self, slot):
+        with self._lock:
+            self._memory[slot] = self._scratch[slot] = 0
+
+    @contextmanager
+    def reserve(self, slot, memory, scratch, log=print):
+        """Wait until the budgets allow a slot's job, and hold its reservation until the block exits"""
+        waiting = False
+        while not self.try_reserve(slot, memory, scratch):
+            if not waiting:
+                log('Slot {} waiting for memory and scratch disk held by other slots'.format(slot))
+                waiting = True
+            time.sleep(self.poll_seconds)
+        try:
+            yield
+        finally:
+            self.release(slot)
+
+
+def default_budgets(scratch_dir):
+    """Return the memory and scratch disk, in bytes, free for the slots' jobs now"""
+    return available_memory(), shutil.disk_usage(scratch_dir).free
+
+
+@contextmanager
+def slot_workdir(workdir, slot):
+    """Make a work directory for a slot's job inside `workdir`, removing it afterwards"""
+    os.makedirs(workdir, exist_ok=True)
+    slot_dir = tempfile.mkdtemp(prefix='slot{}-'.format(slot), dir=workdir)
+    try:
+        yield slot_dir
+    finally:
+        shutil.rmtree(slot_dir, ignore_errors=True)
+
+
+def _run_slot(target, slot, cpus):
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    target(slot)
+
+
+def run_slots(target, slots):
+    """Run `target(slot)` in `slots` processes at once, each pinned to an equal share of the CPUs
+
+    Returns:
+        exitcodes: The exit code of each slot process
+    """
+    processes = [multiprocessing.Process(target=_run_slot, args=(target, slot, cpus), name='slot{}'.format(slot))
+                 for slot, cpus in enumerate(split_cpus(slots))]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+    return [process.exitcode for process in processes]
@@ -0,0 +1,90 @@
+"""Extract the metadata of an interferogram from SAFE annotation and isce.log files"""
+
+import glob
+import json
+import os
+import re
+from functools import lru_cache
+
+from lxml import etree
+
+# The isce.log lines to extract, and the metadata field each of them holds
+LOG_PATTERN = re.compile(
+    r'(?P<key>subset\.Overlap.*start time|Bperp at midrange for first common burst|'
+    r'geocode\.Azimuth looks|geocode\.Range looks)[^=]*=(?P<value>[^=]*)'
+)
+LOG_FIELDS = {
+    'Bperp at midrange for first common burst': 'baseline',
+    'geocode.Azimuth looks': 'azimuth_looks',
+    'geocode.Range looks': 'range_looks',
+}
+
+
+@lru_cache(maxsize=None)
+def get_heading(safe, swath=1):
+    """Return the platform heading of a SAFE from its swath annotation, reading only as far as needed"""
+    annotation = sorted(glob.glob(os.path.join(safe, 'annotation', '*-00{}.xml'.format(swath))))
+    for _, element in etree.iterparse(annotation[0], tag='platformHeading'):
+        return float(element.text)
+    return None
+
+
+def seconds_of_day(timestamp):
+    """Convert a 'YYYY-MM-DD HH:MM:SS.ffffff' timestamp to seconds since the start of its day"""
+    hours, minutes, seconds = timestamp.split(' ')[1].split(':')
+    return (int(hours) * 60 + int(minutes)) * 60 + float(seconds)
+
+
+def read_isce_log(log_file):
+    """Extract the overlap start time, baseline and looks from an isce.log in a single pass
+
+    Like topsApp, later values override earlier ones.
+    """
+    metadata = {'baseline': None, 'utctime': None, 'range_looks': None, 'azimuth_looks': None}
+    with open(log_file) as f:
+        for line in f:
+            match = LOG_PATTERN.search(line)
+            if match is None:
+                continue
+            key, value = match.group('key'), match.group('value').strip()
+            if key.startswith('subset.Overlap'):
+                metadata['utctime'] = seconds_of_day(value)
+            else:
+                metadata[LOG_FIELDS[key]] = value
+    return metadata
+
+
+def _number(value):
+    """Convert a numeric string read from isce.log to a number"""
+    if not isinstance(value, str):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def write_metadata(basename, metadata):
+    """Write metadata as both a text file and a JSON sidecar
+
+    Returns:
+        files: Names of the text and JSON files written
+    """
+    def text(value):
+        return '' if value is None else value
+
+    with open(basename + '.txt', 'w') as f:
+        f.write("baseline: %s\n" % text(metadata['baseline']))
+        f.write("utctime: %s\n" % text(metadata['utctime']))
+        f.write("heading: %s\n" % text(metadata['heading']))
+        f.write("range looks: %s\n" % text(metadata['range_looks']))
+        f.write("azimuth looks: %s\n" % text(metadata['azimuth_looks']))
+
+    with open(basename + '.json', 'w') as f:
+        json.dump({key: _number(value) for key, value in metadata.items()}, f, indent=2)
+
+    return [os.path.basename(basename) + '.txt', os.path.basename(basename) + '.json']
@@ -0,0 +1,176 @@
+"""Measure the wall time, CPU time, peak memory and I/O of processing stages
+
+Measurements are taken around each stage from `resource.getrusage` and `/proc/self/io`,
+which include the child processes (topsApp, snaphu, GDAL) the stage waited for. When
+stages run concurrently, their CPU time and I/O overlap and each stage's figures include
+the work of the others running at the same time.
+
+The peak memory of a stage is that of the commands it runs through `execute`, each taken
+from the resource usage of that command alone, since the peak `getrusage` reports for the
+children of a process covers every child it ever had.
+"""
+
+import json
+import os
+import resource
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+from hyp3lib import ExecuteError
+
+REPORT_NAME = 'stack_metrics'
+PROMETHEUS_PREFIX = 'hyp3_insar_isce_stage_'
+
+# Measurement, description and how to combine repeated stages for the Prometheus report
+FIELDS = (
+    ('wall_seconds', 'Wall time of the stage', sum),
+    ('cpu_seconds', 'CPU time of this process and its children during the stage', sum),
+    ('max_rss_bytes', 'Peak resident memory of the largest command the stage ran', max),
+    ('read_bytes', 'Bytes read from storage during the stage', sum),
+    ('write_bytes', 'Bytes written to storage during the stage', sum),
+)
+FIELD_NAMES = [field for field, _, _ in FIELDS]
+
+# The stages running in each thread, innermost last, which the commands it runs are measured for
+_active = threading.local()
+
+
+def _io_bytes():
+    counters = {'read_bytes': 0, 'write_bytes': 0}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                name, value = line.split(':')
+                if name in counters:
+                    counters[name] = int(value)
+    except OSError:
+        pass
+    return counters
+
+
+def _snapshot():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    snapshot = {
+        'wall_seconds': time.monotonic(),
+        'cpu_seconds': usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime,
+    }
+    snapshot.update(_io_bytes())
+    return snapshot
+
+
+def execute(cmd):
+    """Run a shell command like hyp3lib's execute, and add its peak memory to the stages running in this thread
+
+    The command is reaped with `os.wait4`, whose resource usage is that of the command and
+    the processes it waited for, like topsApp.py under the shell.
+
+    Returns:
+        output: The combined stdout and stderr of the command
+
+    Raises:
+        ExecuteError: If the command exits with a nonzero status
+    """
+    print('Running command: ' + cmd)
+    pipe = subprocess.Popen(cmd + ' 2>&1', shell=True, stdout=subprocess.PIPE, universal_newlines=True)
+    output = pipe.stdout.read()
+    pipe.stdout.close()
+    _, status, usage = os.wait4(pipe.pid, 0)
+    pipe.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+
+    # ru_maxrss is in kilobytes on Linux
+    for peak in getattr(_active, 'stages', []):
+        peak['max_rss_bytes'] = max(peak['max_rss_bytes'], usage.ru_maxrss * 1024)
+
+    lines = [line for line in output.split('\n') if line.rstrip()]
+    for line in lines:
+        print('Proc: ' + line)
+    print('Finished: ' + cmd)
+    if pipe.returncode != 0:
+        # Like hyp3lib, report the first error line, or else the last line of output
+        errors = [line for line in lines if 'ERROR' in line.upper()]
+        last = errors[0] if errors else lines[-1] if lines else 'Nonzero return value: {}'.format(pipe.returncode)
+        raise ExecuteError('{}: {}'.format(cmd.split(' ')[0], last))
+    return output
+
+
+def _human_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return '%.1f %s' % (size, unit)
+        size /= 1024
+    return '%.1f TB' % size
+
+
+class Metrics:
+    """Records the measurements of named, labeled stages
+
+    Use `stage` as a context manager around each stage; it's safe to use from several threads.
+    """
+    def __init__(self, log=print):
+        self.log = log
+        self.records = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, **labels):
+        if not hasattr(_active, 'stages'):
+            _active.stages = []
+        peak = {'max_rss_bytes': 0}
+        _active.stages.append(peak)
+        start = _snapshot()
+        try:
+            yield
+        finally:
+            end = _snapshot()
+            _active.stages.remove(peak)
+            record = dict(stage=name, **labels)
+            for field in FIELD_NAMES:
+                record[field] = peak[field] if field == 'max_rss_bytes' else end[field] - start[field]
+            with self._lock:
+                self.records.append(record)
+            self.log('Stage {}{} took {:.1f}s wall, {:.1f}s CPU, read {}, wrote {}; peak command memory {}'.format(
+                name, ''.join(' {}={}'.format(k, v) for k, v in labels.items()), record['wall_seconds'],
+                record['cpu_seconds'], _human_bytes(record['read_bytes']), _human_bytes(record['write_bytes']),
+                _human_bytes(record['max_rss_bytes']),
+            ))
+
+    def extend(self, records):
+        with self._lock:
+            self.records.extend(records)
+
+    def load(self, json_file):
+        """Add the records of a JSON report, like one written by a child process"""
+        with open(json_file) as f:
+            self.extend(json.load(f)['stages'])
+
+    def write_json(self, json_file):
+        with open(json_file, 'w') as f:
+            json.dump({'stages': self.records}, f, indent=2)
+
+    def write_prometheus(self, prom_file):
+        """Write the records in the Prometheus text format, for the node exporter's textfile collector"""
+        lines = []
+        for field, description, combine in FIELDS:
+            metric = PROMETHEUS_PREFIX + field
+            lines.append('# HELP {} {}'.format(metric, description))
+            lines.append('# TYPE {} gauge'.format(metric))
+            values = {}
+            for record in self.records:
+                labels = tuple((k, v) for k, v in record.items() if k not in FIELD_NAMES)
+                values.setdefault(labels, []).append(record[field])
+            for labels, samples in values.items():
+                label_text = ','.join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in labels)
+                lines.append('{}{{{}}} {}'.format(metric, label_text, combine(samples)))
+
+        # The textfile collector may read at any time, so replace the file atomically
+        with open(prom_file + '.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(prom_file + '.tmp', prom_file)
+
+    def write(self, basename=REPORT_NAME):
+        """Write both a JSON and a Prometheus report, basename.json and basename.prom"""
+        self.write_json(basename + '.json')
+        self.write_prometheus(basename + '.prom')
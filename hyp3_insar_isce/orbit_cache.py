@@ -0,0 +1,161 @@
+"""Persistent, size-bounded cache of Sentinel-1 orbit files"""
+
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from hyp3lib import OrbitDownloadError
+from hyp3lib.get_orb import downloadSentinelOrbitFile
+
+from hyp3_insar_isce.cache_index import CacheIndex
+from hyp3_insar_isce.file_system import link_or_symlink
+
+EOF_PATTERN = re.compile(
+    r'^(?P<mission>S1[AB])_OPER_(?P<type>AUX_(?:POE|RES)ORB)_OPOD_(?P<created>\d{8}T\d{6})'
+    r'_V(?P<start>\d{8}T\d{6})_(?P<stop>\d{8}T\d{6})\.EOF$',
+    re.IGNORECASE,
+)
+
+# Preferred orbit types, most precise first
+ORBIT_TYPES = ('AUX_POEORB', 'AUX_RESORB')
+
+
+def parse_orbit_name(filename):
+    """Return the mission, orbit type, creation time, and validity window of an orbit file name"""
+    match = EOF_PATTERN.match(os.path.basename(filename))
+    if match is None:
+        return None
+    entry = match.groupdict()
+    entry['mission'] = entry['mission'].upper()
+    entry['type'] = entry['type'].upper()
+    return entry
+
+
+def granule_window(granule):
+    """Return the mission, start time, and stop time of a Sentinel-1 granule"""
+    t = re.split('_+', os.path.basename(granule))
+    return t[0], t[4], t[5]
+
+
+class OrbitCache:
+    """A directory of orbit files indexed by mission and validity window
+
+    Orbit files are fetched once, from ESA/ASF or from a local `source_dir` of EOF files,
+    and then linked into every directory that needs them. The least recently used files
+    are evicted once the cache holds more than `max_bytes`.
+    """
+    index_name = 'index.json'
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3, source_dir=None):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.source_dir = source_dir
+        self._lock = threading.Lock()
+        self._fetch_locks = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._index = CacheIndex(self.cache_dir, max_bytes, lambda name: [os.path.join(self.cache_dir, name)],
+                                 kind='orbit file', index_name=self.index_name)
+
+    @staticmethod
+    def _best_match(index, granule):
+        mission, start, stop = granule_window(granule)
+        matches = [
+            (ORBIT_TYPES.index(entry['type']), entry['created'], name) for name, entry in index.items()
+            if entry['mission'] == mission and entry['start'] < start and entry['stop'] > stop
+        ]
+        if not matches:
+            return None
+        # most precise orbit type, then the most recently created
+        return sorted(matches, key=lambda m: (m[0], -int(m[1].replace('T', ''))))[0][2]
+
+    def lookup(self, granule):
+        """Return the cached orbit file for a granule, or None if there isn't one"""
+        with self._index.locked() as index:
+            name = self._best_match(index, granule)
+            if name is None or not os.path.isfile(os.path.join(self.cache_dir, name)):
+                return None
+            index[name]['last_used'] = time.time()
+            return os.path.join(self.cache_dir, name)
+
+    def add(self, orbit_file):
+        """Move an orbit file into the cache and index it"""
+        name = os.path.basename(orbit_file)
+        entry = parse_orbit_name(name)
+        if entry is None:
+            raise OrbitDownloadError('Not a Sentinel-1 orbit file: {}'.format(orbit_file))
+
+        cached = os.path.join(self.cache_dir, name)
+        if os.path.abspath(orbit_file) != cached:
+            shutil.move(orbit_file, cached)
+
+        with self._index.locked() as index:
+            entry['size'] = os.path.getsize(cached)
+            entry['last_used'] = time.time()
+            index[name] = entry
+            self._index.evict(index, keep=name)
+        return cached
+
+    def _fetch(self, granule):
+        if self.source_dir is None:
+            orbit_file, provider = downloadSentinelOrbitFile(granule, directory=self.cache_dir)
+            print('Downloaded orbit file {} from {}'.format(os.path.basename(orbit_file), provider))
+            return orbit_file
+
+        index = {name: parse_orbit_name(name) for name in os.listdir(self.source_dir) if parse_orbit_name(name)}
+        name = self._best_match(index, granule)
+        if name is None:
+            raise OrbitDownloadError('No orbit file for {} in {}'.format(granule, self.source_dir))
+        orbit_file = os.path.join(self.cache_dir, name)
+        shutil.copyfile(os.path.join(self.source_dir, name), orbit_file)
+        return orbit_file
+
+    def get(self, granule):
+        """Return the cached orbit file for a granule, fetching it into the cache if needed"""
+        orbit_file = self.lookup(granule)
+        if orbit_file is not None:
+            return orbit_file
+
+        # Granules acquired on the same day share an orbit file; only fetch it once
+        mission, start, _ = granule_window(granule)
+        with self._lock:
+            fetch_lock = self._fetch_locks.setdefault((mission, start[:8]), threading.Lock())
+        with fetch_lock:
+            orbit_file = self.lookup(granule)
+            if orbit_file is None:
+                orbit_file = self.add(self._fetch(granule))
+        return orbit_file
+
+    def link(self, granule, directory):
+        """Link the orbit file for a granule into a directory
+
+        Returns:
+            orbit_file: The linked orbit file
+        """
+        cached = self.get(granule)
+        orbit_file = os.path.join(directory, os.path.basename(cached))
+        if not os.path.exists(orbit_file):
+            link_or_symlink(cached, orbit_file)
+        return orbit_file
+
+    def prefetch(self, granules, workers=8):
+        """Fetch the orbit files for many granules at once
+
+        Returns:
+            orbit_files: dict of granule to its cached orbit file
+        """
+        # Look up everything already cached in a single pass over the index
+        orbit_files = {}
+        with self._index.locked() as index:
+            for granule in granules:
+                name = self._best_match(index, granule)
+                if name is not None and os.path.isfile(os.path.join(self.cache_dir, name)):
+                    index[name]['last_used'] = time.time()
+                    orbit_files[granule] = os.path.join(self.cache_dir, name)
+
+        missing = [granule for granule in granules if granule not in orbit_files]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            orbit_files.update(zip(missing, executor.map(self.get, missing)))
+        return orbit_files
@@ -0,0 +1,210 @@
+"""Choose the pairs of a stack to make interferograms of
+
+Pairs are limited by temporal and perpendicular baseline, and by the number of connections
+per scene. Perpendicular baselines are estimated from the orbit state vectors and
+geolocation grid in each scene's annotation, so they are known before topsApp runs.
+"""
+
+import glob
+import os
+from datetime import datetime
+
+import numpy as np
+from lxml import etree
+
+# WGS84 ellipsoid
+SEMI_MAJOR_AXIS = 6378137.0
+ECCENTRICITY_SQUARED = 6.69437999014e-3
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def parse_date(filedate):
+    """Parse a scene date, like 20160408T091355, as returned by `get_file_list`"""
+    return datetime.strptime(filedate[:15], '%Y%m%dT%H%M%S')
+
+
+def _seconds(timestamp):
+    return (datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%f') - EPOCH).total_seconds()
+
+
+def _vector(element):
+    return np.array([float(element.findtext(axis)) for axis in 'xyz'])
+
+
+def to_ecef(lat, lon, height):
+    """Convert geodetic coordinates, in degrees and meters, to Earth-centered Earth-fixed coordinates"""
+    lat, lon = np.radians(lat), np.radians(lon)
+    radius = SEMI_MAJOR_AXIS / np.sqrt(1 - ECCENTRICITY_SQUARED * np.sin(lat) ** 2)
+    return np.array([
+        (radius + height) * np.cos(lat) * np.cos(lon),
+        (radius + height) * np.cos(lat) * np.sin(lon),
+        (radius * (1 - ECCENTRICITY_SQUARED) + height) * np.sin(lat),
+    ])
+
+
+def find_annotation(safe, swath):
+    """Return the annotation file of a subswath of a SAFE"""
+    return sorted(glob.glob(os.path.join(safe, 'annotation', '*-00{}.xml'.format(swath))))[0]
+
+
+def read_orbit(annotation):
+    """Read the orbit state vectors of an annotation file
+
+    Returns:
+        times: Time of each state vector, in seconds since 1970
+        positions: (N, 3) array of ECEF positions
+        velocities: (N, 3) array of ECEF velocities
+    """
+    times, positions, velocities = [], [], []
+    for _, orbit in etree.iterparse(annotation, tag='orbit'):
+        times.append(_seconds(orbit.findtext('time')))
+        positions.append(_vector(orbit.find('position')))
+        velocities.append(_vector(orbit.find('velocity')))
+        orbit.clear()
+    return np.array(times), np.array(positions), np.array(velocities)
+
+
+def read_center(annotation):
+    """Return the ECEF coordinates of the center of an annotation file's geolocation grid"""
+    points = []
+    for _, point in etree.iterparse(annotation, tag='geolocationGridPoint'):
+        points.append([float(point.findtext(name)) for name in ('latitude', 'longitude', 'height')])
+        point.clear()
+    lat, lon, height = np.mean(points, axis=0)
+    return to_ecef(lat, lon, height)
+
+
+def interpolate_orbit(orbit, t):
+    """Interpolate the position and velocity of an orbit at time t with cubic Hermite splines"""
+    times, positions, velocities = orbit
+    i = int(np.clip(np.searchsorted(times, t) - 1, 0, len(times) - 2))
+    dt = times[i + 1] - times[i]
+    s = (t - times[i]) / dt
+
+    h00, h10, h01, h11 = 2 * s**3 - 3 * s**2 + 1, s**3 - 2 * s**2 + s, -2 * s**3 + 3 * s**2, s**3 - s**2
+    position = (h00 * positions[i] + h10 * dt * velocities[i]
+                + h01 * positions[i + 1] + h11 * dt * velocities[i + 1])
+
+    d00, d10, d01, d11 = 6 * s**2 - 6 * s, 3 * s**2 - 4 * s + 1, -6 * s**2 + 6 * s, 3 * s**2 - 2 * s
+    velocity = (d00 * positions[i] + d10 * dt * velocities[i]
+                + d01 * positions[i + 1] + d11 * dt * velocities[i + 1]) / dt
+    return position, velocity
+
+
+def zero_doppler_position(orbit, target, iterations=10):
+    """Return the position and velocity of the satellite when it is closest to target"""
+    times = orbit[0]
+    t = times[len(times) // 2]
+    for _ in range(iterations):
+        position, velocity = interpolate_orbit(orbit, t)
+        step = np.dot(position - target, velocity) / np.dot(velocity, velocity)
+        t -= step
+        if abs(step) < 1e-6:
+            break
+    return interpolate_orbit(orbit, t)
+
+
+def estimate_baselines(filenames, swath):
+    """Estimate the perpendicular baseline of each scene relative to the first
+
+    The perpendicular baseline of a pair is the difference of the baselines of its scenes.
+
+    Args:
+        filenames: SAFE files of the stack
+        swath: Subswath number the pairs will be processed for
+
+    Returns:
+        baselines: Perpendicular baseline of each scene, in meters
+    """
+    target = None
+    reference = None
+    baselines = []
+    for safe in filenames:
+        annotation = find_annotation(safe, swath)
+        if target is None:
+            target = read_center(annotation)
+        position, velocity = zero_doppler_position(read_orbit(annotation), target)
+        if reference is None:
+            reference = position
+            look = (target - position) / np.linalg.norm(target - position)
+            perpendicular = np.cross(velocity / np.linalg.norm(velocity), look)
+        baselines.append(float(np.dot(position - reference, perpendicular)))
+    return baselines
+
+
+class _Components:
+    """Union-find over scene indices"""
+    def __init__(self, count):
+        self.parent = list(range(count))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i, j):
+        i, j = self.find(i), self.find(j)
+        if i == j:
+            return False
+        self.parent[j] = i
+        return True
+
+
+def build_network(filedates, baselines=None, max_days=None, max_bperp=None, connections=2, connected=True):
+    """Choose the pairs of a stack to process
+
+    Each scene is paired with up to `connections` of the scenes following it in time that
+    are within the baseline limits. With the default arguments, that is each scene's nearest
+    and second-nearest following scene, like the stack driver always paired them.
+
+    Args:
+        filedates: Date of each scene, as returned by `get_file_list`, in time order
+        baselines: Perpendicular baseline of each scene, from `estimate_baselines`; required with max_bperp
+        max_days: Longest temporal baseline of a pair, in days
+        max_bperp: Longest perpendicular baseline of a pair, in meters
+        connections: Maximum number of later scenes to pair each scene with
+        connected: Add the shortest pairs needed to connect every scene, even if they exceed the limits
+
+    Returns:
+        pairs: List of (earlier, later) scene index tuples
+    """
+    if max_bperp is not None and baselines is None:
+        raise ValueError('baselines are required to limit the perpendicular baseline')
+
+    dates = [parse_date(filedate) for filedate in filedates]
+
+    def days(i, j):
+        return (dates[j] - dates[i]).total_seconds() / 86400
+
+    def bperp(i, j):
+        return abs(baselines[j] - baselines[i]) if baselines is not None else 0.0
+
+    pairs = []
+    components = _Components(len(dates))
+    for i in range(len(dates)):
+        paired = 0
+        for j in range(i + 1, len(dates)):
+            if paired == connections or (max_days is not None and days(i, j) > max_days):
+                break
+            if max_bperp is not None and bperp(i, j) > max_bperp:
+                continue
+            pairs.append((i, j))
+            components.union(i, j)
+            paired += 1
+
+    if connected and len(dates) > 1:
+        # Join the disconnected parts of the network with the shortest pairs between them
+        day_scale = max_days or max(days(0, len(dates) - 1), 1.0)
+        bperp_scale = max_bperp or max(max(baselines) - min(baselines) if baselines is not None else 0.0, 1.0)
+        candidates = sorted(
+            (days(i, j) / day_scale + bperp(i, j) / bperp_scale, i, j)
+            for i in range(len(dates)) for j in range(i + 1, len(dates))
+        )
+        for _, i, j in candidates:
+            if components.union(i, j):
+                print("Adding pair %s_%s to connect the network" % (filedates[i], filedates[j]))
+                pairs.append((i, j))
+
+    return sorted(pairs)
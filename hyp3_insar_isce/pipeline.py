@@ -0,0 +1,64 @@
+"""Run many items through a sequence of stages, each stage with its own concurrency limit"""
+
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_pipeline(items, stages, limits, finish=None):
+    """Run every item through the stages in order, overlapping the stages of different items
+
+    An item moves to the next stage as soon as it leaves the previous one, so while one
+    item is in a CPU-bound stage the next can already be in an I/O-bound one. Stage
+    functions run in worker threads and are expected to do their work in subprocesses.
+
+    Args:
+        items: Items to process
+        stages: Sequence of (stage name, function) pairs; each function is called with an item
+        limits: dict of stage name to the maximum number of items in that stage at once
+        finish: Function called with each item, in this thread and in the order of items,
+            once the item has passed through every stage. No stage is submitted while it
+            runs, so slow work, like collecting an item's results, belongs in a stage
+
+    Raises:
+        The first exception raised by a stage or by finish, after every other item has been processed
+    """
+    executors = {name: ThreadPoolExecutor(max_workers=limits.get(name, 1)) for name, _ in stages}
+    events = queue.Queue()
+
+    def submit(index, stage):
+        name, func = stages[stage]
+        future = executors[name].submit(func, items[index])
+        future.add_done_callback(lambda f: events.put((index, stage, f)))
+
+    for index in range(len(items)):
+        submit(index, 0)
+
+    errors = {}
+    done = set()
+    next_index = 0
+    try:
+        while next_index < len(items):
+            index, stage, future = events.get()
+            if future.exception() is not None:
+                print("ERROR: stage %s failed for %s: %s" % (stages[stage][0], items[index], future.exception()))
+                errors[index] = future.exception()
+                done.add(index)
+            elif stage + 1 < len(stages):
+                submit(index, stage + 1)
+            else:
+                done.add(index)
+
+            while next_index in done:
+                if next_index not in errors and finish is not None:
+                    try:
+                        finish(items[next_index])
+                    except Exception as e:  # noqa: B902
+                        print("ERROR: finishing %s failed: %s" % (items[next_index], e))
+                        errors[next_index] = e
+                next_index += 1
+    finally:
+        for executor in executors.values():
+            executor.shutdown()
+
+    if errors:
+        raise errors[min(errors)]
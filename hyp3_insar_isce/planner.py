@@ -0,0 +1,214 @@
+"""Estimate the scratch disk, memory and CPU time a stack needs before processing it
+
+Each topsApp stage of a pair, and its GeoTIFF conversion, is assumed to use resources in
+proportion to the pixels of the bursts the pair processes: the bursts of the subswath in
+the region of interest times the lines per burst and samples per line in the annotation.
+The coefficients start at rough figures for full IW subswaths and are calibrated from the
+plans and metrics reports of past stacks:
+
+    calibrateS1StackPlan.py STACK_DIR [STACK_DIR ...] -o planner_model.json
+
+Stages of concurrent pairs overlap in the metrics reports, so stacks processed with more than
+one worker calibrate the model conservatively.
+"""
+
+import argparse
+import copy
+import heapq
+import json
+import os
+
+from hyp3_insar_isce import __version__, bursts, checkpoint
+from hyp3_insar_isce.metrics import REPORT_NAME
+
+PLAN_FILE = 'stack_plan.json'
+MODEL_FILE = 'planner_model.json'
+
+# Stages of a pair the model covers, in order
+STAGES = checkpoint.STAGE_NAMES + ('geotiff',)
+
+# Resources the model predicts, and the metrics field each is calibrated from
+RESOURCES = {
+    'scratch_bytes': 'write_bytes',
+    'memory_bytes': 'max_rss_bytes',
+    'cpu_seconds': 'cpu_seconds',
+}
+
+# Resources used per pixel by each stage of a full IW subswath pair, before calibration
+DEFAULT_MODEL = {
+    'preprocess': {'scratch_bytes': 40.0, 'memory_bytes': 4.0, 'cpu_seconds': 8e-6},
+    'filter': {'scratch_bytes': 24.0, 'memory_bytes': 6.0, 'cpu_seconds': 4e-6},
+    'unwrap': {'scratch_bytes': 2.0, 'memory_bytes': 14.0, 'cpu_seconds': 6e-6},
+    'geocode': {'scratch_bytes': 12.0, 'memory_bytes': 6.0, 'cpu_seconds': 2e-6},
+    'geotiff': {'scratch_bytes': 4.0, 'memory_bytes': 1.0, 'cpu_seconds': 1e-6},
+}
+
+GB = 1024 ** 3
+
+
+def load_model(model_file=None):
+    """Return the default model, updated with the coefficients of a calibrated model file if given"""
+    model = copy.deepcopy(DEFAULT_MODEL)
+    if model_file is not None:
+        with open(model_file) as f:
+            for stage, coefficients in json.load(f)['stages'].items():
+                model.setdefault(stage, {}).update(coefficients)
+    return model
+
+
+def pair_pixels(reference, secondary, roi=None):
+    """Return the number of bursts, and of pixels, a pair processes
+
+    Args:
+        reference: Catalog entry of the subswath in the reference scene, from `scene_catalog`
+        secondary: Catalog entry of the subswath in the secondary scene
+        roi: Region of interest (south, north, west, east) topsApp is given, if any
+    """
+    counts = [len(bursts.select_bursts(swath, roi)) if roi is not None else len(swath['bursts'])
+              for swath in (reference, secondary)]
+    count = min(counts)
+    return count, count * reference['lines_per_burst'] * reference['samples']
+
+
+def plan_pair(pair_dir, swath, reference, secondary, roi=None, stages=STAGES, model=DEFAULT_MODEL):
+    """Return the plan of a pair: its size and the resources each of its remaining stages needs
+
+    A pair's scratch disk and CPU time are the sums over its stages; its memory is the peak.
+    """
+    count, pixels = pair_pixels(reference, secondary, roi)
+    plan = {'pair_dir': pair_dir, 'swath': swath, 'bursts': count, 'pixels': pixels, 'stages': {}}
+    for stage in stages:
+        plan['stages'][stage] = {resource: model[stage][resource] * pixels for resource in RESOURCES}
+    _total(plan, plan['stages'].values())
+    return plan
+
+
+def _total(plan, parts):
+    parts = list(parts)
+    plan['scratch_bytes'] = sum(part['scratch_bytes'] for part in parts)
+    plan['memory_bytes'] = max((part['memory_bytes'] for part in parts), default=0)
+    plan['cpu_seconds'] = sum(part['cpu_seconds'] for part in parts)
+
+
+def plan_stack(pairs):
+    """Return the plan of a stack from the plans of its pairs, with the totals of each stage"""
+    plan = {'pairs': pairs, 'stages': {}}
+    for stage in STAGES:
+        stage_plans = [pair['stages'][stage] for pair in pairs if stage in pair['stages']]
+        if stage_plans:
+            plan['stages'][stage] = {}
+            _total(plan['stages'][stage], stage_plans)
+    _total(plan, pairs)
+    return plan
+
+
+def _describe(plan):
+    return '{:8.1f} GB scratch {:6.1f} GB memory {:8.2f} CPU hours'.format(
+        plan['scratch_bytes'] / GB, plan['memory_bytes'] / GB, plan['cpu_seconds'] / 3600,
+    )
+
+
+def print_plan(plan):
+    for pair in plan['pairs']:
+        print('{pair_dir} {swath} {bursts:2d} bursts {mpx:8.1f} Mpx '.format(mpx=pair['pixels'] / 1e6, **pair)
+              + _describe(pair))
+    for stage, stage_plan in plan['stages'].items():
+        print('{:10s} {}'.format(stage, _describe(stage_plan)))
+    print('Stack of {} pairs: {}'.format(len(plan['pairs']), _describe(plan)))
+
+
+def write_plan(plan, plan_file=PLAN_FILE):
+    with open(plan_file + '.tmp', 'w') as f:
+        json.dump(plan, f, indent=2)
+    os.replace(plan_file + '.tmp', plan_file)
+
+
+def fit_plan(plan, free_scratch, free_memory, reclaimed=False, in_flight=1):
+    """Return the pairs of a plan that fit in the free scratch disk and memory, in order
+
+    Every pair must fit in memory on its own. When the whole stack doesn't fit in the scratch
+    disk, the pairs that do, in order, make a first batch and the rest are left for later.
+    When each pair's scratch disk is reclaimed once it's collected, only the `in_flight` pairs
+    being processed at once need to fit, so a batch is limited by its largest pairs rather
+    than by all of them.
+
+    Raises:
+        ValueError: If even the first pair can't be processed here
+    """
+    for pair in plan['pairs']:
+        if pair['memory_bytes'] > free_memory:
+            raise ValueError('Pair {pair_dir} {swath} needs an estimated {need:.1f} GB of memory; '
+                             'only {free:.1f} GB is available'.format(need=pair['memory_bytes'] / GB,
+                                                                      free=free_memory / GB, **pair))
+    batch = []
+    for pair in plan['pairs']:
+        scratch = [other['scratch_bytes'] for other in batch + [pair]]
+        if reclaimed:
+            scratch = heapq.nlargest(in_flight, scratch)
+        if sum(scratch) > free_scratch:
+            break
+        batch.append(pair)
+    if plan['pairs'] and not batch:
+        raise ValueError('Pair {pair_dir} {swath} needs an estimated {need:.1f} GB of scratch disk; only {free:.1f} GB '
+                         'is free'.format(need=plan['pairs'][0]['scratch_bytes'] / GB, free=free_scratch / GB,
+                                          **plan['pairs'][0]))
+    return batch
+
+
+def calibrate(stack_dirs, model=None):
+    """Fit the model to the plans and metrics reports of processed stacks
+
+    Each stage's scratch disk and CPU time per pixel are the totals measured over the totals
+    planned; its memory per pixel is the largest measured, so the model doesn't underestimate it.
+
+    Returns:
+        model: The calibrated coefficients, with the default ones for stages that were never measured
+    """
+    measured = {}
+    for stack_dir in stack_dirs:
+        with open(os.path.join(stack_dir, PLAN_FILE)) as f:
+            pixels = {(pair['pair_dir'], pair['swath']): pair['pixels'] for pair in json.load(f)['pairs']}
+        with open(os.path.join(stack_dir, REPORT_NAME + '.json')) as f:
+            records = json.load(f)['stages']
+        for record in records:
+            key = (record.get('pair'), record.get('swath'))
+            if record['stage'] not in STAGES or not pixels.get(key):
+                continue
+            measured.setdefault(record['stage'], []).append((pixels[key], record))
+
+    model = copy.deepcopy(model or DEFAULT_MODEL)
+    for stage, samples in measured.items():
+        total_pixels = sum(pixels for pixels, _ in samples)
+        model[stage] = {
+            'scratch_bytes': sum(record['write_bytes'] for _, record in samples) / total_pixels,
+            # Stages that ran no commands, like ones resumed from a checkpoint, measure no memory
+            'memory_bytes': max(record['max_rss_bytes'] / pixels for pixels, record in samples) or
+            model[stage]['memory_bytes'],
+            'cpu_seconds': sum(record['cpu_seconds'] for _, record in samples) / total_pixels,
+        }
+        print('Calibrated {} from {} pairs: {}'.format(stage, len(samples), model[stage]))
+    return model
+
+
+def main():
+    """Main entrypoint"""
+    parser = argparse.ArgumentParser(
+        prog='calibrateS1StackPlan.py',
+        description='Calibrate the resource planner of procS1StackISCE.py from the plans and metrics reports of '
+                    'processed stacks',
+    )
+    parser.add_argument("stack_dirs", nargs='+',
+                        help="Working directories of processed stacks, with %s and %s.json" % (PLAN_FILE, REPORT_NAME))
+    parser.add_argument("-o", "--output", default=MODEL_FILE,
+                        help="Model file to write, for procS1StackISCE.py --plan-model")
+    parser.add_argument('--version', action='version', version=f'hyp3_insar_isce {__version__}')
+    args = parser.parse_args()
+
+    model = calibrate(args.stack_dirs)
+    with open(args.output, 'w') as f:
+        json.dump({'stages': model}, f, indent=2)
+    print('Wrote %s' % args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,37 +2,140 @@
 
 import argparse
 import os
+import shutil
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 from hyp3lib import getSubSwath
-from hyp3lib.file_subroutines import get_file_list
 from hyp3lib.file_subroutines import prepare_files
+from hyp3lib.get_dem import get_ISCE_dem
 
-from hyp3_insar_isce import __version__
-from hyp3_insar_isce.proc_s1_stack_isce import proc_s1_stack_isce
+from hyp3_insar_isce import __version__, scene_catalog
+from hyp3_insar_isce.dem_cache import DemCache
+from hyp3_insar_isce.file_system import link_or_copy
+from hyp3_insar_isce.iscegeo2geotif import GTIFF, OUTPUT_FORMATS
+from hyp3_insar_isce.metrics import Metrics
+from hyp3_insar_isce.orbit_cache import OrbitCache
+from hyp3_insar_isce.proc_s1_stack_isce import PAIR_MEMORY, proc_s1_stack_isce, subswath_bounding_box
+from hyp3_insar_isce.resources import available_cpus, split_cpus
 
 
-def proc_all_s1_stack_isce(south, north, west, east, csv_file=None, dem=None):
+def union_bounding_box(boxes):
+    """Return the bounding box (south, north, west, east) covering all of the given boxes"""
+    souths, norths, wests, easts = zip(*boxes)
+    return min(souths), max(norths), min(wests), max(easts)
+
+
+def link_scenes(filenames, work_dir):
+    """Link the SAFE files of the stack into a working directory"""
+    for filename in filenames:
+        link = os.path.join(work_dir, filename)
+        if not os.path.lexists(link):
+            os.symlink(os.path.abspath(filename), link)
+
+
+def merge_products(work_dir, product_dir="PRODUCT"):
+    """Link the products of a subswath's working directory into the shared product directory"""
+    subswath_products = os.path.join(work_dir, "PRODUCT")
+    if not os.path.isdir(subswath_products):
+        return
+    for name in sorted(os.listdir(subswath_products)):
+        link_or_copy(os.path.join(subswath_products, name), os.path.join(product_dir, name))
+
+
+def _process_subswath(work_dir, cpus, subswath, scenes, dem_file, workers, pair_memory, orbit_cache_dir, roi,
+                      output_format, catalog_file, scratch_disk):
+    """Process the stack of one subswath in its own working directory, pinned to a share of the CPUs"""
+    os.chdir(work_dir)
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    proc_s1_stack_isce(ss=subswath, scenes=scenes, dem_file=dem_file, workers=workers, pair_memory=pair_memory,
+                       orbit_cache_dir=orbit_cache_dir, burst_roi=roi, output_format=output_format,
+                       catalog_file=catalog_file, scratch_disk=scratch_disk)
+
+
+def proc_all_s1_stack_isce(south, north, west, east, csv_file=None, dem=None, workers=None, pair_memory=PAIR_MEMORY,
+                           orbit_cache_dir=None, dem_cache_dir=None, output_format=GTIFF):
     """Main process
 
         south,north,west,east -- bounding box
         csv_file = file to fetch granules from using get_asf.py
         dem = if TRUE, use ASF get_dem instead of opentopo
+        workers = Maximum number of pairs in each CPU-bound topsApp stage, shared between all subswaths
+        pair_memory = Peak memory, in GB, needed to process a single pair
+        orbit_cache_dir = Directory to cache orbit files in, shared between subswaths
+        dem_cache_dir = Directory to cache DEM tiles and DEMs in, shared between runs
+        output_format = Format of the collected GeoTIFFs: GTiff, or COG for cloud-optimized GeoTIFFs
+
+        Each subswath is processed at the same time in its own working directory, iwN, with
+        an equal share of the CPUs, memory and free scratch disk, and its products are linked into PRODUCT. Only
+        the bursts of each subswath that intersect the bounding box are processed. The SAFE
+        files are indexed once, into the scene catalog every subswath reads.
     """
     # If file list is given, download the files and unzip them
     if csv_file is not None:
         prepare_files(csv_file)
 
-    (filenames, filesdates) = get_file_list()
+    catalog = scene_catalog.connect()
+    scene_catalog.update(catalog)
+    (filenames, filesdates) = scene_catalog.get_file_list(catalog)
 
     swaths, roi = getSubSwath.SelectAllSubswaths(filenames[0], west, south, east, north)
 
     if len(swaths) == 0:
         sys.exit("ERROR: No overlap of bounding box with imagery")
     print("Found {} subswath(s) to process".format(len(swaths)))
+    swaths = [int(subswath) for subswath in swaths]
+
+    metrics = Metrics()
+    dem_file = None
+    if dem:
+        # One DEM covering every subswath
+        dem_south, dem_north, dem_west, dem_east = union_bounding_box(
+            [subswath_bounding_box(filenames[0], subswath, catalog) for subswath in swaths]
+        )
+        dem_getter = get_ISCE_dem if dem_cache_dir is None else DemCache(dem_cache_dir).get_ISCE_dem
+        with metrics.stage('dem'):
+            dem_getter(dem_west, dem_south, dem_east, dem_north, "stack_dem.dem", "stack_dem.dem.xml")
+        dem_file = os.path.abspath("stack_dem.dem")
+
+    if orbit_cache_dir is not None:
+        orbit_cache_dir = os.path.abspath(orbit_cache_dir)
+        with metrics.stage('orbits'):
+            OrbitCache(orbit_cache_dir).prefetch(filenames)
 
+    workers = workers or available_cpus()
+    swath_workers = max(workers // len(swaths), 1)
+    # Each subswath sees all of the available memory, so it admits pairs as if they needed its share of it
+    swath_memory = pair_memory * len(swaths)
+    # The subswaths' working directories share a disk, so each plans its pairs for its share of the free space
+    swath_scratch = shutil.disk_usage(".").free // len(swaths)
+
+    work_dirs = []
     for subswath in swaths:
-        proc_s1_stack_isce(dem=dem, ss=int(subswath))
+        work_dir = os.path.abspath("iw%s" % subswath)
+        if not os.path.exists(work_dir):
+            os.mkdir(work_dir)
+        link_scenes(filenames, work_dir)
+        work_dirs.append(work_dir)
+
+    with ProcessPoolExecutor(max_workers=len(swaths)) as executor:
+        futures = [
+            executor.submit(_process_subswath, work_dir, cpus, subswath, (filenames, filesdates), dem_file,
+                            swath_workers, swath_memory, orbit_cache_dir,
+                            (float(south), float(north), float(west), float(east)), output_format,
+                            os.path.abspath(scene_catalog.CATALOG_FILE), swath_scratch)
+            for work_dir, cpus, subswath in zip(work_dirs, split_cpus(len(swaths)), swaths)
+        ]
+        for future in futures:
+            future.result()
+
+    if not os.path.exists("PRODUCT"):
+        os.mkdir("PRODUCT")
+    for work_dir in work_dirs:
+        merge_products(work_dir)
+    # The stack of each subswath writes its own report in its working directory
+    metrics.write()
 
 
 def main():
@@ -47,10 +150,24 @@ def main():
     parser.add_argument("east", help="Maximum longitude")
     parser.add_argument("-f", "--csv-file", help="list of files to download, in csv format")
     parser.add_argument("-d", "--dem", action="store_true", help="Use the ASF DEM heap instead of opentopo")
+    parser.add_argument("-w", "--workers", type=int,
+                        help="Maximum number of pairs in each CPU-bound topsApp stage, shared between all "
+                             "subswaths; defaults to the number of available CPUs")
+    parser.add_argument("--pair-memory", type=float, default=PAIR_MEMORY,
+                        help="Peak memory in GB needed to process a single pair; limits the number of workers")
+    parser.add_argument("--orbit-cache", dest="orbit_cache_dir",
+                        help="Directory to cache orbit files in so each orbit file is only downloaded once")
+    parser.add_argument("--dem-cache", dest="dem_cache_dir",
+                        help="With --dem, directory to cache DEM tiles and DEMs in so each tile is only fetched once")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default=GTIFF,
+                        help="Write the collected GeoTIFFs as plain tiled GeoTIFFs, or as cloud-optimized GeoTIFFs "
+                             "with internal overviews")
     parser.add_argument('--version', action='version', version=f'hyp3_insar_isce {__version__}')
     args = parser.parse_args()
 
-    proc_all_s1_stack_isce(args.south, args.north, args.west, args.east, csv_file=args.csv_file, dem=args.dem)
+    proc_all_s1_stack_isce(args.south, args.north, args.west, args.east, csv_file=args.csv_file, dem=args.dem,
+                           workers=args.workers, pair_memory=args.pair_memory, orbit_cache_dir=args.orbit_cache_dir,
+                           dem_cache_dir=args.dem_cache_dir, output_format=args.output_format)
 
 
 if __name__ == "__main__":
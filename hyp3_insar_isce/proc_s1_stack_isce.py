@@ -1,126 +1,481 @@
 """Create a stack of interferograms using ISCE software"""
 
 import argparse
+import glob
+import json
 import os
-import re
+import shutil
 import sys
-from shutil import copyfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
 
 from hyp3lib import file_subroutines, getSubSwath
 from hyp3lib import saa_func_lib as saa
-from hyp3lib.execute import execute
 from hyp3lib.get_dem import get_ISCE_dem
-from hyp3lib.iscegeo2geotif import convert_files
-from lxml import etree
 
-from hyp3_insar_isce import __version__
-from hyp3_insar_isce.proc_s1_isce import proc_s1_isce
-
-
-def isce_process(bname, ss, step):
+from hyp3_insar_isce import (
+    __version__,
+    bursts,
+    checkpoint,
+    datacube,
+    metadata,
+    pair_network,
+    planner,
+    retention,
+    scene_cache,
+    scene_catalog,
+    stack_state,
+    topsapp_xml,
+    work_queue,
+)
+from hyp3_insar_isce.dem_cache import DemCache
+from hyp3_insar_isce.file_system import link_or_copy
+from hyp3_insar_isce.iscegeo2geotif import GTIFF, GriddedRaster, OUTPUT_FORMATS, stack_grid
+from hyp3_insar_isce.metrics import Metrics, REPORT_NAME, execute
+from hyp3_insar_isce.orbit_cache import OrbitCache
+from hyp3_insar_isce.pipeline import run_pipeline
+from hyp3_insar_isce.resources import admit_workers, available_memory, threads_per_worker
+
+# Peak memory, in GB, of a single topsApp run; dominated by snaphu unwrapping a full subswath
+PAIR_MEMORY = 4
+
+# Pairs to preprocess at once; preprocessing is bound by reading SAFE files rather than by CPU
+IO_WORKERS = 2
+
+# Directory in the stack to keep orbit files in when there's no shared orbit cache
+ORBIT_DIR = 'orbits'
+
+# Files in the merged directory of a pair, and the suffix of the name they are collected into PRODUCT with
+PRODUCT_FILES = (
+    ("colorized_unw.png", "unw_phase.png"),
+    ("colorized_unw.png.aux.xml", "unw_phase.png.aux.xml"),
+    ("colorized_unw_large.png", "unw_phase_large.png"),
+    ("colorized_unw_large.png.aux.xml", "unw_phase_large.png.aux.xml"),
+    ("colorized_unw.kmz", "unw_phase.kmz"),
+    ("color.png", "color_phase.png"),
+    ("color.png.aux.xml", "color_phase.png.aux.xml"),
+    ("color_large.png", "color_phase_large.png"),
+    ("color_large.png.aux.xml", "color_phase_large.png.aux.xml"),
+    ("color.kmz", "color_phase.kmz"),
+    ("phase.tif", "unw_phase.tif"),
+    ("amp.tif", "amp.tif"),
+    ("coherence.tif", "corr.tif"),
+)
+
+
+def isce_process(bname, ss, step, threads=None):
     cmd = 'cd {bname}/{ss} ; topsApp.py {step}'.format(bname=bname, ss=ss, step=step)
+    if threads is not None:
+        cmd = 'export OMP_NUM_THREADS={threads} ; {cmd}'.format(threads=threads, cmd=cmd)
     execute(cmd)
 
 
-def make_dir_and_xml(date1, date2, file1, file2, dem, options):
-    dirname = '{date1}_{date2}'.format(date1=date1, date2=date2)
-    if not os.path.exists(dirname):
-        os.mkdir(dirname)
-    roi = [options['south'], options['north'], options['west'], options['east']]
+def pair_dirname(date1, date2):
+    return '{date1}_{date2}'.format(date1=date1, date2=date2)
 
-    if dem:
-        proc_s1_isce(options['swath'], file1, file2, gbb=roi, xml=True, unwrap=True, dem=options['demname'])
-    else:
-        proc_s1_isce(options['swath'], file1, file2, gbb=roi, xml=True, unwrap=True)
+
+def convert_merged(merged_dir, proj, output_format=GTIFF):
+    """Convert the merged results of a pair in a child process, in their directory"""
+    execute('cd {merged_dir} ; {python} -m hyp3_insar_isce.iscegeo2geotif -p {proj} -r 30 -f {output_format}'.format(
+        merged_dir=merged_dir, python=sys.executable, proj=proj, output_format=output_format))
 
 
 def get_image_files(mydir, ss, options):
-    os.chdir("%s/%s/merged" % (mydir, ss))
+    """Convert the merged results of a pair and collect them into PRODUCT
+
+    The conversion runs in a child process in the pair's merged directory, so pairs can be
+    collected in worker threads without changing the directory of the others.
+
+    Returns:
+        products: Names of the files collected into PRODUCT
+    """
+    merged_dir = os.path.join(mydir, ss, 'merged')
     proj = saa.get_utm_proj(options['west'], options['east'], options['south'], options['north'])
-    convert_files(True, proj=proj, res=30)
-    copyfile("colorized_unw.png", "../../../PRODUCT/%s_%s_unw_phase.png" % (mydir, ss))
-    copyfile("colorized_unw.png.aux.xml", "../../../PRODUCT/%s_%s_unw_phase.png.aux.xml" % (mydir, ss))
-    copyfile("colorized_unw_large.png", "../../../PRODUCT/%s_%s_unw_phase_large.png" % (mydir, ss))
-    copyfile("colorized_unw_large.png.aux.xml", "../../../PRODUCT/%s_%s_unw_phase_large.png.aux.xml" % (mydir, ss))
-    copyfile("colorized_unw.kmz", "../../../PRODUCT/%s_%s_unw_phase.kmz" % (mydir, ss))
-    copyfile("color.png", "../../../PRODUCT/%s_%s_color_phase.png" % (mydir, ss))
-    copyfile("color.png.aux.xml", "../../../PRODUCT/%s_%s_color_phase.png.aux.xml" % (mydir, ss))
-    copyfile("color_large.png", "../../../PRODUCT/%s_%s_color_phase_large.png" % (mydir, ss))
-    copyfile("color_large.png.aux.xml", "../../../PRODUCT/%s_%s_color_phase_large.png.aux.xml" % (mydir, ss))
-    copyfile("color.kmz", "../../../PRODUCT/%s_%s_color_phase.kmz" % (mydir, ss))
-    copyfile("phase.tif", "../../../PRODUCT/%s_%s_unw_phase.tif" % (mydir, ss))
-    copyfile("amp.tif", "../../../PRODUCT/%s_%s_amp.tif" % (mydir, ss))
-    copyfile("coherence.tif", "../../../PRODUCT/%s_%s_corr.tif" % (mydir, ss))
-    os.chdir("../../../")
+    with options['metrics'].stage('geotiff', pair=mydir, swath=ss):
+        convert_merged(merged_dir, proj, options.get('output_format', GTIFF))
+    products = []
+    with options['metrics'].stage('collect', pair=mydir, swath=ss):
+        for name, suffix in PRODUCT_FILES:
+            product = "%s_%s_%s" % (mydir, ss, suffix)
+            link_or_copy(os.path.join(merged_dir, name), os.path.join("PRODUCT", product))
+            products.append(product)
+    return products
 
 
 def make_metadata_file(basedir, ss):
-    # Get the platform heading
-    heading = ''
-    back = os.getcwd()
-    for mydir in os.listdir("."):
-        if ".SAFE" in mydir and os.path.isdir(mydir):
-            os.chdir("%s/annotation" % mydir)
-            for myfile in os.listdir("."):
-                if "001.xml" in myfile:
-                    root = etree.parse(myfile)
-                    for head in root.iter('platformHeading'):
-                        heading = float(head.text)
-                        print("Found heading %s" % heading)
-                        break
-                else:
-                    continue
-                break
-        else:
+    """Write the metadata of a pair into PRODUCT as text and JSON, returning the names of both files"""
+    pair_dir = os.path.join(basedir, ss)
+    safe = scene_cache.read_pair_inputs(os.path.join(pair_dir, 'topsApp.xml'))['master']['safe']
+
+    pair_metadata = metadata.read_isce_log(os.path.join(pair_dir, 'isce.log'))
+    pair_metadata['heading'] = metadata.get_heading(safe)
+    print("Found metadata %s" % pair_metadata)
+
+    return metadata.write_metadata(os.path.join('PRODUCT', '%s_%s' % (basedir, ss)), pair_metadata)
+
+
+# Pairs collected at the same time take turns writing to the data cube
+_cube_lock = threading.Lock()
+
+
+def add_to_cube(mydir, ss, options):
+    """Add the collected products and metadata of a pair to the stack's data cube, creating it for the first pair
+
+    The cube's grid covers the stack's bounding box in the UTM zone the products are projected to.
+    """
+    with _cube_lock:
+        _add_to_cube(mydir, ss, options)
+
+
+def _add_to_cube(mydir, ss, options):
+    name = '%s_%s' % (mydir, ss)
+    products = {layer: os.path.join('PRODUCT', '%s_%s' % (name, suffix)) for layer, suffix in datacube.LAYERS.items()}
+    if not os.path.exists(options['datacube']):
+        proj = saa.get_utm_proj(options['west'], options['east'], options['south'], options['north'])
+        datacube.create(options['datacube'], stack_grid(products['unw_phase'], options['south'], options['north'],
+                                                        options['west'], options['east'], proj))
+    grid = datacube.read_grid(options['datacube'])
+
+    with open(os.path.join('PRODUCT', name + '.json')) as f:
+        coordinates = json.load(f)
+    coordinates['reference_time'], coordinates['secondary_time'] = datacube.pair_times(mydir)
+
+    layers = {layer: GriddedRaster(product, grid) for layer, product in products.items()}
+    try:
+        datacube.append_pair(options['datacube'], name, layers, coordinates)
+    finally:
+        for layer in layers.values():
+            layer.close()
+
+
+def subswath_bounding_box(safe, swath, catalog):
+    """Return the bounding box (south, north, west, east) of a subswath of a SAFE, from the scene catalog"""
+    entry = scene_catalog.get_swath(catalog, safe, swath)
+    print("Found annotation file %s" % entry['annotation'])
+    return entry['south'], entry['north'], entry['west'], entry['east']
+
+
+def plan_pairs(pairs, ss, swaths, roi=None, model=planner.DEFAULT_MODEL):
+    """Plan the stages each pair, as (pair_dir, reference, secondary), has left, skipping collected pairs
+
+    Args:
+        pairs: list of (pair_dir, reference, secondary)
+        ss: Subswath directory, like iw1
+        swaths: dict of each SAFE file to its catalog entry for the subswath
+        roi: Region of interest topsApp is given, if any
+        model: Coefficients of the planner's model
+    """
+    pair_plans = []
+    for mydir, reference, secondary in pairs:
+        isce_dir = os.path.join(mydir, ss)
+        if checkpoint.is_collected(isce_dir, "PRODUCT"):
             continue
-        break
-    os.chdir(back)
-
-    baseline = ''
-    utctime = ''
-    rg_looks = ''
-    az_looks = ''
-
-    os.chdir("%s/%s" % (basedir, ss))
-    with open('isce.log', 'r') as g:
-        for line in g.readlines():
-            if "subset.Overlap" in line and "start time" in line:
-                # FIXME: Too many steps here and re module is overkill
-                t = re.split('=', line)
-                t = t[1].strip()
-                print("Found utctime %s" % t)
-                t = re.split(' ', t)
-                s = re.split(":", t[1])
-                utctime = ((int(s[0]) * 60 + int(s[1])) * 60) + float(s[2])
-            if "Bperp at midrange for first common burst" in line:
-                t = re.split('=', line)
-                baseline = t[1].strip()
-                print("Found baseline %s" % baseline)
-            if "geocode.Azimuth looks" in line:
-                t = re.split('=', line)
-                az_looks = t[1].strip()
-                print("Found azimuth looks %s" % az_looks)
-            if "geocode.Range looks" in line:
-                t = re.split('=', line)
-                rg_looks = t[1].strip()
-                print("Found range looks %s" % rg_looks)
-    os.chdir("../..")
-
-    with open('PRODUCT/%s_%s.txt' % (basedir, ss), 'w') as f:
-        f.write("baseline: %s\n" % baseline)
-        f.write("utctime: %s\n" % utctime)
-        f.write("heading: %s\n" % heading)
-        f.write("range looks: %s\n" % rg_looks)
-        f.write("azimuth looks: %s\n" % az_looks)
-
-
-def proc_s1_stack_isce(csv_file=None, dem=False, roi=None, ss=None):
+        stages = [stage for stage, _ in checkpoint.remaining_stages(isce_dir)] + ['geotiff']
+        pair_plans.append(planner.plan_pair(mydir, ss, swaths[reference], swaths[secondary], roi=roi, stages=stages,
+                                            model=model))
+    return planner.plan_stack(pair_plans)
+
+
+def run_stage(bname, ss, stage, threads=None, metrics=None):
+    """Run a topsApp stage of a pair, unless it already finished, and checkpoint it"""
+    pair_dir = os.path.join(bname, ss)
+    for remaining, step in checkpoint.remaining_stages(pair_dir):
+        if remaining == stage:
+            with metrics.stage(stage, pair=os.path.basename(bname), swath=ss) if metrics else nullcontext():
+                isce_process(bname, ss, step, threads)
+            checkpoint.mark_stage(pair_dir, stage)
+
+
+def collect_pair(mydir, ss, options):
+    """Collect the results of a processed pair into PRODUCT, and checkpoint them
+
+    This doesn't touch the stack state, so pairs can be collected in worker threads; see `record_pair`.
+
+    Returns:
+        products: Names of the files collected into PRODUCT, or None if the pair has no merged results, in
+            which case its checkpoint is rewound so it's processed again
+    """
+    if not os.path.isdir("%s/%s/merged" % (mydir, ss)):
+        # Its outputs were reclaimed or never written, so have the next run process it again
+        checkpoint.rewind(os.path.join(mydir, ss), None)
+        print("ERROR: %s has no merged results to collect; it will be processed again by the next run" % mydir)
+        return None
+    print("Collecting directory %s" % mydir)
+    products = get_image_files(mydir, ss, options)
+    with options['metrics'].stage('metadata', pair=mydir, swath=ss):
+        products.extend(make_metadata_file(mydir, ss))
+    # Before the pair is marked collected, so a rerun adds it if this is interrupted
+    if options.get('datacube') is not None:
+        with options['metrics'].stage('datacube', pair=mydir, swath=ss):
+            add_to_cube(mydir, ss, options)
+    checkpoint.mark_collected(os.path.join(mydir, ss), products)
+    if options.get('retention') is not None:
+        with options['metrics'].stage('reclaim', pair=mydir, swath=ss):
+            freed = retention.reclaim(os.path.join(mydir, ss), options['retention'])
+        print("Reclaimed %.1f GB of scratch disk from %s" % (freed / planner.GB, mydir))
+    return products
+
+
+def record_pair(mydir, ss, products, options):
+    """Record the products collected from a pair in the stack state"""
+    if products is not None and 'stack_state' in options:
+        stack_state.record_products(options['stack_state'], mydir, ss, products)
+        stack_state.save(options['stack_state'])
+
+
+def already_collected(mydir, ss, options):
+    """Return whether a pair was collected by an earlier run, making sure the stack state has its products"""
+    if not checkpoint.is_collected(os.path.join(mydir, ss), "PRODUCT"):
+        return False
+    print("Skipping directory %s; already collected" % mydir)
+    if 'stack_state' in options and not stack_state.is_processed(options['stack_state'], mydir, ss):
+        products = checkpoint.load(os.path.join(mydir, ss))['products']
+        stack_state.record_products(options['stack_state'], mydir, ss, products)
+    if options.get('datacube') is not None and not (
+            os.path.exists(options['datacube']) and '%s_%s' % (mydir, ss) in datacube.pairs(options['datacube'])):
+        with options['metrics'].stage('datacube', pair=mydir, swath=ss):
+            add_to_cube(mydir, ss, options)
+    return True
+
+
+def preprocess_pairs(pairs, ss, scene_cache_dir, io_workers=IO_WORKERS, metrics=None):
+    """Preprocess the pairs the scene cache can't seed, add them to it, and seed the others from it"""
+    pair_dirs = {mydir: os.path.join(mydir, ss) for mydir in pairs}
+    pair_dirs = {mydir: pair_dir for mydir, pair_dir in pair_dirs.items() if checkpoint.load(pair_dir)['stage'] is None}
+    selected = scene_cache.select_preprocess_pairs(scene_cache_dir, list(pair_dirs.values()))
+    print("Preprocessing %s of %s pairs; the rest are in the scene cache" % (len(selected), len(pair_dirs)))
+
+    def preprocess(mydir):
+        run_stage(os.path.abspath(mydir), ss, 'preprocess', metrics=metrics)
+        scene_cache.store(scene_cache_dir, pair_dirs[mydir])
+
+    with ThreadPoolExecutor(max_workers=io_workers) as executor:
+        list(executor.map(preprocess, [mydir for mydir in pair_dirs if pair_dirs[mydir] in selected]))
+
+    for pair_dir in pair_dirs.values():
+        if pair_dir not in selected and scene_cache.seed(scene_cache_dir, pair_dir):
+            checkpoint.mark_stage(pair_dir, 'preprocess')
+
+
+def watermarked(func, watermark, admit=False, release=False):
+    """Wrap a stage function so a pair waits for a disk watermark before it runs, and is released if it fails
+
+    With release, the pair is also released when the stage finishes.
+    """
+    def run(bname):
+        if admit:
+            watermark.admit(os.path.basename(bname))
+        try:
+            result = func(bname)
+        except BaseException:  # noqa: B902
+            watermark.release()
+            raise
+        if release:
+            watermark.release()
+        return result
+    return run
+
+
+def process_pairs(pairs, options, workers=1, pair_memory=PAIR_MEMORY, scene_cache_dir=None, io_workers=IO_WORKERS):
+    """Run topsApp for each pair directory and collect the results into PRODUCT
+
+    The topsApp stages of different pairs overlap: while one pair is unwrapping the next
+    can already be preprocessing. The I/O-bound preprocess stage runs up to `io_workers`
+    pairs at once, and the CPU-bound stages, including collecting the results into PRODUCT,
+    up to `workers` pairs, sized down to fit the CPUs and, for unwrapping, the memory
+    available. Collected products are recorded in the stack state in the order of `pairs`
+    regardless of the order the pairs finish in, and a pair that fails to be collected
+    doesn't stop the others.
+
+    Pairs already collected by an earlier run are skipped, and partially processed
+    pairs resume after their last finished stage.
+
+    With a scene cache, each scene is preprocessed once and linked into the pairs using it.
+
+    With a disk watermark in the options, a pair doesn't start while the free disk is below
+    it, until the pairs in flight are collected and their scratch disk reclaimed.
+    """
+    ss = 'iw' + str(options['swath'])
+    metrics = options.setdefault('metrics', Metrics())
+
+    remaining = [mydir for mydir in pairs if not already_collected(mydir, ss, options)]
+    if not remaining:
+        return
+
+    cpu_workers = admit_workers(min(workers, len(remaining)))
+    limits = {
+        'preprocess': io_workers,
+        'filter': cpu_workers,
+        'unwrap': admit_workers(cpu_workers, memory_per_worker=int(pair_memory * 1024 ** 3)),
+        'geocode': cpu_workers,
+        'collect': cpu_workers,
+    }
+    threads = threads_per_worker(cpu_workers) if cpu_workers > 1 else None
+    print("Processing %s pairs with stage limits %s" % (len(remaining), limits))
+
+    if scene_cache_dir is not None:
+        preprocess_pairs(remaining, ss, scene_cache_dir, io_workers=io_workers, metrics=metrics)
+
+    # Stages run in worker threads, so none of them may change directory
+    stages = [
+        (stage, partial(run_stage, ss=ss, stage=stage, threads=threads, metrics=metrics))
+        for stage in checkpoint.STAGE_NAMES
+    ]
+    products = {}
+
+    def collect(bname):
+        products[bname] = collect_pair(os.path.basename(bname), ss, options)
+
+    stages.append(('collect', collect))
+    watermark = options.get('watermark')
+    if watermark is not None:
+        stages = [(stage, watermarked(func, watermark, admit=index == 0, release=index == len(stages) - 1))
+                  for index, (stage, func) in enumerate(stages)]
+
+    run_pipeline([os.path.abspath(mydir) for mydir in remaining], stages, limits,
+                 finish=lambda bname: record_pair(os.path.basename(bname), ss, products.pop(bname), options))
+
+
+def publish_pairs(queue_file, pairs, options, scenes):
+    """Publish a task for each pair that isn't collected yet, for workers on any node to process
+
+    The workers and the finalize step get the stack's directory, bounding box, subswath,
+    scenes, retention policy, output format and data cube from the queue's settings.
+    """
+    ss = 'iw' + str(options['swath'])
+    tasks = [
+        {
+            'pair_dir': mydir, 'swath': ss, 'inputs': {
+                'xml': os.path.join(mydir, ss, 'topsApp.xml'),
+                'reference': os.path.basename(reference),
+                'secondary': os.path.basename(secondary),
+            },
+            'outputs': [name for name, _ in PRODUCT_FILES],
+        }
+        for mydir, reference, secondary in pairs if not already_collected(mydir, ss, options)
+    ]
+    conn = work_queue.connect(queue_file)
+    try:
+        work_queue.publish(conn, tasks, settings={
+            'stack_dir': os.getcwd(),
+            'swath': options['swath'],
+            'bounds': [options['south'], options['north'], options['west'], options['east']],
+            'scenes': [os.path.basename(scene) for scene in scenes],
+            'retention': options.get('retention'),
+            'output_format': options.get('output_format', GTIFF),
+            'datacube': options.get('datacube'),
+        })
+        print("Published %s pairs to %s; tasks by state: %s" % (len(tasks), queue_file, work_queue.counts(conn)))
+    finally:
+        conn.close()
+
+
+def finalize_queue(queue_file):
+    """Collect the products of the pairs the workers finished into PRODUCT, with their metadata
+
+    With a retention policy in the queue's settings, the scratch disk of each pair is reclaimed
+    once it's collected.
+
+    Returns:
+        unfinished: Number of tasks in the queue that aren't done
+    """
+    conn = work_queue.connect(queue_file)
+    try:
+        queue_settings = work_queue.settings(conn)
+        finished = work_queue.tasks(conn, work_queue.DONE)
+        counts = work_queue.counts(conn)
+    finally:
+        conn.close()
+
+    os.chdir(queue_settings['stack_dir'])
+    options = {
+        'metrics': Metrics(),
+        'swath': queue_settings['swath'],
+        'retention': queue_settings.get('retention'),
+        'output_format': queue_settings.get('output_format', GTIFF),
+        'datacube': queue_settings.get('datacube'),
+    }
+    options['south'], options['north'], options['west'], options['east'] = queue_settings['bounds']
+    # Add the measurements of the workers to those of publishing the pairs, once
+    worker_reports = sorted(glob.glob(REPORT_NAME + '.*.json'))
+    for report in glob.glob(REPORT_NAME + '.json') + worker_reports:
+        options['metrics'].load(report)
+
+    state = stack_state.load()
+    options['stack_state'] = state
+    if not os.path.exists("PRODUCT"):
+        os.mkdir("PRODUCT")
+    for task in finished:
+        if not already_collected(task['pair_dir'], task['swath'], options):
+            products = collect_pair(task['pair_dir'], task['swath'], options)
+            record_pair(task['pair_dir'], task['swath'], products, options)
+
+    stack_state.add_scenes(state, queue_settings['scenes'])
+    stack_state.save(state)
+    options['metrics'].write(os.path.abspath(REPORT_NAME))
+    for report in worker_reports:
+        basename, _ = os.path.splitext(report)
+        os.remove(basename + '.json')
+        os.remove(basename + '.prom')
+
+    unfinished = sum(count for state_name, count in counts.items() if state_name != work_queue.DONE)
+    if unfinished:
+        print("WARNING: %s tasks are not done; tasks by state: %s" % (unfinished, counts))
+    return unfinished
+
+
+def proc_s1_stack_isce(csv_file=None, dem=False, roi=None, ss=None, workers=1, pair_memory=None,
+                       scene_cache_dir=None, orbit_cache_dir=None, io_workers=IO_WORKERS, max_days=None,
+                       max_bperp=None, connections=2, incremental=False, scenes=None, dem_file=None,
+                       dem_cache_dir=None, overrides=None, queue_file=None, burst_roi=None, dry_run=False,
+                       plan_model=None, reclaim=False, retention_policy=None, min_free_disk=None,
+                       output_format=GTIFF, cube=False, catalog_file=scene_catalog.CATALOG_FILE,
+                       scratch_disk=None):
     """Main process
 
-        csv_file = input file to read granules from and use get_asf.py
-        dem      = If true, use get_dem instead of opentopo
-        roi      = Region of interest, defined as (south north west east)
-        ss       = Subswath to process
+        csv_file        = input file to read granules from and use get_asf.py
+        dem             = If true, use get_dem instead of opentopo
+        roi             = Region of interest, defined as (south north west east)
+        ss              = Subswath to process
+        workers         = Maximum number of pairs in each CPU-bound topsApp stage at the same time
+        pair_memory     = Peak memory, in GB, needed to process a single pair; defaults to the plan's estimate
+        scene_cache_dir = Directory to cache preprocessed scenes in, shared between pairs
+        orbit_cache_dir = Directory to cache orbit files in, shared between pairs and runs
+        io_workers      = Maximum number of pairs to preprocess at the same time
+        max_days        = Longest temporal baseline, in days, of a pair to process
+        max_bperp       = Longest perpendicular baseline, in meters, of a pair to process
+        connections     = Maximum number of later scenes to pair each scene with
+        incremental     = If true, only make and process the pairs not already in the stack state
+        scenes          = (filenames, filedates) of the stack, instead of finding the SAFE files in the current
+                          directory
+        dem_file        = Existing ISCE DEM covering the stack to use instead of getting one
+        dem_cache_dir   = Directory to cache DEM tiles and DEMs in, shared between runs
+        overrides       = dict of topsApp settings to override, by their name in topsapp_xml.OVERRIDES
+        queue_file      = Work queue to publish the pairs to, for procS1StackWorker.py to process, instead of
+                          processing them here
+        burst_roi       = With ss, region of interest (south north west east) to trim the subswath's bursts to;
+                          with roi, the bursts are trimmed to roi
+        dry_run         = If true, only print the estimated scratch disk, memory and CPU time of each pair and stage
+        plan_model      = Model file calibrated by calibrateS1StackPlan.py to estimate them with
+        reclaim         = If true, delete or compress the intermediate files of each pair once it's collected
+        retention_policy = JSON file of what to delete, compress or keep of each topsApp step's outputs when
+                          reclaiming, instead of deleting them all; implies reclaim
+        min_free_disk   = When reclaiming, GB of free disk below which new pairs wait for others to be reclaimed
+        output_format   = Format of the collected GeoTIFFs: GTiff, or COG for cloud-optimized GeoTIFFs with
+                          internal overviews
+        cube            = If true, also add each pair's products to the stack's data cube, stack_cube.h5, as it's
+                          collected
+        catalog_file    = Scene catalog to read the scenes' annotations from, like one already indexed by
+                          procAllS1StackISCE.py for every subswath
+        scratch_disk    = Bytes of scratch disk the stack may use, by default all the free disk of the working
+                          directory, like the share of each subswath procAllS1StackISCE.py processes at once
+
+        Pairs that can't fit in the available memory stop the stack before it starts, and when the
+        stack doesn't fit in the free scratch disk only the pairs that do are processed, and running
+        again processes the rest. When reclaiming, only the pairs in flight at once need to fit, and
+        at most `workers` + `io_workers` pairs are.
 
         roi and ss are mutually exclusive required parameters.
     """
@@ -131,43 +486,36 @@ def proc_s1_stack_isce(csv_file=None, dem=False, roi=None, ss=None):
         print("ERROR: can only specify one of ROI or SS")
         sys.exit(1)
 
-    options = {}
+    options = {'metrics': Metrics(), 'retention': None, 'output_format': output_format,
+               'datacube': datacube.CUBE_FILE if cube else None}
+    report = os.path.abspath(REPORT_NAME)
+    if reclaim or retention_policy is not None:
+        try:
+            options['retention'] = retention.load_policy(retention_policy)
+        except ValueError as e:
+            sys.exit("ERROR: %s" % e)
+        options['watermark'] = retention.DiskWatermark(os.path.abspath("."), (min_free_disk or 0) * planner.GB,
+                                                       max_in_flight=workers + io_workers)
+    catalog = scene_catalog.connect(catalog_file)
 
     if ss is not None:
         options['swath'] = int(ss)
 
-    if csv_file is not None:
-        file_subroutines.prepare_files(csv_file)
+    if scenes is not None:
+        filenames, filedates = scenes
+    else:
+        if csv_file is not None:
+            file_subroutines.prepare_files(csv_file)
 
-    (filenames, filedates) = file_subroutines.get_file_list()
+        scene_catalog.update(catalog)
+        (filenames, filedates) = scene_catalog.get_file_list(catalog)
 
     print(filenames)
     print(filedates)
 
     if roi is None:
-        mydir = "%s/annotation" % filenames[0]
-        myxml = ""
-        name = ""
-        if options['swath'] == 1:
-            name = "001.xml"
-        elif options['swath'] == 2:
-            name = "002.xml"
-        elif options['swath'] == 3:
-            name = "003.xml"
-        else:
-            print("Invalid sub-swath specified %s" % options['swath'])
-
-        for myfile in os.listdir(mydir):
-            if name in myfile:
-                myxml = "%s/annotation/%s" % (filenames[0], myfile)
-        print("Found annotation file %s" % myxml)
-
-        lat_max, lat_min, lon_max, lon_min = getSubSwath.get_bounding_box(myxml)
-
-        options['south'] = lat_min
-        options['north'] = lat_max
-        options['west'] = lon_min
-        options['east'] = lon_max
+        options['south'], options['north'], options['west'], options['east'] = \
+            subswath_bounding_box(filenames[0], options['swath'], catalog)
     else:
         options['south'] = roi[0]
         options['north'] = roi[1]
@@ -185,38 +533,126 @@ def proc_s1_stack_isce(csv_file=None, dem=False, roi=None, ss=None):
         options['north'] = roi[1]
         options['west'] = roi[2]
         options['east'] = roi[3]
-
-    if dem:
-        get_ISCE_dem(options['west'], options['south'], options['east'], options['north'], "stack_dem.dem",
-                     "stack_dem.dem.xml")
+        burst_roi = roi
+
+    # Only have topsApp process the bursts the region of interest needs
+    options['roi'] = None
+    if burst_roi is not None:
+        swaths = [scene_catalog.get_swath(catalog, filename, options['swath']) for filename in filenames]
+        try:
+            options['roi'], selected = bursts.stack_roi(swaths, burst_roi)
+        except ValueError as e:
+            sys.exit("ERROR: %s" % e)
+        print("Processing %s of the %s bursts of the scenes within %s" %
+              (sum(len(indices) for indices in selected), sum(len(swath['bursts']) for swath in swaths),
+               options['roi']))
+
+    state = stack_state.load()
+    options['stack_state'] = state
+    if incremental:
+        print("Found %s new scenes" % len(stack_state.new_scenes(state, filenames)))
+
+    baselines = None
+    if max_bperp is not None:
+        baselines = pair_network.estimate_baselines(filenames, options['swath'])
+        print("Estimated perpendicular baselines %s" % baselines)
+    pairs = pair_network.build_network(filedates, baselines, max_days=max_days, max_bperp=max_bperp,
+                                       connections=connections)
+    ssname = 'iw' + str(options['swath'])
+    # Only plan and set up the pairs that are still outstanding
+    collected = [pair for pair in pairs if checkpoint.is_collected(
+        os.path.join(pair_dirname(filedates[pair[0]], filedates[pair[1]]), ssname), "PRODUCT")]
+    pairs = [pair for pair in pairs if pair not in collected]
+    if incremental:
+        pairs = [(x, y) for x, y in pairs
+                 if not stack_state.is_processed(state, pair_dirname(filedates[x], filedates[y]), ssname)]
+    print("Processing %s pairs of %s scenes; %s already collected" % (len(pairs), len(filenames), len(collected)))
+
+    # Estimate what the pairs need before fetching or writing anything
+    swaths = {filenames[i]: scene_catalog.get_swath(catalog, filenames[i], options['swath'])
+              for i in sorted({i for pair in pairs for i in pair})}
+    plan = plan_pairs([(pair_dirname(filedates[x], filedates[y]), filenames[x], filenames[y]) for x, y in pairs],
+                      ssname, swaths, roi=options['roi'], model=planner.load_model(plan_model))
+    planner.print_plan(plan)
+    if dry_run:
+        return
+
+    if queue_file is None:
+        try:
+            batch = planner.fit_plan(plan, shutil.disk_usage(".").free if scratch_disk is None else scratch_disk,
+                                     available_memory(), reclaimed=options['retention'] is not None,
+                                     in_flight=workers + io_workers)
+        except ValueError as e:
+            sys.exit("ERROR: %s" % e)
+        if len(batch) < len(plan['pairs']):
+            deferred = {pair['pair_dir'] for pair in plan['pairs'][len(batch):]}
+            print("Only %s of the %s remaining pairs fit in the free scratch disk; run again to process the rest" %
+                  (len(batch), len(plan['pairs'])))
+            pairs = [(x, y) for x, y in pairs if pair_dirname(filedates[x], filedates[y]) not in deferred]
+            plan = planner.plan_stack(batch)
+        if pair_memory is None and plan['pairs']:
+            pair_memory = plan['memory_bytes'] / planner.GB
+    planner.write_plan(plan)
+
+    # Make sure the stack state and data cube have the products of pairs collected by earlier runs
+    for x, y in collected:
+        stack_state.add_pair(state, pair_dirname(filedates[x], filedates[y]), ssname, filenames[x], filenames[y])
+        already_collected(pair_dirname(filedates[x], filedates[y]), ssname, options)
+
+    if dem_file is not None:
+        dem = True
+        options['demname'] = dem_file
+    elif dem:
+        if not (incremental and os.path.exists("stack_dem.dem")):
+            dem_getter = get_ISCE_dem if dem_cache_dir is None else DemCache(dem_cache_dir).get_ISCE_dem
+            with options['metrics'].stage('dem'):
+                dem_getter(options['west'], options['south'], options['east'], options['north'], "stack_dem.dem",
+                           "stack_dem.dem.xml")
         options['demname'] = "stack_dem.dem"
 
-    length = len(filenames)
-
-    # Make XML files for pairs and 2nd pairs
-    for x in range(length - 2):
-        make_dir_and_xml(filedates[x], filedates[x + 1], filenames[x], filenames[x + 1], dem, options)
-        make_dir_and_xml(filedates[x], filedates[x + 2], filenames[x], filenames[x + 2], dem, options)
+    # Without a shared cache, still fetch each scene's orbit file only once for all of its pairs
+    options['orbit_cache'] = OrbitCache(orbit_cache_dir if orbit_cache_dir is not None else ORBIT_DIR)
+    with options['metrics'].stage('orbits'):
+        orbit_files = options['orbit_cache'].prefetch(sorted({filenames[i] for pair in pairs for i in pair}))
+
+    # Make XML files for the pairs of the network
+    with options['metrics'].stage('setup'):
+        template = topsapp_xml.TopsAppTemplate(
+            unwrap=True, gbb=(options['south'], options['north'], options['west'], options['east']),
+            roi=options['roi'], dem=options['demname'] if dem else None, overrides=overrides,
+        )
+        topsapp_xml.write_pair_xmls(
+            template, [(pair_dirname(filedates[x], filedates[y]), filenames[x], filenames[y]) for x, y in pairs],
+            options['swath'], orbit_files,
+        )
+        for x, y in pairs:
+            stack_state.add_pair(state, pair_dirname(filedates[x], filedates[y]), ssname, filenames[x],
+                                 filenames[y])
+
+    if queue_file is not None:
+        publish_pairs(queue_file, [(pair_dirname(filedates[x], filedates[y]), filenames[x], filenames[y])
+                                   for x, y in pairs], options, filenames)
+        stack_state.save(state)
+        options['metrics'].write(report)
+        return
 
     # If we have anything to process
-    if length > 1:
-        # Make XML files for last pair
-        make_dir_and_xml(filedates[length - 2], filedates[length - 1], filenames[length - 2], filenames[length - 1],
-                         dem, options)
-
+    if pairs:
         if not os.path.exists("PRODUCT"):
             os.mkdir("PRODUCT")
 
         # Run through directories processing imgs and collecting results as we go
-        for mydir in os.listdir("."):
-            if len(mydir) == 31 and os.path.isdir(mydir) and "_20" in mydir:
-                print("Processing directory %s" % mydir)
-                ss = 'iw' + str(options['swath'])
-                isce_process(mydir, ss, " ")
-                if os.path.isdir("%s/%s/merged" % (mydir, ss)):
-                    print("Collecting directory %s" % mydir)
-                    get_image_files(mydir, ss, options)
-                    make_metadata_file(mydir, ss)
+        try:
+            process_pairs(sorted(pair_dirname(filedates[x], filedates[y]) for x, y in pairs), options,
+                          workers=workers, pair_memory=pair_memory or PAIR_MEMORY, scene_cache_dir=scene_cache_dir,
+                          io_workers=io_workers)
+        finally:
+            # Keep the measurements of a failed run too
+            options['metrics'].write(report)
+
+    stack_state.add_scenes(state, filenames)
+    stack_state.save(state)
+    options['metrics'].write(report)
 
 
 def main():
@@ -236,10 +672,75 @@ def main():
                             "bounding box from first image")
     group.add_argument("-s", "--ss",
                        help="Set the subswath to process. If ROI is specified, calculate subswath")
+    parser.add_argument("--burst-roi", nargs=4, type=float,
+                        help="With --ss, only process the bursts of the subswath that intersect this region of "
+                             "interest (south north west east); west may be greater than east across the antimeridian")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Maximum number of pairs in each CPU-bound topsApp stage at the same time")
+    parser.add_argument("--io-workers", type=int, default=IO_WORKERS,
+                        help="Maximum number of pairs to preprocess at the same time")
+    parser.add_argument("--pair-memory", type=float,
+                        help="Peak memory in GB needed to process a single pair; limits the number of workers. "
+                             "Defaults to the planner's estimate")
+    parser.add_argument("--scene-cache", dest="scene_cache_dir",
+                        help="Directory to cache preprocessed scenes in so each scene is only preprocessed once")
+    parser.add_argument("--orbit-cache", dest="orbit_cache_dir",
+                        help="Directory to cache orbit files in so each orbit file is only downloaded once")
+    parser.add_argument("--dem-cache", dest="dem_cache_dir",
+                        help="With --dem, directory to cache DEM tiles and DEMs in so each tile is only fetched once")
+    parser.add_argument("--max-days", type=float,
+                        help="Only pair scenes acquired at most this many days apart")
+    parser.add_argument("--max-bperp", type=float,
+                        help="Only pair scenes with a perpendicular baseline of at most this many meters, "
+                             "estimated from the orbits in each scene's annotation")
+    parser.add_argument("--connections", type=int, default=2,
+                        help="Maximum number of later scenes to pair each scene with")
+    parser.add_argument("-i", "--incremental", action="store_true",
+                        help="Only process the pairs added by scenes that are new since the last run, "
+                             "as recorded in %s" % stack_state.STATE_FILE)
+    parser.add_argument("--range-looks", type=int, help="Number of looks in range, instead of topsApp's default")
+    parser.add_argument("--azimuth-looks", type=int, help="Number of looks in azimuth, instead of topsApp's default")
+    parser.add_argument("--unwrapper", help="Name of the unwrapper topsApp uses, instead of snaphu_mcf")
+    parser.add_argument("--filter-strength", type=float,
+                        help="Strength of the interferogram filter, instead of topsApp's default")
+    parser.add_argument("-q", "--queue", dest="queue_file",
+                        help="Set up the pairs and publish them to this work queue for procS1StackWorker.py to "
+                             "process, instead of processing them here")
+    parser.add_argument("-n", "--dry-run", action="store_true",
+                        help="Print the estimated scratch disk, memory and CPU time of each pair and stage, "
+                             "then exit without processing")
+    parser.add_argument("--plan-model",
+                        help="Planner model calibrated from past stacks by calibrateS1StackPlan.py")
+    parser.add_argument("--reclaim", action="store_true",
+                        help="Delete the intermediate files of each pair once its products are collected")
+    parser.add_argument("--retention-policy",
+                        help="JSON file of what to delete, compress or keep of each topsApp step's outputs once "
+                             "a pair is collected; implies --reclaim")
+    parser.add_argument("--min-free-disk", type=float,
+                        help="With --reclaim, hold back new pairs while less than this many GB of disk is free")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default=GTIFF,
+                        help="Write the collected GeoTIFFs as plain tiled GeoTIFFs, or as cloud-optimized GeoTIFFs "
+                             "with internal overviews")
+    parser.add_argument("--cube", action="store_true",
+                        help="Also write the products of every pair onto one grid in %s, a chunked, compressed "
+                             "HDF5 data cube of (pair, y, x), as each pair is collected" % datacube.CUBE_FILE)
     parser.add_argument('--version', action='version', version=f'hyp3_insar_isce {__version__}')
     args = parser.parse_args()
-
-    proc_s1_stack_isce(csv_file=args.csv_file, dem=args.dem, roi=args.roi, ss=args.ss)
+    if args.min_free_disk is not None and not (args.reclaim or args.retention_policy):
+        parser.error("--min-free-disk needs --reclaim or --retention-policy")
+    if args.burst_roi is not None and args.ss is None:
+        parser.error("--burst-roi needs --ss; with --roi, the bursts are trimmed to the region of interest")
+
+    proc_s1_stack_isce(csv_file=args.csv_file, dem=args.dem, roi=args.roi, ss=args.ss, workers=args.workers,
+                       pair_memory=args.pair_memory, scene_cache_dir=args.scene_cache_dir,
+                       orbit_cache_dir=args.orbit_cache_dir, io_workers=args.io_workers, max_days=args.max_days,
+                       max_bperp=args.max_bperp, connections=args.connections, incremental=args.incremental,
+                       dem_cache_dir=args.dem_cache_dir,
+                       overrides={option: getattr(args, option) for option in topsapp_xml.OVERRIDES},
+                       queue_file=args.queue_file, dry_run=args.dry_run, plan_model=args.plan_model,
+                       reclaim=args.reclaim, retention_policy=args.retention_policy,
+                       min_free_disk=args.min_free_disk, output_format=args.output_format, cube=args.cube,
+                       burst_roi=args.burst_roi)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,99 @@
+"""Process the pairs of a stack published to a work queue by procS1StackISCE.py --queue
+
+Run any number of workers, on any number of nodes that share the stack's directory at the
+same path; each claims pairs from the queue and runs their topsApp stages until none are
+left. Then run this once with --finalize to collect the products into PRODUCT.
+"""
+
+import argparse
+import os
+import socket
+import sys
+
+from hyp3_insar_isce import __version__, checkpoint, work_queue
+from hyp3_insar_isce.metrics import Metrics, REPORT_NAME
+from hyp3_insar_isce.proc_s1_stack_isce import finalize_queue, run_stage
+from hyp3_insar_isce.resources import admit_workers, threads_per_worker
+
+
+def run_task(task, stack_dir, threads=None, metrics=None, lease=None):
+    """Run the remaining topsApp stages of a pair and check it produced its outputs
+
+    With the task's lease, each stage only starts while the lease is still held, so a pair
+    another worker has claimed since isn't processed by both at once.
+    """
+    bname = os.path.join(stack_dir, task['pair_dir'])
+    for stage in checkpoint.STAGE_NAMES:
+        if lease is not None:
+            lease.check()
+        run_stage(bname, task['swath'], stage, threads=threads, metrics=metrics)
+
+    merged = os.path.join(bname, task['swath'], 'merged')
+    missing = [name for name in task['outputs'] if not os.path.isfile(os.path.join(merged, name))]
+    if missing:
+        raise FileNotFoundError('topsApp did not produce {} in {}'.format(', '.join(missing), merged))
+
+
+def proc_s1_stack_worker(queue_file, workers=1, lease_seconds=work_queue.LEASE_SECONDS,
+                         max_attempts=work_queue.MAX_ATTEMPTS):
+    """Main process
+
+        queue_file    = Work queue published by procS1StackISCE.py --queue
+        workers       = Number of pairs to process on this node at the same time
+        lease_seconds = Seconds each claimed pair is leased for, between renewals
+        max_attempts  = Attempts at a pair before it's marked failed
+
+    Returns:
+        done: Number of pairs this node processed
+    """
+    conn = work_queue.connect(queue_file)
+    try:
+        stack_dir = work_queue.settings(conn)['stack_dir']
+    finally:
+        conn.close()
+
+    workers = admit_workers(workers)
+    threads = threads_per_worker(workers) if workers > 1 else None
+    metrics = Metrics()
+    try:
+        done = work_queue.work_concurrently(
+            queue_file, lambda task, lease: run_task(task, stack_dir, threads=threads, metrics=metrics, lease=lease),
+            workers,
+            lease_seconds=lease_seconds, max_attempts=max_attempts,
+        )
+    finally:
+        # finalize_queue adds the measurements of every worker to the stack's report
+        metrics.write(os.path.join(stack_dir, '{}.{}-{}'.format(REPORT_NAME, socket.gethostname(), os.getpid())))
+    print("Processed %s pairs" % done)
+    return done
+
+
+def main():
+    """Main entrypoint"""
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(__file__),
+        description=__doc__,
+    )
+    parser.add_argument("queue_file", help="Work queue published by procS1StackISCE.py --queue")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Number of pairs to process on this node at the same time")
+    parser.add_argument("--lease", type=float, default=work_queue.LEASE_SECONDS,
+                        help="Seconds each claimed pair is leased for, between renewals; a pair whose worker stops "
+                             "renewing it goes back to the queue")
+    parser.add_argument("--max-attempts", type=int, default=work_queue.MAX_ATTEMPTS,
+                        help="Attempts at a pair before it is marked failed")
+    parser.add_argument("--finalize", action="store_true",
+                        help="Once the pairs are processed, collect their products into PRODUCT instead of working")
+    parser.add_argument('--version', action='version', version=f'hyp3_insar_isce {__version__}')
+    args = parser.parse_args()
+
+    if args.finalize:
+        if finalize_queue(args.queue_file):
+            sys.exit(1)
+    else:
+        proc_s1_stack_worker(args.queue_file, workers=args.workers, lease_seconds=args.lease,
+                             max_attempts=args.max_attempts)
+
+
+if __name__ == "__main__":
+    main()
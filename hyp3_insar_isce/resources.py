@@ -0,0 +1,58 @@
+"""Size concurrent work to the CPU and memory available on this machine"""
+
+import os
+
+
+def available_cpus():
+    """Return the number of CPUs this process is allowed to run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def split_cpus(count):
+    """Split the CPUs this process is allowed to run on into count disjoint, near equal sets
+
+    When there are fewer CPUs than sets, every set gets all of them.
+    """
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = list(range(os.cpu_count() or 1))
+    if len(cpus) < count:
+        return [cpus] * count
+    return [cpus[i::count] for i in range(count)]
+
+
+def available_memory():
+    """Return the memory, in bytes, that can be given to new processes without swapping"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+
+
+def admit_workers(requested, memory_per_worker=0):
+    """Bound a requested number of concurrent workers by the CPUs and memory available
+
+    Args:
+        requested: Number of workers asked for
+        memory_per_worker: Peak memory, in bytes, expected of each worker
+
+    Returns:
+        workers: Number of workers that can safely run at once (at least one)
+    """
+    workers = min(requested, available_cpus())
+    if memory_per_worker:
+        workers = min(workers, available_memory() // memory_per_worker)
+    return max(int(workers), 1)
+
+
+def threads_per_worker(workers):
+    """Split the available CPUs evenly between concurrent workers"""
+    return max(available_cpus() // workers, 1)
@@ -0,0 +1,204 @@
+"""Reclaim the scratch disk of pairs as soon as their products are collected
+
+A retention policy says, for each topsApp step, what to do with its outputs in a pair's
+ISCE directory once the pair is collected: delete them, gzip them or keep them, with a
+keep-list of patterns to leave alone. Products collected into PRODUCT are links to the
+files in `merged`, so deleting them there doesn't lose them, and files with other links
+are never compressed, which would only duplicate them. Once `merged` is reclaimed, the
+pair's checkpoint is rewound so that, should its products be lost, it's processed again
+rather than skipped.
+
+While pairs are being processed, a DiskWatermark holds back new pairs when the free disk
+drops below a threshold, until collected pairs have been reclaimed.
+"""
+
+import copy
+import fnmatch
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+
+from hyp3_insar_isce import checkpoint
+
+DELETE = 'delete'
+COMPRESS = 'compress'
+KEEP = 'keep'
+ACTIONS = (DELETE, COMPRESS, KEEP)
+
+# topsApp outputs of each step, relative to a pair's ISCE directory
+STEP_OUTPUTS = {
+    'preprocess': ['master', 'slave'],
+    'coregistration': ['geom_master', 'coarse_offsets', 'coarse_coreg', 'coarse_interferogram', 'ESD', 'fine_offsets',
+                       'fine_coreg'],
+    'interferogram': ['fine_interferogram'],
+    'merge': ['merged'],
+}
+
+# The topsApp stage of the checkpoint that writes each step's outputs
+STEP_STAGES = {
+    'preprocess': 'preprocess',
+    'coregistration': 'filter',
+    'interferogram': 'filter',
+    'merge': 'filter',
+}
+
+# Files no policy removes, which document the pair and let it be rerun
+ALWAYS_KEEP = ['topsApp.xml', 'isce.log', checkpoint.CHECKPOINT_FILE, '*.EOF']
+
+DEFAULT_POLICY = {
+    'preprocess': {'action': DELETE, 'keep': []},
+    'coregistration': {'action': DELETE, 'keep': []},
+    'interferogram': {'action': DELETE, 'keep': []},
+    'merge': {'action': DELETE, 'keep': []},
+}
+
+# Seconds between checks of the free disk while new pairs are held back
+POLL_SECONDS = 30
+
+
+def load_policy(policy_file=None):
+    """Return the default policy, updated with the steps of a JSON policy file if given
+
+    A policy file maps step names to an `action`, one of delete, compress or keep, and an
+    optional `keep` list of glob patterns, matched against file names and paths relative to
+    the pair's ISCE directory.
+    """
+    policy = copy.deepcopy(DEFAULT_POLICY)
+    if policy_file is not None:
+        with open(policy_file) as f:
+            for step, rule in json.load(f).items():
+                if step not in STEP_OUTPUTS:
+                    raise ValueError('Unknown step {} in {}; expected one of {}'.format(
+                        step, policy_file, ', '.join(STEP_OUTPUTS)))
+                if rule.get('action', DELETE) not in ACTIONS:
+                    raise ValueError('Unknown action {} for {} in {}; expected one of {}'.format(
+                        rule['action'], step, policy_file, ', '.join(ACTIONS)))
+                policy[step] = {'action': rule.get('action', DELETE), 'keep': list(rule.get('keep', []))}
+    return policy
+
+
+def _kept(relpath, patterns):
+    name = os.path.basename(relpath)
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relpath, pattern) for pattern in patterns)
+
+
+def _compress(path):
+    """gzip a file in place, returning the bytes saved"""
+    with open(path, 'rb') as src, gzip.open(path + '.gz.tmp', 'wb', compresslevel=1) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(path + '.gz.tmp', path + '.gz')
+    saved = os.path.getsize(path) - os.path.getsize(path + '.gz')
+    os.remove(path)
+    return saved
+
+
+def _files(path):
+    if not os.path.isdir(path) or os.path.islink(path):
+        yield path
+        return
+    for root, _, names in os.walk(path):
+        for name in names:
+            yield os.path.join(root, name)
+
+
+def _remove_empty_dirs(path):
+    if not os.path.isdir(path) or os.path.islink(path):
+        return
+    for root, _, _ in os.walk(path, topdown=False):
+        if not os.listdir(root):
+            os.rmdir(root)
+
+
+def reclaim(isce_dir, policy=DEFAULT_POLICY):
+    """Delete or compress the intermediate outputs of a collected pair, following a retention policy
+
+    Args:
+        isce_dir: The pair's ISCE directory, like 20160408T091355_20160420T091355/iw1
+        policy: dict of each step in STEP_OUTPUTS to its action and keep-list
+
+    The pair's checkpoint is rewound to before the first stage whose outputs are gone when
+    `merged`, which collecting the pair again would need, is deleted or compressed.
+
+    Returns:
+        freed: Bytes of disk freed
+    """
+    freed = 0
+    reclaimed = set()
+    for step, rule in policy.items():
+        if rule['action'] == KEEP:
+            continue
+        keep = ALWAYS_KEEP + list(rule.get('keep', []))
+        for output in STEP_OUTPUTS[step]:
+            path = os.path.join(isce_dir, output)
+            if not os.path.lexists(path):
+                continue
+            for filename in _files(path):
+                if _kept(os.path.relpath(filename, isce_dir), keep):
+                    continue
+                stat = os.lstat(filename)
+                # Other links, like products in PRODUCT or scenes in the scene cache, keep the data on disk
+                only_link = not os.path.islink(filename) and stat.st_nlink == 1
+                if rule['action'] == DELETE:
+                    os.remove(filename)
+                    freed += stat.st_size if only_link else 0
+                    reclaimed.add(step)
+                elif only_link and not filename.endswith('.gz'):
+                    freed += _compress(filename)
+                    reclaimed.add(step)
+            _remove_empty_dirs(path)
+    if 'merge' in reclaimed:
+        first = min(checkpoint.STAGE_NAMES.index(STEP_STAGES[step]) for step in reclaimed)
+        checkpoint.rewind(isce_dir, checkpoint.STAGE_NAMES[first - 1] if first else None)
+    return freed
+
+
+class DiskWatermark:
+    """Hold back new pairs while the free disk of a directory is below a watermark
+
+    Pairs are admitted before their first stage and released once they're reclaimed, or
+    fail. A pair is always admitted when no other pair is in flight, since waiting couldn't
+    free anything. With `max_in_flight`, a pair also waits while that many pairs are in
+    flight, so the scratch disk planned for them is all they use.
+
+    Args:
+        path: Directory on the file system to watch
+        min_free: Bytes of free disk below which new pairs wait
+        max_in_flight: Most pairs to have in flight at once, if limited
+        poll_seconds: Seconds between checks while waiting
+    """
+    def __init__(self, path, min_free, max_in_flight=None, poll_seconds=POLL_SECONDS, log=print):
+        self.path = path
+        self.min_free = min_free
+        self.max_in_flight = max_in_flight
+        self.poll_seconds = poll_seconds
+        self.log = log
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def free(self):
+        return shutil.disk_usage(self.path).free
+
+    def admit(self, item=None):
+        waiting = False
+        while True:
+            with self._lock:
+                full = self.max_in_flight is not None and self.in_flight >= self.max_in_flight
+                if not full and (not self.in_flight or self.free() >= self.min_free):
+                    self.in_flight += 1
+                    return
+            if not waiting:
+                if full:
+                    self.log('Holding back {} until one of the {} pairs in flight is reclaimed'.format(
+                        item or 'the next pair', self.in_flight))
+                else:
+                    self.log('Holding back {} until more than {:.1f} GB of disk is free'.format(
+                        item or 'the next pair', self.min_free / 1024 ** 3))
+                waiting = True
+            time.sleep(self.poll_seconds)
+
+    def release(self):
+        with self._lock:
+            self.in_flight = max(self.in_flight - 1, 0)
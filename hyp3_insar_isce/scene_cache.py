@@ -0,0 +1,105 @@
+"""Content-addressed cache of topsApp preprocessed scenes, shared between the pairs of a stack
+
+The burst products extracted by topsApp record the output directory they were written
+to, so the role (`master` or `slave`) a scene was extracted for is part of its key. The
+preprocess step's state in PICKLE records the scenes of its pair, so it's keyed by both
+of them and only reused by the same pair, e.g. when it's rerun or processed again in
+another stack with other filtering or unwrapping settings.
+"""
+
+import hashlib
+import json
+import os
+
+from lxml import etree
+
+from hyp3_insar_isce.file_system import link_tree, replace_tree
+
+ROLES = ('master', 'slave')
+
+
+def _digest(fields):
+    return hashlib.sha1(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+def read_pair_inputs(xml_file):
+    """Return the preprocessing inputs of each role in a pair's topsApp.xml
+
+    Returns:
+        inputs: dict of role name to a dict of the role's properties
+    """
+    root = etree.parse(xml_file)
+    inputs = {}
+    for comp in root.findall('component/component'):
+        if comp.attrib['name'] in ROLES:
+            inputs[comp.attrib['name']] = {c.attrib['name']: c.text.strip() for c in comp.findall('property')}
+    return inputs
+
+
+def scene_key(role, properties):
+    """Return the cache key of a scene preprocessed for a role"""
+    return _digest({
+        'role': role,
+        'output directory': properties.get('output directory', role),
+        'safe': os.path.basename(properties['safe']),
+        'swath number': properties['swath number'],
+        'region of interest': properties.get('region of interest'),
+        'orbit file': os.path.basename(properties['orbit file']),
+    })
+
+
+def pickle_key(inputs):
+    """Return the cache key of the preprocess step state for pairs with these inputs
+
+    The state depends on the scenes of each role as well as on the processing configuration.
+    """
+    return _digest({'state': {role: scene_key(role, properties) for role, properties in inputs.items()}})
+
+
+def pair_keys(pair_dir):
+    """Return the scene keys of each role, and the preprocess state key, for a pair directory"""
+    inputs = read_pair_inputs(os.path.join(pair_dir, 'topsApp.xml'))
+    return {role: scene_key(role, properties) for role, properties in inputs.items()}, pickle_key(inputs)
+
+
+def is_cached(cache_dir, key):
+    return os.path.isdir(os.path.join(cache_dir, key))
+
+
+def store(cache_dir, pair_dir):
+    """Add the preprocessed scenes, and the preprocess step state, of a pair to the cache"""
+    keys, state_key = pair_keys(pair_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    for role, key in keys.items():
+        if not is_cached(cache_dir, key):
+            replace_tree(os.path.join(pair_dir, role), os.path.join(cache_dir, key))
+    if not is_cached(cache_dir, state_key):
+        replace_tree(os.path.join(pair_dir, 'PICKLE'), os.path.join(cache_dir, state_key))
+
+
+def seed(cache_dir, pair_dir):
+    """Link cached preprocessed scenes into a pair directory
+
+    Returns:
+        seeded: True if the pair's preprocess step no longer needs to be run
+    """
+    keys, state_key = pair_keys(pair_dir)
+    if not all(is_cached(cache_dir, key) for key in list(keys.values()) + [state_key]):
+        return False
+
+    for role, key in keys.items():
+        if not os.path.exists(os.path.join(pair_dir, role)):
+            link_tree(os.path.join(cache_dir, key), os.path.join(pair_dir, role))
+    if not os.path.exists(os.path.join(pair_dir, 'PICKLE')):
+        link_tree(os.path.join(cache_dir, state_key), os.path.join(pair_dir, 'PICKLE'))
+    return True
+
+
+def select_preprocess_pairs(cache_dir, pair_dirs):
+    """Return the pairs that need preprocessing, in order: those the cache can't seed"""
+    selected = []
+    for pair_dir in pair_dirs:
+        keys, state_key = pair_keys(pair_dir)
+        if not all(is_cached(cache_dir, key) for key in list(keys.values()) + [state_key]):
+            selected.append(pair_dir)
+    return selected
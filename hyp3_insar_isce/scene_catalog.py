@@ -0,0 +1,228 @@
+"""Index the Sentinel-1 SAFE files of a working directory once, and query them without rescanning
+
+The catalog is a SQLite database in the working directory. It holds, for each SAFE file,
+its date, mission and orbits, and for each of its subswaths the annotation file, platform
+heading, image size, bursts, footprint and bounding box. Scenes are read when they're first seen, and
+again only when their SAFE directory changes.
+"""
+
+import json
+import math
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+from lxml import etree
+
+from hyp3_insar_isce.bursts import bounding_box, burst_bounds
+from hyp3_insar_isce.pair_network import find_annotation
+
+CATALOG_FILE = 'scene_catalog.db'
+
+SWATHS = (1, 2, 3)
+
+# Constants of ESA's burst ID definition for IW SLCs: the burst cycle, the preamble before
+# the first burst of an orbit, and the length of an orbit
+BURST_CYCLE_SECONDS = 2.758273
+PREAMBLE_SECONDS = 2.299849
+ORBIT_SECONDS = 12 * 24 * 3600 / 175
+
+# Seconds from the start of a burst of each subswath to the middle of the IW2 burst of the same cycle
+IW2_MID_BURST_OFFSETS = {1: 1.371, 2: 0.539, 3: -0.539}
+
+# Absolute orbit of the first orbit of relative orbit 1, for each mission
+RELATIVE_ORBIT_OFFSETS = {'S1A': 73, 'S1B': 27}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    name TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    mission TEXT NOT NULL,
+    absolute_orbit INTEGER NOT NULL,
+    relative_orbit INTEGER,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS swaths (
+    name TEXT NOT NULL,
+    swath INTEGER NOT NULL,
+    annotation TEXT NOT NULL,
+    heading REAL,
+    samples INTEGER NOT NULL,
+    lines_per_burst INTEGER NOT NULL,
+    bursts TEXT NOT NULL,
+    footprint TEXT NOT NULL,
+    south REAL NOT NULL,
+    north REAL NOT NULL,
+    west REAL NOT NULL,
+    east REAL NOT NULL,
+    PRIMARY KEY (name, swath)
+);
+"""
+
+_SAFE_NAME = re.compile(r'^(S1[AB])_IW_SLC__\w{4}_(\d{8}T\d{6})_\d{8}T\d{6}_(\d{6})_\w{6}_\w{4}\.SAFE$')
+
+
+def connect(catalog_file=CATALOG_FILE):
+    """Open a catalog, creating it if it doesn't exist"""
+    conn = sqlite3.connect(catalog_file, timeout=60)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _time(timestamp):
+    return datetime.strptime(timestamp.strip()[:26], '%Y-%m-%dT%H:%M:%S.%f')
+
+
+def relative_orbit(mission, absolute_orbit):
+    return (absolute_orbit - RELATIVE_ORBIT_OFFSETS[mission]) % 175 + 1
+
+
+def ascending_node_time(safe):
+    """Return the time a SAFE's orbit crossed the ascending node, from its manifest, or None"""
+    manifest = os.path.join(safe, 'manifest.safe')
+    if not os.path.isfile(manifest) or not os.path.getsize(manifest):
+        return None
+    for _, element in etree.iterparse(manifest, tag='{*}ascendingNodeTime'):
+        return _time(element.text)
+    return None
+
+
+def burst_id(azimuth_time, swath, anx_time, track):
+    """Return ESA's ID of the burst of a subswath starting at azimuth_time
+
+    Bursts acquired at the same place on different passes share an ID. Scenes that cross
+    the ascending node aren't accounted for.
+    """
+    since_anx = (azimuth_time - anx_time).total_seconds() + IW2_MID_BURST_OFFSETS[swath]
+    return 1 + int(math.floor((PREAMBLE_SECONDS + since_anx + (track - 1) * ORBIT_SECONDS) / BURST_CYCLE_SECONDS))
+
+
+def read_swath(annotation, swath, anx_time=None, track=None):
+    """Read the heading, bursts, footprint and bounding box of a subswath from its annotation"""
+    root = etree.parse(annotation).getroot()
+
+    heading = root.findtext('generalAnnotation/productInformation/platformHeading')
+    points = {}
+    for point in root.iterfind('geolocationGrid/geolocationGridPointList/geolocationGridPoint'):
+        points[int(point.findtext('line')), int(point.findtext('pixel'))] = (
+            float(point.findtext('latitude')), float(point.findtext('longitude'))
+        )
+    lines = sorted({line for line, _ in points})
+
+    azimuth_times = [_time(azimuth_time.text) for azimuth_time in
+                     root.iterfind('swathTiming/burstList/burst/azimuthTime')]
+    lines_per_burst = root.findtext('swathTiming/linesPerBurst')
+    lines_per_burst = int(lines_per_burst) if lines_per_burst else lines[-1] // max(len(azimuth_times), 1)
+    samples = root.findtext('imageAnnotation/imageInformation/numberOfSamples')
+    samples = int(samples) if samples else max(pixel for _, pixel in points) + 1
+    bursts = []
+    for start, bounds in zip(azimuth_times, burst_bounds(points, lines_per_burst, len(azimuth_times))):
+        burst = {'azimuth_time': start.isoformat(),
+                 'id': burst_id(start, swath, anx_time, track) if anx_time is not None else None}
+        burst.update(zip(('south', 'north', 'west', 'east'), bounds))
+        bursts.append(burst)
+
+    pixels = sorted({pixel for _, pixel in points})
+    # Corners in the order of hyp3lib's getSubSwath.get_real_cc
+    footprint = [points[lines[0], pixels[0]], points[lines[-1], pixels[0]], points[lines[-1], pixels[-1]],
+                 points[lines[0], pixels[-1]]]
+
+    south, north, west, east = bounding_box(points.values())
+    return {
+        'swath': swath, 'annotation': annotation, 'heading': float(heading) if heading is not None else None,
+        'samples': samples, 'lines_per_burst': lines_per_burst, 'bursts': bursts, 'footprint': footprint,
+        'south': south, 'north': north, 'west': west, 'east': east,
+    }
+
+
+def read_scene(safe):
+    """Read the catalog entry of a SAFE file, with each of its subswaths"""
+    name = os.path.basename(os.path.normpath(safe))
+    match = _SAFE_NAME.match(name)
+    if match is None:
+        raise ValueError('Not a Sentinel-1 IW SLC: {}'.format(safe))
+    mission, date, orbit = match.groups()
+    track = relative_orbit(mission, int(orbit)) if mission in RELATIVE_ORBIT_OFFSETS else None
+    anx_time = ascending_node_time(safe) if track is not None else None
+
+    return {
+        'name': name, 'date': date, 'mission': mission, 'absolute_orbit': int(orbit), 'relative_orbit': track,
+        'mtime': os.stat(safe).st_mtime,
+        'swaths': {swath: read_swath(find_annotation(safe, swath), swath, anx_time, track) for swath in SWATHS},
+    }
+
+
+def _store(conn, scene):
+    conn.execute('DELETE FROM swaths WHERE name = ?', (scene['name'],))
+    conn.execute(
+        'INSERT OR REPLACE INTO scenes (name, date, mission, absolute_orbit, relative_orbit, mtime) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        (scene['name'], scene['date'], scene['mission'], scene['absolute_orbit'], scene['relative_orbit'],
+         scene['mtime']),
+    )
+    for swath in scene['swaths'].values():
+        conn.execute(
+            'INSERT INTO swaths (name, swath, annotation, heading, samples, lines_per_burst, bursts, footprint, south, '
+            'north, west, east) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            # Relative to the directory of the SAFE file, which can be linked into other working directories
+            (scene['name'], swath['swath'], os.path.join(scene['name'], 'annotation',
+                                                         os.path.basename(swath['annotation'])),
+             swath['heading'], swath['samples'], swath['lines_per_burst'], json.dumps(swath['bursts']),
+             json.dumps(swath['footprint']), swath['south'], swath['north'], swath['west'], swath['east']),
+        )
+
+
+def update(conn, directory='.'):
+    """Bring the catalog up to date with the SAFE files in a directory
+
+    Only SAFE files that are new, or changed since they were indexed, are read; scenes that
+    are gone are dropped.
+
+    Returns:
+        indexed: Names of the scenes read
+    """
+    indexed = {row['name']: row['mtime'] for row in conn.execute('SELECT name, mtime FROM scenes')}
+    found = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith('.SAFE') and _SAFE_NAME.match(entry.name) and entry.is_dir():
+                found[entry.name] = entry.stat().st_mtime
+
+    changed = sorted(name for name, mtime in found.items() if indexed.get(name) != mtime)
+    with conn:
+        for name in set(indexed) - set(found):
+            conn.execute('DELETE FROM swaths WHERE name = ?', (name,))
+            conn.execute('DELETE FROM scenes WHERE name = ?', (name,))
+        for name in changed:
+            print('Indexing %s' % name)
+            _store(conn, read_scene(os.path.join(directory, name)))
+    return changed
+
+
+def get_file_list(conn):
+    """Return the names and dates of the scenes in the catalog, sorted by date, like hyp3lib's get_file_list"""
+    rows = conn.execute('SELECT name, date FROM scenes ORDER BY date, name').fetchall()
+    return [row['name'] for row in rows], [row['date'] for row in rows]
+
+
+def _swath(row, directory):
+    swath = dict(row)
+    swath['annotation'] = os.path.join(directory, swath['annotation'])
+    swath['bursts'] = json.loads(swath['bursts'])
+    swath['footprint'] = json.loads(swath['footprint'])
+    return swath
+
+
+def get_swath(conn, safe, swath):
+    """Return the catalog entry of a subswath of a SAFE file, indexing the SAFE first if it's new or changed"""
+    name = os.path.basename(os.path.normpath(safe))
+    row = conn.execute('SELECT mtime FROM scenes WHERE name = ?', (name,)).fetchone()
+    if row is None or row['mtime'] != os.stat(safe).st_mtime:
+        with conn:
+            _store(conn, read_scene(safe))
+    row = conn.execute('SELECT * FROM swaths WHERE name = ? AND swath = ?', (name, int(swath))).fetchone()
+    if row is None:
+        raise ValueError('Invalid sub-swath {} of {}'.format(swath, safe))
+    return _swath(row, os.path.dirname(os.path.normpath(safe)))
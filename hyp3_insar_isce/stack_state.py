@@ -0,0 +1,82 @@
+"""Track the scenes, pairs and products of a stack between runs
+
+The state of a stack is kept in a JSON file in its working directory:
+
+    {
+        "scenes": ["S1A_IW_SLC__1SDV_20160408T091355_...", ...],
+        "pairs": {
+            "20160408T091355_20160420T091355/iw1": {
+                "reference": "S1A_IW_SLC__1SDV_20160408T091355_...",
+                "secondary": "S1A_IW_SLC__1SDV_20160420T091355_...",
+                "products": {"20160408T091355_20160420T091355_iw1_amp.tif": "<sha256>", ...}
+            },
+            ...
+        }
+    }
+
+so that when new scenes arrive only the pairs they add need to be processed.
+"""
+
+import hashlib
+import json
+import os
+
+STATE_FILE = 'stack_state.json'
+
+
+def load(state_file=STATE_FILE):
+    """Load the state of a stack; a stack that was never processed has no scenes or pairs"""
+    if not os.path.exists(state_file):
+        return {'scenes': [], 'pairs': {}}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def save(state, state_file=STATE_FILE):
+    """Atomically save the state of a stack"""
+    tmp = state_file + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, state_file)
+
+
+def pair_key(mydir, ss):
+    return '%s/%s' % (mydir, ss)
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 ** 2), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def new_scenes(state, filenames):
+    """Return the scenes that are not yet part of the stack"""
+    known = set(state['scenes'])
+    return [filename for filename in filenames if os.path.basename(filename) not in known]
+
+
+def add_scenes(state, filenames):
+    for filename in new_scenes(state, filenames):
+        state['scenes'].append(os.path.basename(filename))
+    state['scenes'].sort()
+
+
+def is_processed(state, mydir, ss):
+    """Return whether the products of a pair were already collected"""
+    return bool(state['pairs'].get(pair_key(mydir, ss), {}).get('products'))
+
+
+def add_pair(state, mydir, ss, reference, secondary):
+    state['pairs'].setdefault(pair_key(mydir, ss), {'products': {}}).update({
+        'reference': os.path.basename(reference),
+        'secondary': os.path.basename(secondary),
+    })
+
+
+def record_products(state, mydir, ss, products, product_dir='PRODUCT'):
+    """Record the products collected from a pair with their SHA-256 checksums"""
+    pair = state['pairs'].setdefault(pair_key(mydir, ss), {'products': {}})
+    pair['products'] = {product: file_sha256(os.path.join(product_dir, product)) for product in products}
@@ -0,0 +1,135 @@
+"""Write the topsApp.xml files of many pairs from one compiled template
+
+The template is parsed, configured for the stack and serialized once. Each pair's
+topsApp.xml is then rendered by substituting its scenes, orbit files and subswath into the
+serialized text, without building or walking an XML tree per pair.
+"""
+
+import os
+import re
+from xml.sax.saxutils import escape
+
+from lxml import etree
+
+from hyp3_insar_isce.file_system import link_or_symlink
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'etc', 'isceS1template.xml')
+HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+# topsinsar properties that can be overridden, by option name
+OVERRIDES = {
+    'range_looks': 'range looks',
+    'azimuth_looks': 'azimuth looks',
+    'unwrapper': 'unwrapper name',
+    'filter_strength': 'filter strength',
+}
+
+# Template components of the scenes in a pair, and the properties of each that change from pair to pair
+ROLES = {'master': 'reference', 'slave': 'secondary'}
+PAIR_PROPERTIES = {'safe': '{role}', 'orbit file': '{role}_orbit', 'swath number': 'swath'}
+
+_FIELD = re.compile(r'@@(\w+)@@')
+
+
+def bounds_text(bounds):
+    """Format (south, north, west, east) as topsApp expects a bounding box"""
+    return '[{}, {}, {}, {}]'.format(*bounds)
+
+
+def set_property(component, name, value):
+    """Set a property of a template component, adding it if the template doesn't have it"""
+    for prop in component.findall('property'):
+        if prop.attrib['name'] == name:
+            prop.text = str(value)
+            return
+    prop = etree.Element('property', name=name)
+    prop.text = str(value)
+    component.append(prop)
+
+
+class TopsAppTemplate:
+    """A topsApp.xml template configured for a stack, to render the topsApp.xml of each of its pairs
+
+    Args:
+        unwrap: If True, turn on unwrapping
+        gbb: Geocoding bounding box (south, north, west, east)
+        roi: Region of interest (south, north, west, east) to process in both scenes
+        dem: ISCE DEM file to use, instead of having topsApp get one
+        overrides: dict of topsinsar settings to override, by their name in OVERRIDES
+        template_file: topsApp.xml template to start from
+    """
+    def __init__(self, unwrap=False, gbb=None, roi=None, dem=None, overrides=None, template_file=TEMPLATE):
+        root = etree.parse(template_file)
+
+        topsinsar = root.find('component')
+        set_property(topsinsar, 'do unwrap', unwrap)
+        for option, value in (overrides or {}).items():
+            if option not in OVERRIDES:
+                raise ValueError('Unknown topsApp override {}; expected one of {}'.format(option, ', '.join(OVERRIDES)))
+            if value is not None:
+                set_property(topsinsar, OVERRIDES[option], value)
+        if gbb is not None:
+            set_property(topsinsar, 'geocode bounding box', bounds_text(gbb))
+        if dem is not None:
+            set_property(topsinsar, 'demfilename', os.path.abspath(dem))
+
+        for comp in root.findall('component/component'):
+            role = ROLES.get(comp.attrib['name'])
+            if role is None:
+                continue
+            for prop in comp.findall('property'):
+                if prop.attrib['name'] in PAIR_PROPERTIES:
+                    prop.text = '@@{}@@'.format(PAIR_PROPERTIES[prop.attrib['name']].format(role=role))
+            if roi is not None:
+                set_property(comp, 'region of interest', bounds_text(roi))
+
+        text = etree.tostring(root, pretty_print=True, encoding='unicode')
+        self._compiled = HEADER + _FIELD.sub(r'{\1}', text.replace('{', '{{').replace('}', '}}'))
+
+    def render(self, swath, reference, secondary, reference_orbit, secondary_orbit):
+        """Return the topsApp.xml of a pair
+
+        Args:
+            swath: Subswath number to process
+            reference: Reference SAFE file
+            secondary: Secondary SAFE file
+            reference_orbit: Name of the reference orbit file, in the pair's directory
+            secondary_orbit: Name of the secondary orbit file, in the pair's directory
+        """
+        return self._compiled.format(
+            swath=swath, reference=escape(os.path.abspath(reference)), secondary=escape(os.path.abspath(secondary)),
+            reference_orbit=escape(reference_orbit), secondary_orbit=escape(secondary_orbit),
+        )
+
+    def write(self, xml_file, swath, reference, secondary, reference_orbit, secondary_orbit):
+        with open(xml_file, 'w') as f:
+            f.write(self.render(swath, reference, secondary, reference_orbit, secondary_orbit))
+
+
+def write_pair_xmls(template, pairs, swath, orbit_files):
+    """Set up the ISCE directory of every pair, with its orbit files and topsApp.xml, in one pass
+
+    Args:
+        template: TopsAppTemplate configured for the stack
+        pairs: list of (pair_dir, reference, secondary) for each pair
+        swath: Subswath number to process
+        orbit_files: dict of each SAFE file to its orbit file, linked into the directory of every pair using it
+
+    Returns:
+        xml_files: The topsApp.xml file of each pair
+    """
+    ssname = 'iw{}'.format(swath)
+    xml_files = []
+    for pair_dir, reference, secondary in pairs:
+        isce_dir = os.path.join(pair_dir, ssname)
+        os.makedirs(isce_dir, exist_ok=True)
+        for safe in (reference, secondary):
+            orbit_file = os.path.join(isce_dir, os.path.basename(orbit_files[safe]))
+            if not os.path.exists(orbit_file):
+                link_or_symlink(orbit_files[safe], orbit_file)
+
+        xml_file = os.path.join(isce_dir, 'topsApp.xml')
+        template.write(xml_file, swath, reference, secondary, os.path.basename(orbit_files[reference]),
+                       os.path.basename(orbit_files[secondary]))
+        xml_files.append(xml_file)
+    return xml_files
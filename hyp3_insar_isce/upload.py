@@ -0,0 +1,109 @@
+"""Upload products to S3 in concurrent parts while they are still being written"""
+
+import base64
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+# S3 requires every part but the last to be at least 5 MB
+PART_SIZE = 64 * 1024 ** 2
+RETRY_ERRORS = (BotoCoreError, ClientError, OSError)
+
+
+class Tee:
+    """Write to several file objects at once"""
+    def __init__(self, *fileobjs):
+        self.fileobjs = fileobjs
+
+    def write(self, data):
+        for fileobj in self.fileobjs:
+            fileobj.write(data)
+
+
+class MultipartUpload:
+    """A write-only stream that uploads to S3 in parts as data is written to it
+
+    Parts are uploaded concurrently, with at most `2 * workers` parts held in memory, and
+    a failed part is retried on its own. The size and SHA-256 checksum of the object are
+    computed as it's written, so the data never has to be read back.
+
+    Use as a context manager; the upload is completed on a clean exit and aborted otherwise.
+    """
+    def __init__(self, client, bucket, key, part_size=PART_SIZE, workers=4, retries=3):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.retries = retries
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self._buffer = bytearray()
+        self._parts = []
+        self._slots = threading.BoundedSemaphore(2 * workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self.upload_id = client.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.complete()
+        else:
+            self.abort()
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        self._buffer += data
+        while len(self._buffer) >= self.part_size:
+            self._submit(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+
+    def _submit(self, data):
+        self._slots.acquire()
+        future = self._executor.submit(self._upload_part, len(self._parts) + 1, data)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._parts.append(future)
+
+    def _upload_part(self, number, data):
+        md5 = base64.b64encode(hashlib.md5(data).digest()).decode()
+        for attempt in range(1, self.retries + 1):
+            try:
+                response = self.client.upload_part(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=data,
+                    ContentMD5=md5,
+                )
+                return {'PartNumber': number, 'ETag': response['ETag']}
+            except RETRY_ERRORS as e:
+                if attempt == self.retries:
+                    raise
+                print('Retrying part {} of s3://{}/{} after error: {}'.format(number, self.bucket, self.key, e))
+
+    def complete(self):
+        """Upload the last part and complete the upload
+
+        Returns:
+            checksum: Hex SHA-256 checksum of the uploaded object
+        """
+        if self._buffer or not self._parts:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        try:
+            parts = [future.result() for future in self._parts]
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={'Parts': parts},
+            )
+        except BaseException:  # noqa: B902
+            # Whatever went wrong, don't leave the parts uploaded so far to be billed
+            self.abort()
+            raise
+        finally:
+            self._executor.shutdown()
+        return self.sha256.hexdigest()
+
+    def abort(self):
+        self._executor.shutdown()
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
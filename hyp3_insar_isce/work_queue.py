@@ -0,0 +1,292 @@
+"""Share the pairs of a stack between worker processes, on any number of nodes, through a SQLite queue
+
+The coordinator sets up every pair directory and publishes a task for each pair; workers
+claim tasks under a lease, run them and report back. A worker renews the lease of its task
+while it runs, so a task whose worker dies goes back to the queue once its lease expires,
+and is retried up to `max_attempts` times before it's marked failed. A worker that loses
+the lease of its task, to another worker that claimed it after it expired, stops working
+on it, since both would otherwise write to the same pair directory.
+
+The queue is a single SQLite file, so it needs no outside services, only a file system
+shared by every worker that supports POSIX locks. It doesn't use SQLite's write-ahead log,
+which only works between processes on the same machine.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+QUEUE_FILE = 'stack_queue.db'
+
+# Seconds a claimed task is leased to its worker for, between renewals
+LEASE_SECONDS = 600
+
+# Attempts at a task before it's marked failed
+MAX_ATTEMPTS = 3
+
+# Seconds an idle worker waits before looking for tasks again, while other workers hold the rest
+POLL_SECONDS = 30
+
+# Task states
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    pair_dir TEXT NOT NULL,
+    swath TEXT NOT NULL,
+    inputs TEXT NOT NULL,
+    outputs TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    PRIMARY KEY (pair_dir, swath)
+);
+"""
+
+
+class LeaseLost(Exception):
+    """The lease of a task expired and it may have been claimed by another worker"""
+
+
+def connect(queue_file):
+    """Open a queue, creating it if it doesn't exist"""
+    conn = sqlite3.connect(queue_file, timeout=60, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+@contextmanager
+def _transaction(conn):
+    # Take the write lock up front, so two workers can't claim the same task
+    conn.execute('BEGIN IMMEDIATE')
+    committed = False
+    try:
+        yield
+        conn.execute('COMMIT')
+        committed = True
+    finally:
+        if not committed:
+            conn.execute('ROLLBACK')
+
+
+def _task(row):
+    task = dict(row)
+    task['inputs'] = json.loads(task['inputs'])
+    task['outputs'] = json.loads(task['outputs'])
+    return task
+
+
+def worker_name():
+    return '{}:{}:{}'.format(socket.gethostname(), os.getpid(), threading.get_ident())
+
+
+def publish(conn, tasks, settings=None):
+    """Add tasks to the queue, and store settings for the workers and the finalize step
+
+    Tasks are dicts of a `pair_dir`, a `swath`, the `inputs` of the pair and the `outputs`
+    it's expected to produce. Tasks already in the queue are kept as they are, except
+    failed ones, which are tried again.
+    """
+    with _transaction(conn):
+        for name, value in (settings or {}).items():
+            conn.execute('INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)', (name, json.dumps(value)))
+        for task in tasks:
+            conn.execute(
+                'INSERT OR IGNORE INTO tasks (pair_dir, swath, inputs, outputs) VALUES (?, ?, ?, ?)',
+                (task['pair_dir'], task['swath'], json.dumps(task['inputs']), json.dumps(task['outputs'])),
+            )
+            conn.execute(
+                'UPDATE tasks SET state = ?, attempts = 0, error = NULL WHERE pair_dir = ? AND swath = ? AND state = ?',
+                (PENDING, task['pair_dir'], task['swath'], FAILED),
+            )
+
+
+def settings(conn):
+    return {row['name']: json.loads(row['value']) for row in conn.execute('SELECT name, value FROM settings')}
+
+
+def claim(conn, worker, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+    """Lease the next pending task, or a running task whose lease expired, to a worker
+
+    Returns:
+        task: The claimed task, or None if no task can be claimed now
+    """
+    now = time.time()
+    with _transaction(conn):
+        conn.execute(
+            'UPDATE tasks SET state = ?, error = ? WHERE state = ? AND lease_expires < ? AND attempts >= ?',
+            (FAILED, 'Lease expired on the last attempt', RUNNING, now, max_attempts),
+        )
+        row = conn.execute(
+            'SELECT * FROM tasks WHERE state = ? OR (state = ? AND lease_expires < ?) ORDER BY pair_dir, swath LIMIT 1',
+            (PENDING, RUNNING, now),
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            'UPDATE tasks SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 '
+            'WHERE pair_dir = ? AND swath = ?',
+            (RUNNING, worker, now + lease_seconds, row['pair_dir'], row['swath']),
+        )
+        return _task(conn.execute('SELECT * FROM tasks WHERE pair_dir = ? AND swath = ?',
+                                  (row['pair_dir'], row['swath'])).fetchone())
+
+
+def _update_leased(conn, task, worker, assignments, values):
+    """Update a task only while it's still leased to the worker, returning whether it was"""
+    with _transaction(conn):
+        cursor = conn.execute(
+            'UPDATE tasks SET {} WHERE pair_dir = ? AND swath = ? AND worker = ? AND state = ?'.format(assignments),
+            tuple(values) + (task['pair_dir'], task['swath'], worker, RUNNING),
+        )
+        return cursor.rowcount == 1
+
+
+def renew(conn, task, worker, lease_seconds=LEASE_SECONDS):
+    """Extend the lease of a running task; returns False if the worker lost the lease"""
+    return _update_leased(conn, task, worker, 'lease_expires = ?', [time.time() + lease_seconds])
+
+
+def complete(conn, task, worker):
+    """Mark a task done
+
+    Raises:
+        LeaseLost: If the worker no longer holds the lease, so the task's result can't be trusted
+    """
+    if not _update_leased(conn, task, worker, 'state = ?, lease_expires = NULL, error = NULL', [DONE]):
+        raise LeaseLost('{} no longer holds the lease of {pair_dir}/{swath}'.format(worker, **task))
+
+
+def fail(conn, task, worker, error, max_attempts=MAX_ATTEMPTS):
+    """Put a failed task back in the queue, or mark it failed after its last attempt"""
+    state = FAILED if task['attempts'] >= max_attempts else PENDING
+    return _update_leased(conn, task, worker, 'state = ?, lease_expires = NULL, error = ?', [state, error])
+
+
+def release(conn, task, worker):
+    """Give a task back without counting the attempt, e.g. when the worker is stopped"""
+    return _update_leased(conn, task, worker, 'state = ?, lease_expires = NULL, attempts = attempts - 1',
+                          [PENDING])
+
+
+def counts(conn):
+    """Return the number of tasks in each state"""
+    return {row['state']: row['count'] for row in
+            conn.execute('SELECT state, COUNT(*) AS count FROM tasks GROUP BY state')}
+
+
+def tasks(conn, state=None):
+    """Return the tasks in the queue, or only those in a state, in pair order"""
+    if state is None:
+        rows = conn.execute('SELECT * FROM tasks ORDER BY pair_dir, swath')
+    else:
+        rows = conn.execute('SELECT * FROM tasks WHERE state = ? ORDER BY pair_dir, swath', (state,))
+    return [_task(row) for row in rows]
+
+
+class Lease:
+    """The lease of a claimed task, renewed in the background by keep_leased"""
+    def __init__(self, task):
+        self.task = task
+        self.lost = threading.Event()
+
+    def check(self):
+        """Raise LeaseLost if the lease couldn't be renewed, so the task stops before its next step"""
+        if self.lost.is_set():
+            raise LeaseLost('Lost the lease of {pair_dir}/{swath}'.format(**self.task))
+
+
+@contextmanager
+def keep_leased(queue_file, task, worker, lease_seconds=LEASE_SECONDS):
+    """Renew the lease of a task in the background until the block exits, yielding the Lease"""
+    stop = threading.Event()
+    lease = Lease(task)
+
+    def renew_until_stopped():
+        conn = connect(queue_file)
+        try:
+            while not stop.wait(lease_seconds / 3):
+                if not renew(conn, task, worker, lease_seconds):
+                    print('Lost the lease of {pair_dir}/{swath}'.format(**task))
+                    lease.lost.set()
+                    return
+        finally:
+            conn.close()
+
+    renewer = threading.Thread(target=renew_until_stopped, daemon=True)
+    renewer.start()
+    try:
+        yield lease
+    finally:
+        stop.set()
+        renewer.join()
+
+
+def work(queue_file, run, worker=None, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS,
+         poll_seconds=POLL_SECONDS):
+    """Claim and run tasks until every task in the queue is done or failed
+
+    Args:
+        queue_file: Queue to take tasks from
+        run: Function called with each claimed task and its Lease; the task fails if it raises, except with
+            LeaseLost, when it's left to whichever worker holds it now
+        worker: Name of the worker in the queue, by default its host, process and thread
+        lease_seconds: Seconds to lease each task for, between renewals
+        max_attempts: Attempts at a task before it's marked failed
+        poll_seconds: Seconds to wait for leases to expire while other workers hold the remaining tasks
+
+    Returns:
+        done: Number of tasks this worker finished
+    """
+    worker = worker or worker_name()
+    conn = connect(queue_file)
+    done = 0
+    try:
+        while True:
+            task = claim(conn, worker, lease_seconds=lease_seconds, max_attempts=max_attempts)
+            if task is None:
+                if not counts(conn).get(RUNNING):
+                    return done
+                time.sleep(poll_seconds)
+                continue
+
+            print('Worker {} running {pair_dir}/{swath}, attempt {attempts}'.format(worker, **task))
+            try:
+                with keep_leased(queue_file, task, worker, lease_seconds=lease_seconds) as lease:
+                    run(task, lease)
+                    lease.check()
+                complete(conn, task, worker)
+            except LeaseLost as e:
+                print('Abandoning {}/{}: {}'.format(task['pair_dir'], task['swath'], e))
+            except Exception as e:  # noqa: B902
+                # A failed task must not stop the worker
+                print('Task {}/{} failed: {}'.format(task['pair_dir'], task['swath'], e))
+                fail(conn, task, worker, '{}: {}'.format(type(e).__name__, e), max_attempts=max_attempts)
+            except BaseException:  # noqa: B902
+                release(conn, task, worker)
+                raise
+            else:
+                done += 1
+    finally:
+        conn.close()
+
+
+def work_concurrently(queue_file, run, workers, **kwargs):
+    """Run `workers` workers on this node, each in its own thread, returning the number of tasks they finished"""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(lambda _: work(queue_file, run, **kwargs), range(workers)))
@@ -32,10 +32,13 @@ setup(
     python_requires='~=3.7',
 
     install_requires=[
+        'boto3',
+        'h5py',
         'hyp3lib==1.4.1',
         'hyp3proclib~=1.0',
         'importlib_metadata',
         'lxml',
+        'numpy',
     ],
 
     extras_require={
@@ -50,9 +53,11 @@ setup(
 
     entry_points={'console_scripts': [
         'hyp3_insar_isce = hyp3_insar_isce.__main__:main',
+        'calibrateS1StackPlan.py = hyp3_insar_isce.planner:main',
         'procAllS1StackISCE.py = hyp3_insar_isce.proc_all_s1_stack_isce:main',
         'procS1ISCE.py = hyp3_insar_isce.proc_s1_isce:main',
         'procS1StackISCE.py = hyp3_insar_isce.proc_s1_stack_isce:main',
+        'procS1StackWorker.py = hyp3_insar_isce.proc_s1_stack_worker:main',
         ]
     },
 
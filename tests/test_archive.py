@@ -0,0 +1,82 @@
+import os
+import struct
+import zipfile
+import zlib
+
+from hyp3_insar_isce.archive import write_zip, zip_dir
+
+
+class Pipe:
+    """A write-only, unseekable stream"""
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+
+def make_product(tmp_path):
+    product = tmp_path / 'S1AA_20160408T091355_20160420T091423_VVP012_INT80_G_ueF_1A2B'
+    (product / 'browse').mkdir(parents=True)
+    (product / 'pair_iw1_unw_phase.tif').write_bytes(os.urandom(1000) + bytes(300000))
+    (product / 'pair_iw1_unw_phase.png').write_bytes(os.urandom(5000))
+    (product / 'pair_iw1.txt').write_text('baseline: 12.3\n')
+    (product / 'browse' / 'pair_iw1_color_phase.kmz').write_bytes(b'')
+    return product
+
+
+def test_zip_dir(tmp_path):
+    product = make_product(tmp_path)
+    zip_file = str(tmp_path / 'product.zip')
+    size = zip_dir(str(product), zip_file, workers=2)
+    assert size == os.path.getsize(zip_file)
+
+    with zipfile.ZipFile(zip_file) as zf:
+        assert zf.testzip() is None
+        infos = {info.filename: info for info in zf.infolist()}
+        assert sorted(infos) == sorted(
+            '{}/{}'.format(product.name, name) for name in
+            ('pair_iw1_unw_phase.tif', 'pair_iw1_unw_phase.png', 'pair_iw1.txt', 'browse/pair_iw1_color_phase.kmz')
+        )
+        for name, info in infos.items():
+            assert zf.read(info) == (tmp_path / name).read_bytes()
+
+        assert infos[product.name + '/pair_iw1_unw_phase.tif'].compress_type == zipfile.ZIP_DEFLATED
+        assert infos[product.name + '/pair_iw1_unw_phase.png'].compress_type == zipfile.ZIP_STORED
+
+
+def test_write_zip_to_stream(tmp_path):
+    product = make_product(tmp_path)
+    pipe = Pipe()
+    write_zip(str(product), pipe, store_geotiffs=True)
+
+    (tmp_path / 'streamed.zip').write_bytes(pipe.data)
+    with zipfile.ZipFile(str(tmp_path / 'streamed.zip')) as zf:
+        assert zf.testzip() is None
+        assert zf.getinfo(product.name + '/pair_iw1_unw_phase.tif').compress_type == zipfile.ZIP_STORED
+
+
+def test_local_headers(tmp_path):
+    product = make_product(tmp_path)
+    pipe = Pipe()
+    write_zip(str(product), pipe, store_geotiffs=True)
+
+    # Read the archive front to back from its local headers alone, as a streaming reader would
+    data, offset, names = pipe.data, 0, []
+    while struct.unpack_from('<I', data, offset)[0] == 0x04034b50:
+        _, _, flags, method, _, _, crc, compress_size, file_size, name_length, extra_length = struct.unpack_from(
+            '<IHHHHHIIIHH', data, offset)
+        assert not flags & 0x08
+        name = data[offset + 30:offset + 30 + name_length].decode('utf-8')
+        offset += 30 + name_length + extra_length
+        content = data[offset:offset + compress_size]
+        if method == zipfile.ZIP_DEFLATED:
+            content = zlib.decompress(content, -15)
+        assert len(content) == file_size
+        assert zlib.crc32(content) == crc
+        assert content == (tmp_path / name).read_bytes()
+        names.append(name)
+        offset += compress_size
+
+    assert len(names) == 4
+    assert struct.unpack_from('<I', data, offset)[0] == 0x02014b50
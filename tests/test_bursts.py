@@ -0,0 +1,74 @@
+import pytest
+
+from hyp3_insar_isce import bursts
+
+
+def swath(south, count=4, lines_per_burst=100, west=10.0):
+    # A geolocation grid with a line at each burst boundary, each burst 0.2 degrees long
+    points = {(line * lines_per_burst, pixel): (south + 0.2 * line, (west + 0.5 * pixel + 180) % 360 - 180)
+              for line in range(count + 1) for pixel in range(3)}
+    return {
+        'annotation': 'iw1.xml',
+        'bursts': [dict(zip(('south', 'north', 'west', 'east'), bounds))
+                   for bounds in bursts.burst_bounds(points, lines_per_burst, count)],
+    }
+
+
+def test_bounding_box():
+    assert bursts.bounding_box([(1.0, 2.0), (-1.0, 3.0)]) == (-1.0, 1.0, 2.0, 3.0)
+    assert bursts.bounding_box([(60.0, 179.5), (61.0, -179.5)]) == (60.0, 61.0, 179.5, 180.5)
+
+
+def test_burst_bounds():
+    points = {(line, pixel): (35.0 + line / 1000, 10.0 + pixel / 1000)
+              for line in (0, 98, 203, 301) for pixel in (0, 500)}
+    assert bursts.burst_bounds(points, 100, 3) == [
+        (35.0, 35.098, 10.0, 10.5), (35.098, 35.203, 10.0, 10.5), (35.203, 35.301, 10.0, 10.5),
+    ]
+
+
+def test_intersection():
+    assert bursts.intersection((0.0, 2.0, 0.0, 2.0), (1.0, 3.0, -1.0, 1.0)) == (1.0, 2.0, 0.0, 1.0)
+    assert bursts.intersection((0.0, 2.0, 0.0, 2.0), (2.5, 3.0, 0.0, 1.0)) is None
+
+
+def test_select_bursts():
+    assert bursts.select_bursts(swath(35.0), (35.25, 35.35, 10.2, 10.4)) == [1]
+    assert bursts.select_bursts(swath(35.0), (35.3, 35.5, 10.2, 10.4)) == [1, 2]
+    assert bursts.select_bursts(swath(35.0), (36.0, 37.0, 10.2, 10.4)) == []
+
+
+def test_stack_roi():
+    # The second scene starts a burst later
+    stack = [swath(35.0), swath(35.2)]
+    roi, selected = bursts.stack_roi(stack, (35.25, 35.35, 10.2, 10.4))
+    assert roi == (35.25, 35.35, 10.2, 10.4)
+    assert selected == [[1], [0]]
+
+    # Trimmed to the coverage of the stack
+    roi, selected = bursts.stack_roi(stack, (35.7, 36.5, 9.0, 10.4))
+    assert roi == pytest.approx((35.7, 36.0, 10.0, 10.4))
+    assert selected == [[3], [2, 3]]
+
+    with pytest.raises(ValueError):
+        bursts.stack_roi(stack, (34.0, 34.9, 10.2, 10.4))
+
+
+def test_stack_roi_across_antimeridian():
+    # Bursts from 179.5 to 180.5 degrees east, moved to 0 to 360 degrees of longitude
+    stack = [swath(60.0, west=179.5), swath(60.2, west=179.5)]
+    assert stack[0]['bursts'][0]['east'] == 180.5
+
+    # A region of interest east of the antimeridian, in -180 to 180 degrees
+    assert bursts.select_bursts(stack[0], (60.25, 60.35, -179.9, -179.7)) == [1]
+    roi, selected = bursts.stack_roi(stack, (60.25, 60.35, -179.9, -179.7))
+    assert roi == pytest.approx((60.25, 60.35, -179.9, -179.7))
+    assert selected == [[1], [0]]
+
+    # A region of interest across the antimeridian, from west to east
+    roi, selected = bursts.stack_roi(stack, (60.25, 60.35, 179.0, -179.0))
+    assert roi == pytest.approx((60.25, 60.35, 179.5, 180.5))
+    assert selected == [[1], [0]]
+
+    # West of the antimeridian, but nowhere near these bursts
+    assert bursts.select_bursts(stack[0], (60.25, 60.35, -170.0, -160.0)) == []
@@ -0,0 +1,49 @@
+from hyp3_insar_isce import checkpoint
+
+
+def test_remaining_stages(tmp_path):
+    pair_dir = str(tmp_path)
+    stages = [stage for stage, _ in checkpoint.remaining_stages(pair_dir)]
+    assert stages == ['preprocess', 'filter', 'unwrap', 'geocode']
+
+    stages = [stage for stage, _ in checkpoint.remaining_stages(pair_dir, unwrap=False)]
+    assert stages == ['preprocess', 'filter', 'geocode']
+
+    checkpoint.mark_stage(pair_dir, 'filter')
+    assert checkpoint.remaining_stages(pair_dir) == [('unwrap', '--dostep=unwrap'), ('geocode', '--dostep=geocode')]
+
+    checkpoint.mark_stage(pair_dir, 'geocode')
+    assert checkpoint.remaining_stages(pair_dir) == []
+
+
+def test_rewind(tmp_path):
+    pair_dir = str(tmp_path)
+    checkpoint.mark_stage(pair_dir, 'filter')
+    checkpoint.mark_collected(pair_dir, ['pair_iw1_amp.tif'])
+
+    # A pair is never moved forward
+    checkpoint.rewind(pair_dir, 'geocode')
+    assert checkpoint.load(pair_dir)['stage'] == 'filter'
+
+    checkpoint.rewind(pair_dir, 'preprocess')
+    assert checkpoint.load(pair_dir) == {'stage': 'preprocess', 'products': ['pair_iw1_amp.tif']}
+
+    checkpoint.rewind(pair_dir, None)
+    assert [stage for stage, _ in checkpoint.remaining_stages(pair_dir)] == ['preprocess', 'filter', 'unwrap',
+                                                                             'geocode']
+
+
+def test_is_collected(tmp_path):
+    pair_dir = tmp_path / 'pair'
+    product_dir = tmp_path / 'PRODUCT'
+    pair_dir.mkdir()
+    product_dir.mkdir()
+    assert not checkpoint.is_collected(str(pair_dir), str(product_dir))
+
+    checkpoint.mark_collected(str(pair_dir), ['pair_iw1_amp.tif', 'pair_iw1.txt'])
+    (product_dir / 'pair_iw1_amp.tif').touch()
+    assert not checkpoint.is_collected(str(pair_dir), str(product_dir))
+
+    (product_dir / 'pair_iw1.txt').touch()
+    assert checkpoint.is_collected(str(pair_dir), str(product_dir))
+    assert checkpoint.load(str(pair_dir))['stage'] is None
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+datacube = pytest.importorskip('hyp3_insar_isce.datacube')
+h5py = pytest.importorskip('h5py')
+
+GRID = {'crs': 'EPSG:32611', 'x0': 500000.0, 'y0': 4000000.0, 'res': 30.0, 'width': 5, 'height': 4}
+
+
+def layers(value):
+    return {name: np.full((4, 5), value + index, dtype='f4') for index, name in enumerate(datacube.LAYERS)}
+
+
+def test_pair_times():
+    assert datacube.pair_times('20160408T091355_20160420T091356') == ('2016-04-08T09:13:55', '2016-04-20T09:13:56')
+
+
+def test_create(tmp_path):
+    cube_file = str(tmp_path / datacube.CUBE_FILE)
+    datacube.create(cube_file, GRID)
+
+    assert datacube.read_grid(cube_file) == GRID
+    assert datacube.pairs(cube_file) == []
+    with h5py.File(cube_file, 'r') as f:
+        assert f['x'][0] == 500015.0
+        assert f['y'][-1] == 3999895.0
+        assert f['unw_phase'].shape == (0, 4, 5)
+        assert f['unw_phase'].chunks == (1, 4, 5)
+        assert f['unw_phase'].dims[1][0] == f['y']
+
+
+def test_append_pair(tmp_path, monkeypatch):
+    cube_file = str(tmp_path / datacube.CUBE_FILE)
+    datacube.create(cube_file, GRID)
+    # Layers are written a chunk of rows at a time
+    monkeypatch.setattr(datacube, 'CHUNK_SIZE', 3)
+
+    datacube.append_pair(cube_file, 'a_b_iw1', layers(1.0),
+                         {'baseline': 12.5, 'heading': -166.0, 'utctime': 33235.5, 'reference_time': '2016-04-08'})
+    datacube.append_pair(cube_file, 'b_c_iw1', layers(10.0), {'baseline': None})
+    assert datacube.pairs(cube_file) == ['a_b_iw1', 'b_c_iw1']
+
+    # Appending a pair again replaces it
+    datacube.append_pair(cube_file, 'a_b_iw1', layers(2.0), {'baseline': 13.0})
+    assert datacube.pairs(cube_file) == ['a_b_iw1', 'b_c_iw1']
+
+    with h5py.File(cube_file, 'r') as f:
+        assert f['unw_phase'].shape == (2, 4, 5)
+        assert (f['unw_phase'][0] == 2.0).all()
+        assert (f['amp'][1] == 12.0).all()
+        assert f['baseline'][0] == 13.0
+        assert np.isnan(f['baseline'][1])
+        assert f['reference_time'][1] in (b'', '')
+
+    with pytest.raises(ValueError):
+        datacube.append_pair(cube_file, 'c_d_iw1', {name: np.zeros((3, 5)) for name in datacube.LAYERS}, {})
+    assert datacube.pairs(cube_file) == ['a_b_iw1', 'b_c_iw1']
@@ -0,0 +1,54 @@
+import pytest
+
+dem_cache = pytest.importorskip('hyp3_insar_isce.dem_cache')
+
+
+def test_tiles_for():
+    assert dem_cache.tiles_for(-122.5, 45.2, -121.1, 45.9) == [(45, -123), (45, -122)]
+    assert dem_cache.tiles_for(-0.5, -0.5, 0.5, 0.5) == [(-1, -1), (-1, 0), (0, -1), (0, 0)]
+
+
+def test_tile_name():
+    assert dem_cache.tile_name(45, -123) == 'N45W123'
+    assert dem_cache.tile_name(-1, 0) == 'S01E000'
+
+
+def test_source_tiles():
+    source = {
+        'name': 'SRTMGL1',
+        'epsg': 4326,
+        'tiles': {
+            'N45W123': dem_cache.box_wkt(-123, 45, -122, 46),
+            'N45W122': dem_cache.box_wkt(-122, 45, -121, 46),
+        },
+    }
+    assert dem_cache.source_tiles(source, 45, -123) == ['N45W123']
+    assert dem_cache.source_tiles(source, 44, -123) == []
+    assert dem_cache.source_tile_path('SRTMGL1', 'N45W123') == '/vsis3/asf-dem-east/SRTMGL1/N45W123.tif'
+
+
+def test_get_tile_fetches_once(tmp_path, monkeypatch):
+    fetched = []
+
+    def fetch_tile(source, lat, lon, path):
+        fetched.append((source['name'], lat, lon))
+        for name in dem_cache.envi_files(path):
+            with open(name, 'w') as f:
+                f.write('tile')
+
+    cache = dem_cache.DemCache(str(tmp_path), max_bytes=10)
+    monkeypatch.setattr(cache, '_fetch_tile', fetch_tile)
+    srtm = {'name': 'SRTMGL1'}
+
+    assert cache.get_tile(45, -123, srtm) == str(tmp_path / 'SRTMGL1_N45W123.dem')
+    assert cache.get_tile(45, -123, srtm) == str(tmp_path / 'SRTMGL1_N45W123.dem')
+    assert fetched == [('SRTMGL1', 45, -123)]
+
+    # Tiles of different sources are cached apart
+    cache.get_tile(45, -123, {'name': 'NED1'})
+    assert fetched[-1] == ('NED1', 45, -123)
+
+    # Over the quota, the least recently used tile is evicted
+    cache.get_tile(45, -122, srtm)
+    assert cache.lookup('SRTMGL1_N45W123') is None
+    assert cache.lookup('SRTMGL1_N45W122') == str(tmp_path / 'SRTMGL1_N45W122.dem')
@@ -3,6 +3,11 @@ def test_proc_insar_isce(script_runner):
     assert ret.success
 
 
+def test_calibrateS1StackPlan(script_runner):
+    ret = script_runner.run('calibrateS1StackPlan.py', '-h')
+    assert ret.success
+
+
 def test_procAllS1StackISCE(script_runner):
     ret = script_runner.run('procAllS1StackISCE.py', '-h')
     assert ret.success
@@ -16,3 +21,8 @@ def test_procS1ISCE(script_runner):
 def test_procS1StackISCE(script_runner):
     ret = script_runner.run('procS1StackISCE.py', '-h')
     assert ret.success
+
+
+def test_procS1StackWorker(script_runner):
+    ret = script_runner.run('procS1StackWorker.py', '-h')
+    assert ret.success
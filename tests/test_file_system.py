@@ -0,0 +1,23 @@
+import os
+
+from hyp3_insar_isce.file_system import link_or_copy, link_tree
+
+
+def test_link_or_copy(tmp_path):
+    src = tmp_path / 'phase.tif'
+    src.write_text('phase')
+    dst = tmp_path / 'PRODUCT_unw_phase.tif'
+    dst.write_text('stale')
+
+    link_or_copy(str(src), str(dst))
+    assert dst.read_text() == 'phase'
+    assert os.path.samefile(str(src), str(dst))
+
+
+def test_link_tree(tmp_path):
+    src = tmp_path / 'master'
+    (src / 'IW1').mkdir(parents=True)
+    (src / 'IW1' / 'burst_01.slc').write_text('burst')
+
+    link_tree(str(src), str(tmp_path / 'pair' / 'master'))
+    assert (tmp_path / 'pair' / 'master' / 'IW1' / 'burst_01.slc').read_text() == 'burst'
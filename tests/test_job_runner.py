@@ -0,0 +1,120 @@
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from hyp3_insar_isce import job_runner
+
+
+def test_connection_pool(tmp_path):
+    opened = []
+
+    def connect():
+        conn = sqlite3.connect(str(tmp_path / 'hyp3.db'), check_same_thread=False)
+        opened.append(conn)
+        return conn
+
+    pool = job_runner.ConnectionPool(connect)
+    with pool.connection() as conn:
+        conn.execute('CREATE TABLE jobs (id INTEGER)')
+        conn.execute('INSERT INTO jobs VALUES (1)')
+
+    # Connections are reused, and rolled back when the block fails
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            conn.execute('INSERT INTO jobs VALUES (2)')
+            raise ValueError()
+    with pool.connection() as conn:
+        assert conn.execute('SELECT id FROM jobs').fetchall() == [(1,)]
+    assert len(opened) == 1
+
+    pool.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        opened[0].execute('SELECT 1')
+
+
+def test_connection_pool_size(tmp_path):
+    pool = job_runner.ConnectionPool(lambda: sqlite3.connect(str(tmp_path / 'hyp3.db'), check_same_thread=False),
+                                     size=2)
+    held = threading.Event()
+    done = threading.Event()
+
+    def hold():
+        with pool.connection():
+            held.set()
+            done.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    with pool.connection() as conn:
+        assert conn.execute('SELECT 1').fetchone() == (1,)
+    done.set()
+    thread.join()
+
+
+def test_resource_throttle():
+    throttle = job_runner.ResourceThrottle(3, memory=10, scratch=100, poll_seconds=0.01)
+    assert throttle.try_reserve(0, 6, 50)
+    assert not throttle.try_reserve(1, 6, 10)
+    assert not throttle.try_reserve(1, 2, 60)
+    assert throttle.try_reserve(1, 4, 50)
+    assert throttle.reserved() == (10, 100)
+
+    throttle.release(0)
+    with throttle.reserve(2, 5, 20):
+        assert throttle.reserved() == (9, 70)
+    assert throttle.reserved() == (4, 50)
+
+    # A job is admitted when nothing else is reserved, even beyond the budgets
+    throttle.release(1)
+    assert throttle.try_reserve(0, 20, 200)
+
+
+def test_resource_throttle_shrink():
+    throttle = job_runner.ResourceThrottle(2, memory=10, scratch=100, poll_seconds=0.01)
+    assert throttle.try_reserve(0, 8, 50)
+    assert not throttle.try_reserve(1, 8, 10)
+
+    # Once a job's processing is done, another can use the memory it no longer needs
+    throttle.shrink(0, memory=1)
+    assert throttle.reserved() == (1, 50)
+    assert throttle.try_reserve(1, 8, 10)
+
+    # A reservation is never raised
+    throttle.shrink(0, memory=5, scratch=80)
+    assert throttle.reserved() == (9, 60)
+
+
+def test_resource_throttle_waits():
+    throttle = job_runner.ResourceThrottle(2, memory=10, scratch=100, poll_seconds=0.01)
+    assert throttle.try_reserve(0, 8, 10)
+    timer = threading.Timer(0.1, throttle.release, args=(0,))
+    timer.start()
+    with throttle.reserve(1, 8, 10):
+        assert throttle.reserved() == (8, 10)
+    timer.join()
+
+
+def test_slot_workdir(tmp_path):
+    with job_runner.slot_workdir(str(tmp_path), 1) as first, job_runner.slot_workdir(str(tmp_path), 1) as second:
+        assert first != second
+        assert os.path.basename(first).startswith('slot1-')
+        assert os.path.isdir(first) and os.path.isdir(second)
+    assert os.listdir(str(tmp_path)) == []
+
+
+def write_slot(directory, slot):
+    open(os.path.join(directory, str(slot)), 'w').close()
+
+
+def fail_slot(slot):
+    raise SystemExit(slot)
+
+
+def test_run_slots(tmp_path):
+    assert job_runner.run_slots(lambda slot: write_slot(str(tmp_path), slot), 2) == [0, 0]
+    assert sorted(os.listdir(str(tmp_path))) == ['0', '1']
+
+    assert job_runner.run_slots(fail_slot, 2) == [0, 1]
@@ -0,0 +1,53 @@
+import json
+
+from hyp3_insar_isce import metadata
+
+ISCE_LOG = """\
+2020-06-01 12:00:00,000 - isce.topsinsar.runPreprocessor - INFO - Preprocessing
+topsinsar.subset.Overlap.IW-1.start time = 2016-04-08 09:13:55.123456
+topsinsar.subset.Overlap.IW-1.start time = 2016-04-08 09:14:03.500000
+topsinsar.baseline.Bperp at midrange for first common burst = 42.7
+topsinsar.geocode.Azimuth looks = 3
+topsinsar.geocode.Range looks = 7
+"""
+
+ANNOTATION = """\
+<product>
+  <adsHeader><missionId>S1A</missionId></adsHeader>
+  <generalAnnotation>
+    <productInformation><platformHeading>-1.699e+02</platformHeading></productInformation>
+  </generalAnnotation>
+</product>
+"""
+
+
+def test_read_isce_log(tmp_path):
+    log_file = tmp_path / 'isce.log'
+    log_file.write_text(ISCE_LOG)
+    assert metadata.read_isce_log(str(log_file)) == {
+        'baseline': '42.7',
+        'utctime': 33243.5,
+        'range_looks': '7',
+        'azimuth_looks': '3',
+    }
+
+
+def test_get_heading(tmp_path):
+    annotation = tmp_path / 'S1A.SAFE' / 'annotation'
+    annotation.mkdir(parents=True)
+    (annotation / 's1a-iw1-slc-vv-20160408t091355-001.xml').write_text(ANNOTATION)
+    (annotation / 's1a-iw2-slc-vv-20160408t091355-002.xml').write_text('<product/>')
+    assert metadata.get_heading(str(tmp_path / 'S1A.SAFE')) == -169.9
+
+
+def test_write_metadata(tmp_path):
+    pair_metadata = {'baseline': '42.7', 'utctime': 33243.5, 'range_looks': '7', 'azimuth_looks': None,
+                     'heading': -169.9}
+    assert metadata.write_metadata(str(tmp_path / 'pair_iw1'), pair_metadata) == ['pair_iw1.txt', 'pair_iw1.json']
+
+    assert (tmp_path / 'pair_iw1.txt').read_text() == (
+        'baseline: 42.7\nutctime: 33243.5\nheading: -169.9\nrange looks: 7\nazimuth looks: \n'
+    )
+    assert json.loads((tmp_path / 'pair_iw1.json').read_text()) == {
+        'baseline': 42.7, 'utctime': 33243.5, 'range_looks': 7, 'azimuth_looks': None, 'heading': -169.9,
+    }
@@ -0,0 +1,71 @@
+import json
+import sys
+
+import pytest
+from hyp3lib import ExecuteError
+
+from hyp3_insar_isce.metrics import Metrics, execute
+
+
+def test_stage(tmp_path):
+    lines = []
+    metrics = Metrics(log=lines.append)
+    with metrics.stage('unwrap', pair='20160408_20160420', swath='iw1'):
+        execute('{} -c "bytearray(64 * 1024 ** 2)"'.format(sys.executable))
+
+    with pytest.raises(RuntimeError):
+        with metrics.stage('geocode', pair='20160408_20160420', swath='iw1'):
+            raise RuntimeError('topsApp failed')
+
+    unwrap, geocode = metrics.records
+    assert unwrap['stage'] == 'unwrap'
+    assert unwrap['pair'] == '20160408_20160420'
+    assert unwrap['wall_seconds'] > 0
+    assert unwrap['cpu_seconds'] > 0
+    assert unwrap['max_rss_bytes'] > 64 * 1024 ** 2
+    assert geocode['stage'] == 'geocode'
+    assert lines[0].startswith('Stage unwrap pair=20160408_20160420 swath=iw1 took ')
+
+
+def test_stage_peak_memory(tmp_path):
+    metrics = Metrics(log=lambda _: None)
+    with metrics.stage('unwrap'):
+        execute('{} -c "bytearray(512 * 1024 ** 2)"'.format(sys.executable))
+    # A later stage's peak is that of its own commands, not of every command run before it
+    with metrics.stage('geocode'):
+        execute('{} -c "pass"'.format(sys.executable))
+    with metrics.stage('metadata'):
+        pass
+
+    unwrap, geocode, metadata = metrics.records
+    assert unwrap['max_rss_bytes'] > 512 * 1024 ** 2
+    assert 0 < geocode['max_rss_bytes'] < unwrap['max_rss_bytes'] - 256 * 1024 ** 2
+    assert metadata['max_rss_bytes'] == 0
+
+
+def test_execute():
+    assert execute('echo hello') == 'hello\n'
+    with pytest.raises(ExecuteError, match='ERROR: no outputs'):
+        execute('echo "ERROR: no outputs"; echo done; exit 3')
+
+
+def test_write(tmp_path):
+    metrics = Metrics(log=lambda _: None)
+    metrics.extend([
+        {'stage': 'unwrap', 'pair': 'a', 'wall_seconds': 1.5, 'cpu_seconds': 3.0, 'max_rss_bytes': 10,
+         'read_bytes': 100, 'write_bytes': 50},
+        {'stage': 'unwrap', 'pair': 'a', 'wall_seconds': 2.5, 'cpu_seconds': 1.0, 'max_rss_bytes': 20,
+         'read_bytes': 0, 'write_bytes': 0},
+    ])
+    metrics.write(str(tmp_path / 'report'))
+
+    assert json.loads((tmp_path / 'report.json').read_text())['stages'] == metrics.records
+
+    prom = (tmp_path / 'report.prom').read_text().splitlines()
+    assert '# TYPE hyp3_insar_isce_stage_wall_seconds gauge' in prom
+    assert 'hyp3_insar_isce_stage_wall_seconds{stage="unwrap",pair="a"} 4.0' in prom
+    assert 'hyp3_insar_isce_stage_max_rss_bytes{stage="unwrap",pair="a"} 20' in prom
+
+    loaded = Metrics()
+    loaded.load(str(tmp_path / 'report.json'))
+    assert loaded.records == metrics.records
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+from hyp3lib import OrbitDownloadError
+
+from hyp3_insar_isce.orbit_cache import OrbitCache, parse_orbit_name
+
+GRANULE = 'S1A_IW_SLC__1SSV_20160408T091355_20160408T091430_010728_01001F_83EB.SAFE'
+POEORB = 'S1A_OPER_AUX_POEORB_OPOD_20160428T121507_V20160407T225943_20160409T005943.EOF'
+RESORB = 'S1A_OPER_AUX_RESORB_OPOD_20160408T120000_V20160408T083000_20160408T114000.EOF'
+OTHER = 'S1B_OPER_AUX_POEORB_OPOD_20160428T121507_V20160407T225943_20160409T005943.EOF'
+
+
+@pytest.fixture
+def source_dir(tmp_path):
+    source = tmp_path / 'source'
+    source.mkdir()
+    for name in (POEORB, RESORB, OTHER):
+        (source / name).write_text(name)
+    return str(source)
+
+
+def test_parse_orbit_name():
+    assert parse_orbit_name(POEORB) == {
+        'mission': 'S1A', 'type': 'AUX_POEORB', 'created': '20160428T121507',
+        'start': '20160407T225943', 'stop': '20160409T005943',
+    }
+    assert parse_orbit_name('list.csv') is None
+
+
+def test_link_reuses_precise_orbit(tmp_path, source_dir):
+    cache = OrbitCache(str(tmp_path / 'cache'), source_dir=source_dir)
+    pair_dir = tmp_path / 'pair'
+    pair_dir.mkdir()
+
+    orbit_file = cache.link(GRANULE, str(pair_dir))
+    assert os.path.basename(orbit_file) == POEORB
+    assert (pair_dir / POEORB).read_text() == POEORB
+
+    os.remove(os.path.join(source_dir, POEORB))
+    assert cache.link(GRANULE, str(tmp_path)) == str(tmp_path / POEORB)
+
+
+def test_prefetch_fetches_once(tmp_path, source_dir):
+    cache = OrbitCache(str(tmp_path / 'cache'), source_dir=source_dir)
+    granules = [GRANULE, GRANULE.replace('T091355', 'T091420')]
+
+    orbit_files = cache.prefetch(granules)
+    assert set(orbit_files.values()) == {os.path.join(cache.cache_dir, POEORB)}
+    assert sorted(os.listdir(cache.cache_dir)) == [POEORB, 'index.json', 'index.lock']
+
+
+def test_evicts_least_recently_used(tmp_path, source_dir):
+    cache = OrbitCache(str(tmp_path / 'cache'), max_bytes=len(POEORB), source_dir=source_dir)
+    cache.get(GRANULE)
+    cache.get(GRANULE.replace('S1A', 'S1B'))
+
+    assert cache.lookup(GRANULE) is None
+    assert os.listdir(cache.cache_dir).count(POEORB) == 0
+
+
+def test_missing_orbit(tmp_path, source_dir):
+    cache = OrbitCache(str(tmp_path / 'cache'), source_dir=source_dir)
+    with pytest.raises(OrbitDownloadError):
+        cache.get(GRANULE.replace('20160408', '20170408'))
+
+
+def test_prefetch_cached(tmp_path, source_dir):
+    cache = OrbitCache(str(tmp_path / 'cache'), source_dir=source_dir)
+    cache.get(GRANULE)
+    os.remove(os.path.join(source_dir, POEORB))
+
+    orbit_files = cache.prefetch([GRANULE, GRANULE.replace('T091355', 'T091420')])
+    assert set(orbit_files.values()) == {os.path.join(cache.cache_dir, POEORB)}
@@ -0,0 +1,56 @@
+import pytest
+
+from hyp3_insar_isce import pair_network
+
+DATES = ['20160408T091355', '20160420T091355', '20160502T091356', '20160514T091357', '20160526T091358']
+
+
+def write_annotation(safe, offset):
+    annotation = safe / 'annotation'
+    annotation.mkdir(parents=True)
+    orbits = ''.join(
+        '<orbit><time>2016-04-08T09:14:{:02d}.000000</time>'
+        '<position><x>7078137.0</x><y>{}</y><z>{}</z></position>'
+        '<velocity><x>0.0</x><y>7000.0</y><z>0.0</z></velocity></orbit>'.format(second, 7000.0 * (second - 30), offset)
+        for second in range(0, 60, 10)
+    )
+    points = ''.join(
+        '<geolocationGridPoint><latitude>{}</latitude><longitude>0.0</longitude><height>0.0</height>'
+        '</geolocationGridPoint>'.format(lat)
+        for lat in (-0.1, 0.1)
+    )
+    (annotation / 's1a-iw1-slc-vv-20160408t091355-001.xml').write_text(
+        '<product><generalAnnotation><orbitList>{}</orbitList></generalAnnotation>'
+        '<geolocationGrid><geolocationGridPointList>{}</geolocationGridPointList></geolocationGrid>'
+        '</product>'.format(orbits, points)
+    )
+    return str(safe)
+
+
+def test_estimate_baselines(tmp_path):
+    filenames = [write_annotation(tmp_path / 'a.SAFE', 0.0), write_annotation(tmp_path / 'b.SAFE', 100.0),
+                 write_annotation(tmp_path / 'c.SAFE', -50.0)]
+    baselines = pair_network.estimate_baselines(filenames, 1)
+    assert baselines == pytest.approx([0.0, 100.0, -50.0], abs=1e-3)
+
+
+def test_build_network_default():
+    # Each scene's nearest and second-nearest following scene
+    assert pair_network.build_network(DATES) == [(0, 1), (0, 2), (1, 2), (1, 3), (2, 3), (2, 4), (3, 4)]
+    assert pair_network.build_network(DATES[:2]) == [(0, 1)]
+    assert pair_network.build_network(DATES[:1]) == []
+
+
+def test_build_network_limits():
+    assert pair_network.build_network(DATES, connections=3, max_days=13) == [(0, 1), (1, 2), (2, 3), (3, 4)]
+
+    baselines = [0.0, 300.0, 10.0, 20.0, 250.0]
+    assert pair_network.build_network(DATES, baselines, max_bperp=100, connected=False) == [
+        (0, 2), (0, 3), (1, 4), (2, 3),
+    ]
+
+    # Scenes 1 and 4 are joined to the rest of the network with its shortest pair
+    assert pair_network.build_network(DATES, baselines, max_bperp=100) == [(0, 2), (0, 3), (1, 4), (2, 3), (3, 4)]
+
+    with pytest.raises(ValueError):
+        pair_network.build_network(DATES, max_bperp=100)
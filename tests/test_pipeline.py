@@ -0,0 +1,54 @@
+import threading
+import time
+
+import pytest
+
+from hyp3_insar_isce.pipeline import run_pipeline
+
+
+def test_run_pipeline_limits_and_order():
+    running = {'io': 0, 'cpu': 0}
+    peak = {'io': 0, 'cpu': 0}
+    lock = threading.Lock()
+
+    def stage(name, delay):
+        def func(item):
+            with lock:
+                running[name] += 1
+                peak[name] = max(peak[name], running[name])
+            time.sleep(delay[item])
+            with lock:
+                running[name] -= 1
+        return func
+
+    finished = []
+    run_pipeline(
+        [0, 1, 2, 3], [('io', stage('io', [0.03, 0.0, 0.02, 0.0])), ('cpu', stage('cpu', [0.0, 0.02, 0.0, 0.01]))],
+        {'io': 2, 'cpu': 1}, finish=finished.append,
+    )
+
+    assert finished == [0, 1, 2, 3]
+    assert peak == {'io': 2, 'cpu': 1}
+
+
+def test_run_pipeline_finishes_other_items_before_raising():
+    def fail(item):
+        if item == 1:
+            raise ValueError(item)
+
+    finished = []
+    with pytest.raises(ValueError):
+        run_pipeline([0, 1, 2], [('first', fail), ('second', lambda item: None)], {}, finish=finished.append)
+    assert finished == [0, 2]
+
+
+def test_run_pipeline_finishes_other_items_after_finish_fails():
+    def finish(item):
+        if item == 0:
+            raise ValueError(item)
+        finished.append(item)
+
+    finished = []
+    with pytest.raises(ValueError):
+        run_pipeline([0, 1, 2], [('first', lambda item: None)], {}, finish=finish)
+    assert finished == [1, 2]
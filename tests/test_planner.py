@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from hyp3_insar_isce import planner
+from hyp3_insar_isce.metrics import REPORT_NAME
+
+MODEL = {stage: {'scratch_bytes': 10.0, 'memory_bytes': 2.0, 'cpu_seconds': 0.001} for stage in planner.STAGES}
+
+
+def swath(count=4, south=35.0):
+    return {
+        'samples': 100, 'lines_per_burst': 10,
+        'bursts': [{'south': south + 0.2 * burst, 'north': south + 0.2 * (burst + 1), 'west': 10.0, 'east': 11.0}
+                   for burst in range(count)],
+    }
+
+
+def test_pair_pixels():
+    assert planner.pair_pixels(swath(), swath()) == (4, 4000)
+    assert planner.pair_pixels(swath(), swath(count=3)) == (3, 3000)
+    assert planner.pair_pixels(swath(), swath(), roi=(35.25, 35.35, 10.2, 10.4)) == (1, 1000)
+
+
+def test_plan_stack():
+    pairs = [planner.plan_pair('a_b', 'iw1', swath(), swath(), model=MODEL),
+             planner.plan_pair('b_c', 'iw1', swath(), swath(count=2), stages=('unwrap', 'geocode', 'geotiff'),
+                               model=MODEL)]
+    assert pairs[0]['stages']['preprocess'] == {'scratch_bytes': 40000, 'memory_bytes': 8000, 'cpu_seconds': 4.0}
+    assert pairs[0]['scratch_bytes'] == 200000
+    assert pairs[0]['memory_bytes'] == 8000
+    assert pairs[1]['scratch_bytes'] == 60000
+    assert pairs[1]['cpu_seconds'] == pytest.approx(6.0)
+
+    plan = planner.plan_stack(pairs)
+    assert plan['stages']['preprocess']['scratch_bytes'] == 40000
+    assert plan['stages']['unwrap']['scratch_bytes'] == 60000
+    assert plan['scratch_bytes'] == 260000
+    assert plan['memory_bytes'] == 8000
+    assert plan['cpu_seconds'] == pytest.approx(26.0)
+
+    assert planner.plan_stack([])['scratch_bytes'] == 0
+
+
+def test_fit_plan():
+    plan = planner.plan_stack([planner.plan_pair(name, 'iw1', swath(), swath(), model=MODEL)
+                               for name in ('a_b', 'a_c', 'b_c')])
+    assert planner.fit_plan(plan, free_scratch=10 ** 6, free_memory=10 ** 6) == plan['pairs']
+    assert planner.fit_plan(plan, free_scratch=450000, free_memory=10 ** 6) == plan['pairs'][:2]
+    assert planner.fit_plan(plan, free_scratch=450000, free_memory=10 ** 6, reclaimed=True) == plan['pairs']
+    # Reclaimed pairs still need room for every pair in flight at once
+    assert planner.fit_plan(plan, free_scratch=450000, free_memory=10 ** 6, reclaimed=True,
+                            in_flight=2) == plan['pairs']
+    assert planner.fit_plan(plan, free_scratch=450000, free_memory=10 ** 6, reclaimed=True,
+                            in_flight=3) == plan['pairs'][:2]
+
+    with pytest.raises(ValueError):
+        planner.fit_plan(plan, free_scratch=10 ** 6, free_memory=7999)
+    with pytest.raises(ValueError):
+        planner.fit_plan(plan, free_scratch=199999, free_memory=10 ** 6)
+
+
+def test_calibrate(tmp_path):
+    plan = planner.plan_stack([planner.plan_pair('a_b', 'iw1', swath(), swath(), model=MODEL),
+                               planner.plan_pair('b_c', 'iw1', swath(count=2), swath(count=2), model=MODEL)])
+    planner.write_plan(plan, str(tmp_path / planner.PLAN_FILE))
+    records = [
+        {'stage': 'unwrap', 'pair': 'a_b', 'swath': 'iw1', 'wall_seconds': 1.0, 'cpu_seconds': 8.0,
+         'max_rss_bytes': 40000, 'read_bytes': 0, 'write_bytes': 4000},
+        {'stage': 'unwrap', 'pair': 'b_c', 'swath': 'iw1', 'wall_seconds': 1.0, 'cpu_seconds': 4.0,
+         'max_rss_bytes': 40000, 'read_bytes': 0, 'write_bytes': 2000},
+        {'stage': 'dem', 'wall_seconds': 1.0, 'cpu_seconds': 1.0, 'max_rss_bytes': 0, 'read_bytes': 0,
+         'write_bytes': 0},
+    ]
+    with open(str(tmp_path / (REPORT_NAME + '.json')), 'w') as f:
+        json.dump({'stages': records}, f)
+
+    model = planner.calibrate([str(tmp_path)])
+    assert model['unwrap'] == {'scratch_bytes': 1.0, 'memory_bytes': 20.0, 'cpu_seconds': 0.002}
+    assert model['preprocess'] == planner.DEFAULT_MODEL['preprocess']
+
+    model_file = str(tmp_path / planner.MODEL_FILE)
+    with open(model_file, 'w') as f:
+        json.dump({'stages': {'unwrap': model['unwrap']}}, f)
+    assert planner.load_model(model_file) == model
+    assert planner.load_model() == planner.DEFAULT_MODEL
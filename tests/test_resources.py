@@ -0,0 +1,21 @@
+from hyp3_insar_isce import resources
+
+
+def test_split_cpus():
+    cpus = resources.available_cpus()
+    sets = resources.split_cpus(1)
+    assert len(sets) == 1
+    assert len(sets[0]) == cpus
+
+    sets = resources.split_cpus(cpus)
+    assert all(len(cpu_set) == 1 for cpu_set in sets)
+    assert len({cpu for cpu_set in sets for cpu in cpu_set}) == cpus
+
+    sets = resources.split_cpus(cpus + 1)
+    assert all(len(cpu_set) == cpus for cpu_set in sets)
+
+
+def test_admit_workers():
+    assert resources.admit_workers(0) == 1
+    assert resources.admit_workers(10 ** 6) == resources.available_cpus()
+    assert resources.admit_workers(2, memory_per_worker=10 ** 15) == 1
@@ -0,0 +1,138 @@
+import gzip
+import json
+import os
+import threading
+
+import pytest
+
+from hyp3_insar_isce import checkpoint, retention
+
+
+def write(path, size=100):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'\0' * size)
+
+
+def test_load_policy(tmp_path):
+    assert retention.load_policy() == retention.DEFAULT_POLICY
+
+    policy_file = tmp_path / 'policy.json'
+    policy_file.write_text(json.dumps({'merge': {'action': 'compress', 'keep': ['*.xml']}}))
+    policy = retention.load_policy(str(policy_file))
+    assert policy['merge'] == {'action': 'compress', 'keep': ['*.xml']}
+    assert policy['preprocess'] == retention.DEFAULT_POLICY['preprocess']
+
+    policy_file.write_text(json.dumps({'merge': {'action': 'shred'}}))
+    with pytest.raises(ValueError):
+        retention.load_policy(str(policy_file))
+    policy_file.write_text(json.dumps({'unwrap': {'action': 'delete'}}))
+    with pytest.raises(ValueError):
+        retention.load_policy(str(policy_file))
+
+
+def test_reclaim(tmp_path):
+    isce_dir = tmp_path / 'pair' / 'iw1'
+    write(isce_dir / 'master' / 'IW1' / 'burst_01.slc')
+    write(isce_dir / 'fine_coreg' / 'IW1' / 'burst_01.slc')
+    write(isce_dir / 'fine_coreg' / 'IW1.xml')
+    write(isce_dir / 'merged' / 'filt_topophase.unw', size=1000)
+    write(isce_dir / 'merged' / 'phase.tif')
+    write(isce_dir / 'topsApp.xml')
+    write(isce_dir / 'S1A_OPER_AUX_POEORB.EOF')
+    # Products collected into PRODUCT are links to the files in merged
+    (tmp_path / 'PRODUCT').mkdir()
+    os.link(str(isce_dir / 'merged' / 'phase.tif'), str(tmp_path / 'PRODUCT' / 'pair_iw1_unw_phase.tif'))
+
+    policy = retention.load_policy()
+    policy['coregistration']['keep'] = ['*.xml']
+    policy['merge']['action'] = retention.COMPRESS
+
+    freed = retention.reclaim(str(isce_dir), policy)
+
+    assert not (isce_dir / 'master').exists()
+    assert not (isce_dir / 'fine_coreg' / 'IW1').exists()
+    assert (isce_dir / 'fine_coreg' / 'IW1.xml').exists()
+    with gzip.open(str(isce_dir / 'merged' / 'filt_topophase.unw.gz')) as f:
+        assert f.read() == b'\0' * 1000
+    assert not (isce_dir / 'merged' / 'filt_topophase.unw').exists()
+    assert (isce_dir / 'merged' / 'phase.tif').exists()
+    assert (isce_dir / 'topsApp.xml').exists()
+    assert (isce_dir / 'S1A_OPER_AUX_POEORB.EOF').exists()
+    assert freed > 200
+
+    # Reclaiming again finds nothing left to free
+    assert retention.reclaim(str(isce_dir), policy) == 0
+
+
+def test_reclaim_rewinds_checkpoint(tmp_path):
+    isce_dir = tmp_path / 'pair' / 'iw1'
+    write(isce_dir / 'master' / 'IW1' / 'burst_01.slc')
+    write(isce_dir / 'fine_coreg' / 'IW1' / 'burst_01.slc')
+    write(isce_dir / 'merged' / 'phase.tif')
+    checkpoint.mark_stage(str(isce_dir), 'geocode')
+    checkpoint.mark_collected(str(isce_dir), ['pair_iw1_unw_phase.tif'])
+
+    # Collecting the pair again only needs merged
+    policy = retention.load_policy()
+    policy['merge']['action'] = retention.KEEP
+    retention.reclaim(str(isce_dir), policy)
+    assert checkpoint.load(str(isce_dir))['stage'] == 'geocode'
+
+    # Without merged, the pair resumes after the last stage whose outputs are left
+    policy = retention.load_policy()
+    policy['preprocess']['action'] = retention.KEEP
+    retention.reclaim(str(isce_dir), policy)
+    assert checkpoint.load(str(isce_dir)) == {'stage': 'preprocess', 'products': ['pair_iw1_unw_phase.tif']}
+
+
+def test_reclaim_keeps_linked_data(tmp_path):
+    isce_dir = tmp_path / 'pair' / 'iw1'
+    write(tmp_path / 'scene_cache' / 'burst_01.slc')
+    (isce_dir / 'master').mkdir(parents=True)
+    os.link(str(tmp_path / 'scene_cache' / 'burst_01.slc'), str(isce_dir / 'master' / 'burst_01.slc'))
+
+    assert retention.reclaim(str(isce_dir)) == 0
+    assert not (isce_dir / 'master').exists()
+    assert (tmp_path / 'scene_cache' / 'burst_01.slc').exists()
+
+
+def test_disk_watermark(tmp_path):
+    free = [0]
+    watermark = retention.DiskWatermark(str(tmp_path), min_free=10, poll_seconds=0.01, log=lambda message: None)
+    watermark.free = lambda: free[0]
+
+    # The first pair is admitted however little disk is free
+    watermark.admit()
+    assert watermark.in_flight == 1
+
+    admitted = threading.Event()
+    thread = threading.Thread(target=lambda: (watermark.admit(), admitted.set()))
+    thread.start()
+    assert not admitted.wait(0.05)
+
+    free[0] = 10
+    assert admitted.wait(1)
+    thread.join()
+    assert watermark.in_flight == 2
+
+    watermark.release()
+    watermark.release()
+    watermark.release()
+    assert watermark.in_flight == 0
+
+
+def test_disk_watermark_max_in_flight(tmp_path):
+    watermark = retention.DiskWatermark(str(tmp_path), min_free=0, max_in_flight=2, poll_seconds=0.01,
+                                        log=lambda message: None)
+    watermark.admit()
+    watermark.admit()
+
+    admitted = threading.Event()
+    thread = threading.Thread(target=lambda: (watermark.admit(), admitted.set()))
+    thread.start()
+    assert not admitted.wait(0.05)
+
+    watermark.release()
+    assert admitted.wait(1)
+    thread.join()
+    assert watermark.in_flight == 2
@@ -0,0 +1,76 @@
+import os
+
+from hyp3_insar_isce import scene_cache
+
+TEMPLATE = os.path.join(os.path.dirname(scene_cache.__file__), 'etc', 'isceS1template.xml')
+REFERENCE = 'S1A_IW_SLC__1SSV_20160408T091355_20160408T091430_010728_01001F_83EB.SAFE'
+SECONDARY = 'S1A_IW_SLC__1SSV_20160420T091355_20160420T091423_010903_010569_F9CE.SAFE'
+
+
+def make_stack(base, length):
+    with open(TEMPLATE) as f:
+        template = f.read()
+
+    pair_dirs = []
+    for x in range(length):
+        for y in (x + 1, x + 2):
+            if y < length:
+                pair_dir = str(base / 'scene{}_scene{}'.format(x, y) / 'iw1')
+                os.makedirs(pair_dir)
+                with open(os.path.join(pair_dir, 'topsApp.xml'), 'w') as f:
+                    f.write(template.replace(REFERENCE, 'scene{}'.format(x)).replace(SECONDARY, 'scene{}'.format(y)))
+                pair_dirs.append(pair_dir)
+    return sorted(pair_dirs)
+
+
+def preprocess(pair_dir):
+    for name in ('master', 'slave', 'PICKLE'):
+        os.makedirs(os.path.join(pair_dir, name))
+        with open(os.path.join(pair_dir, name, 'IW1.xml'), 'w') as f:
+            f.write(pair_dir)
+
+
+def test_store_and_seed(tmp_path):
+    pair_dirs = make_stack(tmp_path, 4)
+    cache_dir = str(tmp_path / 'cache')
+    assert scene_cache.select_preprocess_pairs(cache_dir, pair_dirs) == pair_dirs
+
+    for pair_dir in pair_dirs:
+        preprocess(pair_dir)
+        scene_cache.store(cache_dir, pair_dir)
+    assert scene_cache.select_preprocess_pairs(cache_dir, pair_dirs) == []
+
+    # The same pairs in another stack are seeded from the cache
+    other_dirs = make_stack(tmp_path / 'other', 4)
+    assert scene_cache.select_preprocess_pairs(cache_dir, other_dirs) == []
+    assert all(scene_cache.seed(cache_dir, pair_dir) for pair_dir in other_dirs)
+
+    # scene0_scene2 gets scene0 as extracted by scene0_scene1, and its own preprocess state
+    with open(os.path.join(other_dirs[1], 'master', 'IW1.xml')) as f:
+        assert f.read() == pair_dirs[0]
+    with open(os.path.join(other_dirs[1], 'PICKLE', 'IW1.xml')) as f:
+        assert f.read() == pair_dirs[1]
+
+
+def test_preprocess_state_is_not_shared(tmp_path):
+    pair_dirs = make_stack(tmp_path, 3)
+    cache_dir = str(tmp_path / 'cache')
+    assert len({scene_cache.pair_keys(pair_dir)[1] for pair_dir in pair_dirs}) == len(pair_dirs)
+
+    # Every scene of scene0_scene2 is cached, but not the state of a pair of those scenes
+    for pair_dir in (pair_dirs[0], pair_dirs[2]):
+        preprocess(pair_dir)
+        scene_cache.store(cache_dir, pair_dir)
+    assert scene_cache.select_preprocess_pairs(cache_dir, pair_dirs) == [pair_dirs[1]]
+    assert not scene_cache.seed(cache_dir, pair_dirs[1])
+
+
+def test_seed_requires_every_scene(tmp_path):
+    pair_dirs = make_stack(tmp_path, 3)
+    cache_dir = str(tmp_path / 'cache')
+
+    preprocess(pair_dirs[0])
+    scene_cache.store(cache_dir, pair_dirs[0])
+
+    assert not scene_cache.seed(cache_dir, pair_dirs[1])
+    assert not os.path.exists(os.path.join(pair_dirs[1], 'master'))
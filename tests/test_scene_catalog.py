@@ -0,0 +1,107 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from hyp3_insar_isce import scene_catalog
+
+ANX_TIME = datetime(2016, 4, 8, 8, 46, 0)
+BURST_SECONDS = scene_catalog.BURST_CYCLE_SECONDS
+
+
+def write_safe(directory, date, mission='S1A', orbit='010000', anx_time=ANX_TIME, lon=10.0):
+    start = datetime.strptime(date, '%Y%m%dT%H%M%S')
+    name = '{}_IW_SLC__1SDV_{}_{}_{}_000001_0001.SAFE'.format(mission, date, date, orbit)
+    safe = directory / name
+    (safe / 'annotation').mkdir(parents=True)
+    (safe / 'manifest.safe').write_text(
+        '<xfdu:XFDU xmlns:xfdu="urn:ccsds:schema:xfdu:1" xmlns:s1="http://www.esa.int/safe/sentinel-1.0/sentinel-1">'
+        '<s1:ascendingNodeTime>{}</s1:ascendingNodeTime></xfdu:XFDU>'.format(anx_time.isoformat() + '.000000')
+    )
+    for swath in scene_catalog.SWATHS:
+        bursts = ''.join(
+            '<burst><azimuthTime>{}</azimuthTime></burst>'.format(
+                (start + timedelta(seconds=BURST_SECONDS * burst)).isoformat(timespec='microseconds')
+            )
+            for burst in range(3)
+        )
+        points = ''.join(
+            '<geolocationGridPoint><line>{}</line><pixel>{}</pixel><latitude>{}</latitude>'
+            '<longitude>{}</longitude></geolocationGridPoint>'.format(line, pixel, 35.0 + line / 1000,
+                                                                      lon + swath + pixel / 1000)
+            for line in (0, 500, 1000) for pixel in (0, 500)
+        )
+        (safe / 'annotation' / 's1a-iw{}-slc-vv-{}-00{}.xml'.format(swath, date.lower(), swath)).write_text(
+            '<product><generalAnnotation><productInformation><platformHeading>-12.5</platformHeading>'
+            '</productInformation></generalAnnotation><swathTiming><burstList>{}</burstList></swathTiming>'
+            '<geolocationGrid><geolocationGridPointList>{}</geolocationGridPointList></geolocationGrid>'
+            '</product>'.format(bursts, points)
+        )
+    return safe
+
+
+def test_update(tmp_path):
+    first = write_safe(tmp_path, '20160420T091355')
+    second = write_safe(tmp_path, '20160408T091355')
+    (tmp_path / 'not_a_scene.SAFE').mkdir()
+    conn = scene_catalog.connect(str(tmp_path / 'catalog.db'))
+
+    assert scene_catalog.update(conn, str(tmp_path)) == sorted([first.name, second.name])
+    assert scene_catalog.get_file_list(conn) == ([second.name, first.name], ['20160408T091355', '20160420T091355'])
+
+    # Unchanged scenes aren't read again
+    assert scene_catalog.update(conn, str(tmp_path)) == []
+
+    third = write_safe(tmp_path, '20160502T091355', lon=11.0)
+    os.utime(str(first), (0, 0))
+    os.rename(str(second), str(tmp_path / 'moved'))
+    assert scene_catalog.update(conn, str(tmp_path)) == sorted([first.name, third.name])
+    assert scene_catalog.get_file_list(conn)[0] == [first.name, third.name]
+
+
+def test_get_swath(tmp_path):
+    safe = write_safe(tmp_path, '20160408T091355', orbit='010848')
+    conn = scene_catalog.connect(str(tmp_path / 'catalog.db'))
+
+    # Scenes are indexed when they're first looked up
+    swath = scene_catalog.get_swath(conn, str(safe), 2)
+    assert swath['annotation'] == str(safe / 'annotation' / 's1a-iw2-slc-vv-20160408t091355-002.xml')
+    assert swath['heading'] == -12.5
+    assert (swath['south'], swath['north'], swath['west'], swath['east']) == pytest.approx((35.0, 36.0, 12.0, 12.5))
+    assert swath['footprint'] == [[35.0, 12.0], [36.0, 12.0], [36.0, 12.5], [35.0, 12.5]]
+
+    ids = [burst['id'] for burst in swath['bursts']]
+    assert ids == list(range(ids[0], ids[0] + 3))
+    assert swath['bursts'][0]['azimuth_time'] == '2016-04-08T09:13:55'
+
+    # The same bursts of a later pass have the same IDs
+    later = write_safe(tmp_path, '20160420T091355', orbit='011023', anx_time=ANX_TIME + timedelta(days=12))
+    assert [burst['id'] for burst in scene_catalog.get_swath(conn, str(later), 2)['bursts']] == ids
+
+    row = conn.execute('SELECT relative_orbit FROM scenes WHERE name = ?', (safe.name,)).fetchone()
+    assert row['relative_orbit'] == 101
+
+    with pytest.raises(ValueError):
+        scene_catalog.get_swath(conn, str(safe), 4)
+
+
+def test_read_scene_rejects_other_products(tmp_path):
+    with pytest.raises(ValueError):
+        scene_catalog.read_scene(
+            str(tmp_path / 'S1A_IW_GRDH_1SDV_20160408T091355_20160408T091422_010848_0103BC_1234.SAFE')
+        )
+
+
+def test_get_swath_through_link(tmp_path, monkeypatch):
+    safe = write_safe(tmp_path, '20160408T091355')
+    conn = scene_catalog.connect(str(tmp_path / 'catalog.db'))
+    scene_catalog.update(conn, str(tmp_path))
+
+    # A subswath's working directory links the SAFE files the catalog already indexed, and needn't read them again
+    (tmp_path / 'iw2').mkdir()
+    link = tmp_path / 'iw2' / safe.name
+    os.symlink(str(safe), str(link))
+    monkeypatch.setattr(scene_catalog, 'read_scene', lambda safe: pytest.fail('read {} again'.format(safe)))
+
+    swath = scene_catalog.get_swath(conn, str(link), 2)
+    assert swath['annotation'] == str(link / 'annotation' / 's1a-iw2-slc-vv-20160408t091355-002.xml')
@@ -0,0 +1,36 @@
+from hyp3_insar_isce import stack_state
+
+
+def test_stack_state(tmp_path):
+    state_file = str(tmp_path / stack_state.STATE_FILE)
+    state = stack_state.load(state_file)
+    assert state == {'scenes': [], 'pairs': {}}
+
+    filenames = ['/data/S1A_20160408.SAFE', '/data/S1A_20160420.SAFE']
+    assert stack_state.new_scenes(state, filenames) == filenames
+    stack_state.add_scenes(state, filenames)
+    assert stack_state.new_scenes(state, filenames + ['/data/S1B_20160502.SAFE']) == ['/data/S1B_20160502.SAFE']
+
+    stack_state.add_pair(state, '20160408_20160420', 'iw1', filenames[0], filenames[1])
+    assert not stack_state.is_processed(state, '20160408_20160420', 'iw1')
+
+    product_dir = tmp_path / 'PRODUCT'
+    product_dir.mkdir()
+    (product_dir / '20160408_20160420_iw1.txt').write_text('baseline: 42.7\n')
+    stack_state.record_products(state, '20160408_20160420', 'iw1', ['20160408_20160420_iw1.txt'], str(product_dir))
+    assert stack_state.is_processed(state, '20160408_20160420', 'iw1')
+    assert not stack_state.is_processed(state, '20160408_20160420', 'iw2')
+
+    stack_state.save(state, state_file)
+    assert stack_state.load(state_file) == {
+        'scenes': ['S1A_20160408.SAFE', 'S1A_20160420.SAFE'],
+        'pairs': {
+            '20160408_20160420/iw1': {
+                'reference': 'S1A_20160408.SAFE',
+                'secondary': 'S1A_20160420.SAFE',
+                'products': {
+                    '20160408_20160420_iw1.txt': '2697682ef002eb4a815d29f3697a21a6feda9167aefe11479961320f124dc580',
+                },
+            },
+        },
+    }
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from hyp3_insar_isce import scene_cache, topsapp_xml
+
+
+def test_render(tmp_path):
+    template = topsapp_xml.TopsAppTemplate(unwrap=True, gbb=(35.0, 36.5, -120.0, -119.1),
+                                           roi=(35.1, 36.2, -119.9, -119.2), dem=str(tmp_path / 'stack_dem.dem'))
+    xml_file = str(tmp_path / 'topsApp.xml')
+    template.write(xml_file, 2, str(tmp_path / 'A&B.SAFE'), str(tmp_path / 'C.SAFE'), 'a.EOF', 'c.EOF')
+
+    with open(xml_file) as f:
+        assert f.readline() == topsapp_xml.HEADER
+    inputs = scene_cache.read_pair_inputs(xml_file)
+    assert inputs['master'] == {
+        'output directory': 'master', 'swath number': '2', 'safe': str(tmp_path / 'A&B.SAFE'), 'orbit file': 'a.EOF',
+        'region of interest': '[35.1, 36.2, -119.9, -119.2]',
+    }
+    assert inputs['slave']['safe'] == str(tmp_path / 'C.SAFE')
+    assert inputs['slave']['orbit file'] == 'c.EOF'
+
+    with open(xml_file) as f:
+        text = f.read()
+    assert '<property name="do unwrap">True</property>' in text
+    assert '<property name="geocode bounding box">[35.0, 36.5, -120.0, -119.1]</property>' in text
+    assert '<property name="demfilename">{}</property>'.format(tmp_path / 'stack_dem.dem') in text
+
+
+def test_overrides():
+    template = topsapp_xml.TopsAppTemplate(overrides={'range_looks': 5, 'azimuth_looks': None, 'unwrapper': 'icu',
+                                                      'filter_strength': 0.8})
+    text = template.render(1, 'A.SAFE', 'B.SAFE', 'a.EOF', 'b.EOF')
+    assert '<property name="do unwrap">False</property>' in text
+    assert '<property name="unwrapper name">icu</property>' in text
+    assert 'snaphu_mcf' not in text
+    assert '<property name="range looks">5</property>' in text
+    assert '<property name="filter strength">0.8</property>' in text
+    assert 'azimuth looks' not in text
+
+    with pytest.raises(ValueError):
+        topsapp_xml.TopsAppTemplate(overrides={'looks': 5})
+
+
+def test_write_pair_xmls(tmp_path):
+    orbit_dir = tmp_path / 'orbits'
+    orbit_dir.mkdir()
+    orbit_files = {}
+    for scene in ('scene0', 'scene1', 'scene2'):
+        orbit_files[scene] = str(orbit_dir / (scene + '.EOF'))
+        open(orbit_files[scene], 'w').close()
+
+    pairs = [(str(tmp_path / 'scene{}_scene{}'.format(x, y)), 'scene{}'.format(x), 'scene{}'.format(y))
+             for x, y in ((0, 1), (0, 2), (1, 2))]
+    xml_files = topsapp_xml.write_pair_xmls(topsapp_xml.TopsAppTemplate(), pairs, 3, orbit_files)
+    assert xml_files == [os.path.join(pair_dir, 'iw3', 'topsApp.xml') for pair_dir, _, _ in pairs]
+
+    inputs = scene_cache.read_pair_inputs(xml_files[1])
+    assert os.path.basename(inputs['master']['safe']) == 'scene0'
+    assert inputs['slave']['orbit file'] == 'scene2.EOF'
+    assert inputs['slave']['swath number'] == '3'
+    assert sorted(os.listdir(os.path.join(pairs[1][0], 'iw3'))) == ['scene0.EOF', 'scene2.EOF', 'topsApp.xml']
+
+    # Setting up the same pairs again is harmless
+    assert topsapp_xml.write_pair_xmls(topsapp_xml.TopsAppTemplate(), pairs, 3, orbit_files) == xml_files
@@ -0,0 +1,77 @@
+import hashlib
+import os
+
+import pytest
+
+from hyp3_insar_isce.upload import MultipartUpload, Tee
+
+
+class DirectoryS3:
+    """A stand-in for an S3 client that keeps objects and parts in a local directory"""
+    def __init__(self, root, failures=()):
+        self.root = root
+        self.failures = list(failures)
+        self.uploaded = []
+
+    def create_multipart_upload(self, Bucket, Key):
+        os.makedirs(os.path.join(self.root, Bucket, 'uploads', 'upload-1'))
+        return {'UploadId': 'upload-1'}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentMD5):
+        if PartNumber in self.failures:
+            self.failures.remove(PartNumber)
+            raise ConnectionError('connection reset')
+        self.uploaded.append(PartNumber)
+        with open(os.path.join(self.root, Bucket, 'uploads', UploadId, str(PartNumber)), 'wb') as f:
+            f.write(Body)
+        return {'ETag': hashlib.md5(Body).hexdigest()}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        with open(os.path.join(self.root, Bucket, Key), 'wb') as f:
+            for part in MultipartUpload['Parts']:
+                with open(os.path.join(self.root, Bucket, 'uploads', UploadId, str(part['PartNumber'])), 'rb') as p:
+                    f.write(p.read())
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted = UploadId
+
+
+def test_multipart_upload(tmp_path):
+    client = DirectoryS3(str(tmp_path), failures=[2])
+    data = os.urandom(2500)
+
+    with open(str(tmp_path / 'product.zip'), 'wb') as f:
+        with MultipartUpload(client, 'bucket', 'product.zip', part_size=1000, workers=2) as upload:
+            stream = Tee(f, upload)
+            for start in range(0, len(data), 300):
+                stream.write(data[start:start + 300])
+
+    assert (tmp_path / 'bucket' / 'product.zip').read_bytes() == data
+    assert (tmp_path / 'product.zip').read_bytes() == data
+    assert sorted(client.uploaded) == [1, 2, 3]
+    assert upload.size == len(data)
+    assert upload.sha256.hexdigest() == hashlib.sha256(data).hexdigest()
+
+
+def test_multipart_upload_aborts(tmp_path):
+    client = DirectoryS3(str(tmp_path), failures=[1, 1, 1])
+    with pytest.raises(ConnectionError):
+        with MultipartUpload(client, 'bucket', 'product.zip', part_size=1000, retries=3) as upload:
+            upload.write(b'product')
+
+    assert client.aborted == 'upload-1'
+    assert not (tmp_path / 'bucket' / 'product.zip').exists()
+
+
+def test_multipart_upload_aborts_on_any_error(tmp_path):
+    client = DirectoryS3(str(tmp_path))
+
+    def complete_multipart_upload(**kwargs):
+        raise ValueError('malformed request')
+    client.complete_multipart_upload = complete_multipart_upload
+
+    with pytest.raises(ValueError):
+        with MultipartUpload(client, 'bucket', 'product.zip', part_size=1000) as upload:
+            upload.write(b'product')
+
+    assert client.aborted == 'upload-1'
@@ -0,0 +1,146 @@
+import time
+
+import pytest
+
+from hyp3_insar_isce import work_queue
+
+
+def make_tasks(count):
+    return [
+        {'pair_dir': 'pair{}'.format(i), 'swath': 'iw1', 'inputs': {'reference': 'scene{}'.format(i)},
+         'outputs': ['phase.tif']}
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def queue_file(tmp_path):
+    queue_file = str(tmp_path / work_queue.QUEUE_FILE)
+    conn = work_queue.connect(queue_file)
+    work_queue.publish(conn, make_tasks(3), settings={'stack_dir': str(tmp_path), 'swath': 1})
+    conn.close()
+    return queue_file
+
+
+def test_publish(queue_file):
+    conn = work_queue.connect(queue_file)
+    assert work_queue.settings(conn) == {'stack_dir': str(queue_file.rsplit('/', 1)[0]), 'swath': 1}
+    assert work_queue.counts(conn) == {work_queue.PENDING: 3}
+
+    task = work_queue.tasks(conn)[0]
+    assert task['pair_dir'] == 'pair0'
+    assert task['inputs'] == {'reference': 'scene0'}
+    assert task['outputs'] == ['phase.tif']
+
+    # Publishing again keeps the tasks as they are
+    task = work_queue.claim(conn, 'worker')
+    work_queue.publish(conn, make_tasks(4))
+    assert work_queue.counts(conn) == {work_queue.PENDING: 3, work_queue.RUNNING: 1}
+
+
+def test_claim_and_complete(queue_file):
+    conn = work_queue.connect(queue_file)
+    first = work_queue.claim(conn, 'a')
+    second = work_queue.claim(conn, 'b')
+    assert (first['pair_dir'], second['pair_dir']) == ('pair0', 'pair1')
+    assert first['worker'] == 'a'
+    assert first['attempts'] == 1
+
+    # Only the worker holding the lease can report on a task
+    with pytest.raises(work_queue.LeaseLost):
+        work_queue.complete(conn, first, 'b')
+    work_queue.complete(conn, first, 'a')
+    assert work_queue.renew(conn, second, 'b')
+    assert work_queue.counts(conn) == {work_queue.DONE: 1, work_queue.RUNNING: 1, work_queue.PENDING: 1}
+
+
+def test_expired_lease(queue_file):
+    conn = work_queue.connect(queue_file)
+    task = work_queue.claim(conn, 'a', lease_seconds=-1)
+    claimed = work_queue.claim(conn, 'b')
+    assert claimed['pair_dir'] == task['pair_dir']
+    assert claimed['attempts'] == 2
+
+    # The worker that lost the lease can't finish the task any more
+    with pytest.raises(work_queue.LeaseLost):
+        work_queue.complete(conn, task, 'a')
+    work_queue.complete(conn, claimed, 'b')
+
+
+def test_fail_retries(queue_file):
+    conn = work_queue.connect(queue_file)
+    for attempt in range(1, 3):
+        task = work_queue.claim(conn, 'a')
+        assert (task['pair_dir'], task['attempts']) == ('pair0', attempt)
+        work_queue.fail(conn, task, 'a', 'boom', max_attempts=2)
+
+    failed = work_queue.tasks(conn, work_queue.FAILED)
+    assert [(task['pair_dir'], task['error']) for task in failed] == [('pair0', 'boom')]
+
+    # Publishing a failed task again gives it another set of attempts
+    work_queue.publish(conn, make_tasks(1))
+    assert work_queue.tasks(conn)[0]['state'] == work_queue.PENDING
+    assert work_queue.tasks(conn)[0]['attempts'] == 0
+
+
+def test_release(queue_file):
+    conn = work_queue.connect(queue_file)
+    task = work_queue.claim(conn, 'a')
+    assert work_queue.release(conn, task, 'a')
+    assert work_queue.claim(conn, 'b')['attempts'] == 1
+
+
+def test_work(queue_file):
+    ran = []
+
+    def run(task, lease):
+        ran.append(task['pair_dir'])
+        if task['pair_dir'] == 'pair1':
+            raise OSError('no outputs')
+
+    assert work_queue.work_concurrently(queue_file, run, 2, max_attempts=2, poll_seconds=0.1) == 2
+    assert sorted(ran) == ['pair0', 'pair1', 'pair1', 'pair2']
+
+    conn = work_queue.connect(queue_file)
+    assert work_queue.counts(conn) == {work_queue.DONE: 2, work_queue.FAILED: 1}
+    assert work_queue.tasks(conn, work_queue.FAILED)[0]['error'] == 'OSError: no outputs'
+
+
+def test_work_renews_lease(queue_file):
+    conn = work_queue.connect(queue_file)
+    for _ in range(2):
+        work_queue.complete(conn, work_queue.claim(conn, 'setup'), 'setup')
+
+    def run(task, lease):
+        time.sleep(1)
+        # The lease is renewed while the task runs, so nobody else can claim it
+        assert work_queue.claim(work_queue.connect(queue_file), 'other') is None
+
+    assert work_queue.work(queue_file, run, worker='a', lease_seconds=0.3, poll_seconds=0.1) == 1
+    task = work_queue.tasks(conn)[2]
+    assert (task['state'], task['worker'], task['attempts']) == (work_queue.DONE, 'a', 1)
+
+
+def test_work_stops_when_lease_lost(queue_file):
+    conn = work_queue.connect(queue_file)
+    for _ in range(2):
+        work_queue.complete(conn, work_queue.claim(conn, 'setup'), 'setup')
+    stages = []
+    claimed = []
+
+    def run(task, lease):
+        if not claimed:
+            claimed.append(True)
+            # Another worker claims the task once its lease has expired
+            conn.execute('UPDATE tasks SET lease_expires = 0')
+            work_queue.claim(conn, 'other', lease_seconds=0.5)
+        for stage in ('preprocess', 'filter'):
+            time.sleep(0.2)
+            lease.check()
+            stages.append((task['attempts'], stage))
+
+    # The first attempt stops before its next stage, and its worker takes the task again once the other's lease expires
+    assert work_queue.work(queue_file, run, worker='a', lease_seconds=0.3, poll_seconds=0.1) == 1
+    assert stages == [(3, 'preprocess'), (3, 'filter')]
+    task = work_queue.tasks(conn)[2]
+    assert (task['state'], task['worker'], task['attempts']) == (work_queue.DONE, 'a', 3)